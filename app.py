@@ -30,6 +30,14 @@ from temporary_week2_main import app as week2_app
 from temporary_main_q16_22 import app as week3_app
 from week4_main import app as week4_app
 from week5_main import app as week5_app
+from database import db_models
+from database.db_config import get_pool_stats
+from database.content_cache import week_content_cache
+from conversation_store import get_conversation_store_stats
+from session_guard import session_guard
+from llm_gateway import llm_gateway
+from completeness_validators import completeness_validators
+from validation_policies import validation_policies
 
 
 def create_root_app():
@@ -55,6 +63,31 @@ def create_root_app():
     def health():
         return {"status": "ok"}
 
+    @root.route('/health/db')
+    def health_db():
+        """Report shared connection pool occupancy/wait times and content cache stats."""
+        return jsonify({
+            "pool": get_pool_stats(),
+            "content_cache": week_content_cache.stats()
+        })
+
+    @root.route('/health/sessions')
+    def health_sessions():
+        """Report conversation state store counters per week and session lock/idempotency counters."""
+        return jsonify({
+            "stores": get_conversation_store_stats(),
+            "guard": session_guard.stats()
+        })
+
+    @root.route('/health/llm')
+    def health_llm():
+        """Report LLM call counts, retries, latency and token usage per call type."""
+        return jsonify({
+            **llm_gateway.stats(),
+            "local_validation": completeness_validators.stats(),
+            "validation_policies": validation_policies.stats(),
+        })
+
     @root.route('/api/elevenlabs/test', methods=['GET'])
     def test_elevenlabs_key():
         """Test endpoint to verify ElevenLabs API key is working."""
@@ -505,6 +538,13 @@ def create_root_app():
 
 root_app = create_root_app()
 
+# Warm the shared week content cache for every week in a single database round trip
+try:
+    preloaded_weeks = db_models.preload_week_content(week1_app)
+    print(f"[Content] Preloaded week content for weeks: {preloaded_weeks}")
+except Exception as e:
+    print(f"[Content] WARNING: Could not preload week content: {e}")
+
 # Mount each week's Flask app under its own prefix so their routes remain unchanged
 application = DispatcherMiddleware(root_app, {
     '/week1': week1_app,
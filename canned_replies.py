@@ -0,0 +1,110 @@
+"""
+Canned Replies for When the LLM Is Unavailable
+
+When the circuit breaker for NOVA's responses is open and no fallback model is
+configured (or the fallback fails too), learners still get a sensible message
+and can keep moving through the week. Canned replies are stored per question
+as system_prompts rows:
+
+    canned_scenario_<n>    Reply while the question's scenario is SCENARIO_<n>,
+                           e.g. canned_scenario_1
+    canned_reply           Reply for any other scenario (or unclassified questions)
+    classifier_fallback    Scenario to assume (e.g. SCENARIO_2) when the
+                           question's classifier can't be reached
+
+Replies may use {name}.
+"""
+
+import re
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+DEFAULT_REPLY_TYPE = "canned_reply"
+CLASSIFIER_FALLBACK_TYPE = "classifier_fallback"
+
+_SCENARIO = re.compile(r"SCENARIO_[A-Z0-9]+")
+
+
+def canned_prompt_type(scenario: Optional[str]) -> str:
+    """Prompt type holding the canned reply for a scenario, e.g. SCENARIO_1 -> canned_scenario_1."""
+    match = _SCENARIO.search((scenario or "").upper())
+    return f"canned_{match.group(0).lower()}" if match else DEFAULT_REPLY_TYPE
+
+
+class CannedReplies:
+    """Canned replies and fallback scenarios for every week, loaded from SYSTEM_PROMPTS."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (week, question) -> {prompt_type: reply}
+        self._replies: Dict[Tuple[int, int], Dict[str, str]] = {}
+        # (week, question) -> scenario
+        self._scenarios: Dict[Tuple[int, int], str] = {}
+        self.served: Dict[str, int] = {}
+
+    def load_week(self, week: int, system_prompts: Dict[int, Dict[str, str]]) -> int:
+        """
+        (Re)load a week's canned replies from its SYSTEM_PROMPTS dict.
+
+        Args:
+            week: Week number
+            system_prompts: {question_number: {prompt_type: prompt_text}}
+
+        Returns:
+            Number of questions that have canned replies
+        """
+        replies = {}
+        scenarios = {}
+        for qnum, prompts in (system_prompts or {}).items():
+            if not isinstance(prompts, dict):
+                continue
+            question_replies = {
+                prompt_type: prompt_text for prompt_type, prompt_text in prompts.items()
+                if prompt_type.startswith("canned_") and prompt_text
+            }
+            if question_replies:
+                replies[(week, int(qnum))] = question_replies
+            scenario = (prompts.get(CLASSIFIER_FALLBACK_TYPE) or "").strip().upper()
+            if scenario:
+                scenarios[(week, int(qnum))] = scenario
+        with self._lock:
+            for key in [key for key in self._replies if key[0] == week]:
+                del self._replies[key]
+            for key in [key for key in self._scenarios if key[0] == week]:
+                del self._scenarios[key]
+            self._replies.update(replies)
+            self._scenarios.update(scenarios)
+        if replies or scenarios:
+            print(f"[LLM] Loaded canned replies for week {week}: questions {sorted(q for _, q in replies)}, "
+                  f"fallback scenarios for {sorted(q for _, q in scenarios)}")
+        return len(replies)
+
+    def reply(self, week: int, question: Optional[int], scenario: Optional[str] = None,
+              name: str = "") -> Optional[str]:
+        """Return the canned reply for the question's current scenario, if one is stored."""
+        replies = self._replies.get((week, question))
+        if not replies:
+            return None
+        reply = replies.get(canned_prompt_type(scenario)) or replies.get(DEFAULT_REPLY_TYPE)
+        return reply.replace("{name}", name or "") if reply else None
+
+    def scenario(self, week: Optional[int], question: Optional[int]) -> Optional[str]:
+        """Return the scenario to assume when the question's classifier is unavailable, if any."""
+        return self._scenarios.get((week, question))
+
+    def count_served(self, kind: str):
+        with self._lock:
+            self.served[kind] = self.served.get(kind, 0) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Return how many canned replies are loaded and how often they were served."""
+        with self._lock:
+            return {
+                'questions_with_replies': len(self._replies),
+                'fallback_scenarios': len(self._scenarios),
+                'served': dict(sorted(self.served.items())),
+            }
+
+
+# Global instance shared by every week app in the process
+canned_replies = CannedReplies()
@@ -0,0 +1,148 @@
+"""
+Circuit Breakers for LLM Calls
+
+During a provider brownout every LLM call waits for its full timeout (and its
+retries) before failing, so workers pile up behind requests that are not going
+to succeed. A CircuitBreaker watches the recent outcomes of one call type on
+one model and trips when too many of them fail or are slow:
+
+    closed      calls go through; outcomes are recorded over a sliding window
+    open        calls are refused at once (the gateway routes them to the
+                fallback model or a canned reply) until the cooldown passes
+    half_open   one probe call is let through; success closes the breaker,
+                failure opens it again
+
+Thresholds are shared by all breakers and set with environment variables:
+LLM_BREAKER_WINDOW (seconds), LLM_BREAKER_MIN_CALLS, LLM_BREAKER_ERROR_RATE,
+LLM_BREAKER_SLOW_RATE and LLM_BREAKER_COOLDOWN (seconds). LLM_BREAKER=0
+disables them.
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from typing import Any, Dict, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class CircuitOpenError(Exception):
+    """The breaker for this call type and model is open; the call was not made."""
+
+
+class CircuitBreaker:
+    """Error-rate and slow-call-rate breaker over a sliding time window."""
+
+    def __init__(self, name: str, slow_seconds: float, window: Optional[float] = None,
+                 min_calls: Optional[int] = None, error_rate: Optional[float] = None,
+                 slow_rate: Optional[float] = None, cooldown: Optional[float] = None):
+        self.name = name
+        self.slow_seconds = slow_seconds
+        self.window = _env_float('LLM_BREAKER_WINDOW', 60) if window is None else window
+        self.min_calls = _env_int('LLM_BREAKER_MIN_CALLS', 10) if min_calls is None else min_calls
+        self.error_rate = _env_float('LLM_BREAKER_ERROR_RATE', 0.5) if error_rate is None else error_rate
+        self.slow_rate = _env_float('LLM_BREAKER_SLOW_RATE', 0.8) if slow_rate is None else slow_rate
+        self.cooldown = _env_float('LLM_BREAKER_COOLDOWN', 30) if cooldown is None else cooldown
+        self.enabled = os.getenv('LLM_BREAKER', '1') == '1'
+        self.state = CLOSED
+        # (recorded_at, failed, slow) for calls within the window
+        self._outcomes: deque = deque()
+        self._opened_at = 0.0
+        self._probe_started: Optional[float] = None
+        self._lock = threading.Lock()
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go through now (False while open; one probe at a time when half-open)."""
+        if not self.enabled:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN and now - self._opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                self._probe_started = None
+            if self.state == HALF_OPEN:
+                # A probe that never reported back (e.g. non-provider error) doesn't block forever
+                if self._probe_started is None or now - self._probe_started >= self.cooldown:
+                    self._probe_started = now
+                    return True
+            if self.state == CLOSED:
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, latency: float, failed: Optional[bool]):
+        """
+        Record a finished call.
+
+        Args:
+            latency: Seconds the call took
+            failed: True for provider failures (timeouts, 5xx, rate limits),
+                False for successes, None for outcomes that say nothing about
+                the provider's health
+        """
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if failed is None:
+                    self._probe_started = None
+                elif failed:
+                    self._open(now, "probe failed")
+                else:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                    print(f"[LLM] Circuit {self.name} closed (probe succeeded)")
+                return
+            if failed is None or self.state != CLOSED:
+                return
+            self._outcomes.append((now, failed, latency >= self.slow_seconds))
+            while self._outcomes and now - self._outcomes[0][0] > self.window:
+                self._outcomes.popleft()
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for _, f, _ in self._outcomes if f)
+            slow = sum(1 for _, _, s in self._outcomes if s)
+            if failures / calls >= self.error_rate:
+                self._open(now, f"{failures}/{calls} calls failed")
+            elif slow / calls >= self.slow_rate:
+                self._open(now, f"{slow}/{calls} calls slower than {self.slow_seconds:g}s")
+
+    def _open(self, now: float, reason: str):
+        self.state = OPEN
+        self._opened_at = now
+        self._probe_started = None
+        self._outcomes.clear()
+        self.trips += 1
+        print(f"[LLM] Circuit {self.name} opened: {reason}; retrying in {self.cooldown:g}s")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return the breaker's state and counters for monitoring."""
+        with self._lock:
+            return {
+                'state': self.state if self.enabled else 'disabled',
+                'recent_calls': len(self._outcomes),
+                'recent_failures': sum(1 for _, f, _ in self._outcomes if f),
+                'trips': self.trips,
+                'rejected': self.rejected,
+            }
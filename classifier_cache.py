@@ -0,0 +1,229 @@
+"""
+Scenario Classifier Result Cache
+
+Every question starts with a scenario classifier call, and many learners give
+the same short answer shapes ("yes", "no", "I don't know", "I didn't do the
+homework"). ClassifierCache remembers the scenario for each
+
+    (week, question, classifier prompt hash, normalized answer)
+
+so a repeated answer skips the LLM round trip:
+- an in-memory LRU bounded by CLASSIFIER_CACHE_MAX_ENTRIES, entries expire
+  after CLASSIFIER_CACHE_TTL seconds
+- an optional persistent SQLite tier (CLASSIFIER_CACHE_BACKEND=sqlite) shared
+  by all workers on the host and kept across restarts
+
+The prompt hash covers the classifier prompt, model and temperature, so editing
+a prompt naturally stops serving old results. Only answers up to
+CLASSIFIER_CACHE_MAX_CHARS (after normalization) are cached - long free-text
+answers practically never repeat. Keys are hashed, so the persistent tier does
+not store learners' text.
+"""
+
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+DEFAULT_SQLITE_PATH = "classifier_cache.db"
+
+_WHITESPACE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = re.compile(r"^[\s\"'.,!?;:()\-]+|[\s\"'.,!?;:()\-]+$")
+_QUOTES = str.maketrans({"‘": "'", "’": "'", "“": '"', "”": '"'})
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def normalize_answer(text: str) -> str:
+    """Lower-case, unify quotes, collapse whitespace and trim surrounding punctuation."""
+    text = (text or "").translate(_QUOTES).lower()
+    text = _WHITESPACE.sub(" ", text)
+    return _EDGE_PUNCTUATION.sub("", text)
+
+
+def prompt_hash(classifier_prompt: str, model: str = "", temperature: Optional[float] = None) -> str:
+    """Short hash identifying a classifier prompt version (including model and temperature)."""
+    material = f"{model}\x00{temperature}\x00{classifier_prompt}"
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()[:16]
+
+
+class SQLiteClassifierTier:
+    """Persistent second tier: key -> scenario in a WAL-mode SQLite table."""
+
+    def __init__(self, db_path: str = DEFAULT_SQLITE_PATH, busy_timeout_ms: int = 5000):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS classifier_cache (
+                cache_key TEXT PRIMARY KEY,
+                scenario TEXT NOT NULL,
+                stored_at REAL NOT NULL
+            )
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection (SQLite connections can't be shared across threads)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=self.busy_timeout_ms / 1000)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, cache_key: str, max_age: float) -> Optional[str]:
+        row = self._connect().execute(
+            "SELECT scenario FROM classifier_cache WHERE cache_key = ? AND stored_at >= ?",
+            (cache_key, time.time() - max_age)
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, cache_key: str, scenario: str):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO classifier_cache (cache_key, scenario, stored_at) VALUES (?, ?, ?)",
+            (cache_key, scenario, time.time())
+        )
+
+
+class ClassifierCache:
+    """LRU + TTL cache of scenario classifications with an optional persistent tier."""
+
+    def __init__(self, max_entries: Optional[int] = None, ttl: Optional[float] = None,
+                 max_chars: Optional[int] = None, backend: Optional[str] = None):
+        self.max_entries = _env_int('CLASSIFIER_CACHE_MAX_ENTRIES', 10000) if max_entries is None else max_entries
+        self.ttl = _env_float('CLASSIFIER_CACHE_TTL', 86400) if ttl is None else ttl
+        self.max_chars = _env_int('CLASSIFIER_CACHE_MAX_CHARS', 200) if max_chars is None else max_chars
+        backend = (backend or os.getenv('CLASSIFIER_CACHE_BACKEND', 'memory')).lower()
+        self.persistent = None
+        if backend == 'sqlite' and self.enabled:
+            db_path = os.getenv('CLASSIFIER_CACHE_DB_PATH', DEFAULT_SQLITE_PATH)
+            self.persistent = SQLiteClassifierTier(db_path)
+            print(f"[Classifier] Persistent classifier cache at {db_path}")
+        # cache_key -> (stored_at, scenario)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    def make_key(self, week: Optional[int], question: Optional[int], classifier_prompt: str,
+                 user_message: str, model: str = "", temperature: Optional[float] = None) -> Optional[str]:
+        """
+        Build the cache key for a classification, or None if it shouldn't be cached.
+
+        Args:
+            week: Week number (None if the caller doesn't know it)
+            question: Question number
+            classifier_prompt: The question's classifier prompt
+            user_message: The learner's answer
+            model: Model used for classification
+            temperature: Sampling temperature used for classification
+        """
+        if not self.enabled:
+            return None
+        normalized = normalize_answer(user_message)
+        if not normalized or len(normalized) > self.max_chars:
+            with self._lock:
+                self.skipped += 1
+            return None
+        material = f"{week}\x00{question}\x00{prompt_hash(classifier_prompt, model, temperature)}\x00{normalized}"
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, cache_key: Optional[str]) -> Optional[str]:
+        """Return the cached scenario for a key from make_key(), checking memory then the persistent tier."""
+        if cache_key is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl:
+                    self._entries.move_to_end(cache_key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[cache_key]
+
+        if self.persistent is not None:
+            try:
+                scenario = self.persistent.get(cache_key, self.ttl)
+            except sqlite3.Error as e:
+                print(f"[Classifier] WARNING: persistent cache read failed: {e}")
+                scenario = None
+            if scenario is not None:
+                with self._lock:
+                    self.persistent_hits += 1
+                self._remember(cache_key, scenario)
+                return scenario
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, cache_key: Optional[str], scenario: str):
+        """Store a classifier result under a key from make_key()."""
+        if cache_key is None or not scenario:
+            return
+        self._remember(cache_key, scenario)
+        if self.persistent is not None:
+            try:
+                self.persistent.put(cache_key, scenario)
+            except sqlite3.Error as e:
+                print(f"[Classifier] WARNING: persistent cache write failed: {e}")
+
+    def _remember(self, cache_key: str, scenario: str):
+        with self._lock:
+            self._entries[cache_key] = (time.monotonic(), scenario)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every in-memory entry (e.g. after classifier prompts were edited in place)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return size and hit-rate counters for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.persistent_hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'persistent': self.persistent is not None,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'persistent_hits': self.persistent_hits,
+                'misses': self.misses,
+                'skipped': self.skipped,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits + self.persistent_hits) / lookups, 3) if lookups else 0.0,
+            }
+
+
+# Global instance shared by every week app in the process
+classifier_cache = ClassifierCache()
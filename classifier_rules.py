@@ -0,0 +1,167 @@
+"""
+Rule-Based Fast Path for Scenario Classification
+
+Plenty of first answers need no LLM to classify: a plain "yes" or "no", an
+empty reply, "I didn't do the homework". Each question can declare rules in a
+system_prompts row with prompt_type 'classifier_rules', next to its
+'classifier' prompt. The prompt text is a JSON list, evaluated in order:
+
+    [
+        {"name": "yes", "match": "yes_no", "value": "yes", "scenario": "SCENARIO_1"},
+        {"name": "no", "match": "yes_no", "value": "no", "scenario": "SCENARIO_2"},
+        {"name": "skipped", "match": "keywords", "any": ["didn't do", "did not do"],
+         "max_words": 8, "scenario": "SCENARIO_3"},
+        {"name": "blank", "match": "empty", "scenario": "SCENARIO_3"},
+        {"name": "unsure", "match": "regex", "pattern": "(i )?(don't|do not) know", "scenario": "SCENARIO_3"}
+    ]
+
+Match types:
+- yes_no: the whole normalized answer is a yes (or no) word/phrase
+- empty: nothing left after normalization
+- keywords: the answer contains one of `any`, and has at most `max_words`
+  words (default 6) - longer answers usually say more than the keyword
+- regex: the pattern matches the whole normalized answer
+
+Rules only fire when confident; otherwise the LLM classifier runs as before.
+Each rule counts how many LLM classifications it saved.
+"""
+
+import re
+import json
+import threading
+from typing import Any, Dict, List, Optional
+
+from classifier_cache import normalize_answer
+
+YES_VALUES = {"yes", "y", "yeah", "yep", "sure", "absolutely", "yes i have", "yes i did"}
+NO_VALUES = {"no", "n", "nope", "nah", "not really", "not yet", "no i haven't", "no i have not"}
+
+DEFAULT_KEYWORD_MAX_WORDS = 6
+MATCH_TYPES = ("yes_no", "empty", "keywords", "regex")
+
+
+def normalize_yes_no(message: str) -> Optional[bool]:
+    """Return True for yes, False for no, or None if unclear."""
+    cleaned = normalize_answer(message)
+    if not cleaned:
+        return None
+    if cleaned in YES_VALUES:
+        return True
+    if cleaned in NO_VALUES:
+        return False
+    return None
+
+
+class ClassifierRule:
+    """One declarative rule mapping an answer shape to a scenario."""
+
+    __slots__ = ('name', 'match', 'scenario', 'value', 'keywords', 'max_words', 'pattern')
+
+    def __init__(self, spec: Dict[str, Any], index: int = 0):
+        self.match = spec.get('match')
+        if self.match not in MATCH_TYPES:
+            raise ValueError(f"unknown match type {self.match!r}")
+        self.scenario = str(spec['scenario']).strip().upper()
+        self.name = spec.get('name') or f"{self.match}_{index}"
+        value = spec.get('value', 'yes')
+        self.value = value is True or str(value).lower() in ('yes', 'true')
+        self.keywords = [normalize_answer(k) for k in spec.get('any', []) if normalize_answer(k)]
+        self.max_words = int(spec.get('max_words', DEFAULT_KEYWORD_MAX_WORDS))
+        self.pattern = re.compile(spec['pattern']) if self.match == 'regex' else None
+        if self.match == 'keywords' and not self.keywords:
+            raise ValueError("keywords rule needs a non-empty 'any' list")
+
+    def matches(self, normalized: str, raw: str) -> bool:
+        if self.match == 'empty':
+            return not normalized
+        if not normalized:
+            return False
+        if self.match == 'yes_no':
+            return normalize_yes_no(raw) is self.value
+        if self.match == 'keywords':
+            if len(normalized.split()) > self.max_words:
+                return False
+            return any(keyword in normalized for keyword in self.keywords)
+        return self.pattern.fullmatch(normalized) is not None
+
+
+def parse_rules(rules_text: str) -> List[ClassifierRule]:
+    """Parse a classifier_rules prompt (JSON list). Raises ValueError on bad input."""
+    specs = json.loads(rules_text)
+    if not isinstance(specs, list):
+        raise ValueError("classifier_rules must be a JSON list")
+    return [ClassifierRule(spec, index) for index, spec in enumerate(specs)]
+
+
+class ClassifierRuleSet:
+    """Rules for every (week, question), with per-rule counts of LLM calls saved."""
+
+    def __init__(self):
+        self._rules: Dict[tuple, List[ClassifierRule]] = {}
+        self._lock = threading.Lock()
+        self._saved: Dict[str, int] = {}
+        self.evaluated = 0
+        self.fallthrough = 0
+
+    def load_week(self, week: int, system_prompts: Dict[int, Dict[str, str]]) -> int:
+        """
+        (Re)load the rules for a week from its SYSTEM_PROMPTS dict.
+
+        Args:
+            week: Week number
+            system_prompts: {question_number: {prompt_type: prompt_text}}
+
+        Returns:
+            Number of questions that have rules
+        """
+        loaded = {}
+        for qnum, prompts in (system_prompts or {}).items():
+            rules_text = prompts.get('classifier_rules') if isinstance(prompts, dict) else None
+            if not rules_text:
+                continue
+            try:
+                loaded[(week, int(qnum))] = parse_rules(rules_text)
+            except (ValueError, KeyError, TypeError, re.error) as e:
+                print(f"[Classifier] WARNING: ignoring invalid classifier_rules for week {week} Q{qnum}: {e}")
+        with self._lock:
+            for key in [key for key in self._rules if key[0] == week]:
+                del self._rules[key]
+            self._rules.update(loaded)
+        if loaded:
+            print(f"[Classifier] Loaded rules for week {week}: questions {sorted(q for _, q in loaded)}")
+        return len(loaded)
+
+    def classify(self, week: Optional[int], question: Optional[int], user_message: str) -> Optional[str]:
+        """Return the scenario of the first matching rule, or None to fall back to the LLM."""
+        rules = self._rules.get((week, question))
+        if not rules:
+            return None
+        normalized = normalize_answer(user_message)
+        for rule in rules:
+            if rule.matches(normalized, user_message):
+                with self._lock:
+                    self.evaluated += 1
+                    counter = f"week{week}.q{question}.{rule.name}"
+                    self._saved[counter] = self._saved.get(counter, 0) + 1
+                print(f"[Classifier] Week {week} Q{question} rule '{rule.name}' -> {rule.scenario}")
+                return rule.scenario
+        with self._lock:
+            self.evaluated += 1
+            self.fallthrough += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        """Return how many classifications each rule saved."""
+        with self._lock:
+            saved = sum(self._saved.values())
+            return {
+                'questions_with_rules': len(self._rules),
+                'evaluated': self.evaluated,
+                'saved': saved,
+                'fallthrough': self.fallthrough,
+                'saved_by_rule': dict(sorted(self._saved.items())),
+            }
+
+
+# Global instance shared by every week app in the process
+classifier_rules = ClassifierRuleSet()
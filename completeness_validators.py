@@ -0,0 +1,205 @@
+"""
+Local Completeness Validators
+
+validate_completeness asks the LLM whether the learner has fully answered the
+current question. Some of those checks are structural and can be decided
+locally: four numbered homework answers, a plain Yes/No, a skill category
+mentioned. A question can register local validators here; they run before the
+LLM validator and only return a verdict when they are confident, otherwise the
+LLM check runs as before.
+
+A validator is any callable taking the learner's responses for the question
+and returning (is_complete, missing_items) or None:
+
+    completeness_validators.register(1, 2, NumberedParts(4))
+    completeness_validators.register(3, 17, CategoryCoverage(SKILL_CATEGORIES, extract_skill_categories_from_text))
+"""
+
+import re
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from classifier_cache import normalize_answer
+from classifier_rules import normalize_yes_no
+
+Verdict = Tuple[bool, str]
+Validator = Callable[[List[str]], Optional[Verdict]]
+
+# "1." / "1)" / "1:" / "1 -" at the start of a line or after whitespace. A part runs to the
+# next marker or the end of the line, so one-line answers ("1. at work 2. anxious ...") split too
+_NUMBERED_PART = re.compile(
+    r"(?:^|(?<=\s))(\d{1,2})\s*[.):\-]\s*(?!\d{1,2}\s*[.):\-])((?:(?!\s+\d{1,2}\s*[.):\-])[^\n])*)", re.MULTILINE
+)
+
+
+class NumberedParts:
+    """
+    Complete when answers numbered 1..count are all present (in one or several responses).
+
+    >>> NumberedParts(4)(["1. at work 2. anxious 3. bad 4. went home"])
+    (True, 'None')
+    >>> NumberedParts(4)(["1) work, 2) anxious", "3) bad\\n4) home"])
+    (True, 'None')
+    >>> NumberedParts(4)(["1. at work 2. anxious 3. bad"]) is None
+    True
+    """
+
+    def __init__(self, count: int, min_chars: int = 2):
+        self.count = count
+        self.min_chars = min_chars
+
+    def __call__(self, user_responses: List[str]) -> Optional[Verdict]:
+        found = set()
+        for response in user_responses:
+            for number, text in _NUMBERED_PART.findall(response or ""):
+                if len(text.strip()) >= self.min_chars:
+                    found.add(int(number))
+        if all(n in found for n in range(1, self.count + 1)):
+            return True, "None"
+        return None  # Unnumbered answers still need the LLM to judge
+
+
+class CategoryCoverage:
+    """Complete when the responses mention at least `min_covered` of the given categories."""
+
+    def __init__(self, categories: Iterable[str], extract: Optional[Callable[[str], Set[str]]] = None,
+                 min_covered: Optional[int] = None):
+        self.categories = list(categories)
+        self.extract = extract or self._extract
+        self.min_covered = len(self.categories) if min_covered is None else min_covered
+
+    def _extract(self, text: str) -> Set[str]:
+        text_lower = text.lower()
+        return {category for category in self.categories if category in text_lower}
+
+    def __call__(self, user_responses: List[str]) -> Optional[Verdict]:
+        covered = set()
+        for response in user_responses:
+            covered |= self.extract(response or "")
+        if len(covered) >= self.min_covered:
+            return True, "None"
+        return None
+
+
+class MinLength:
+    """Incomplete below `min_words` words; optionally complete from `complete_words` words."""
+
+    def __init__(self, min_words: int, missing: str, complete_words: Optional[int] = None):
+        self.min_words = min_words
+        self.missing = missing
+        self.complete_words = complete_words
+
+    def __call__(self, user_responses: List[str]) -> Optional[Verdict]:
+        words = sum(len(normalize_answer(response).split()) for response in user_responses)
+        if words < self.min_words:
+            return False, self.missing
+        if self.complete_words is not None and words >= self.complete_words:
+            return True, "None"
+        return None
+
+
+class KeywordPresence:
+    """Complete when any response contains one of the keywords."""
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords = [normalize_answer(keyword) for keyword in keywords if normalize_answer(keyword)]
+
+    def __call__(self, user_responses: List[str]) -> Optional[Verdict]:
+        for response in user_responses:
+            normalized = normalize_answer(response)
+            if any(keyword in normalized for keyword in self.keywords):
+                return True, "None"
+        return None
+
+
+class YesNoAnswer:
+    """Complete when the latest response is a clear Yes or No."""
+
+    def __call__(self, user_responses: List[str]) -> Optional[Verdict]:
+        if user_responses and normalize_yes_no(user_responses[-1]) is not None:
+            return True, "None"
+        return None
+
+
+VALIDATOR_TYPES = {
+    'numbered_parts': lambda spec: NumberedParts(int(spec['count']), int(spec.get('min_chars', 2))),
+    'category_coverage': lambda spec: CategoryCoverage(spec['categories'], min_covered=spec.get('min_covered')),
+    'min_length': lambda spec: MinLength(int(spec['min_words']), spec.get('missing', 'A more complete response'),
+                                         spec.get('complete_words')),
+    'keywords': lambda spec: KeywordPresence(spec['any']),
+    'yes_no': lambda spec: YesNoAnswer(),
+}
+
+
+def build_validator(spec: Dict) -> Validator:
+    """
+    Build a validator from a declarative spec, e.g. {"validator": "numbered_parts", "count": 4}.
+
+    Raises:
+        ValueError: Unknown validator type or missing fields
+    """
+    factory = VALIDATOR_TYPES.get(spec.get('validator'))
+    if factory is None:
+        raise ValueError(f"unknown validator {spec.get('validator')!r}")
+    try:
+        return factory(spec)
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"invalid {spec['validator']} validator: {e}") from e
+
+
+class ValidatorRegistry:
+    """Local validators per (week, question), tried in registration order."""
+
+    def __init__(self):
+        self._validators: Dict[Tuple[int, int], List[Validator]] = {}
+        self._lock = threading.Lock()
+        self.decided: Dict[str, int] = {}
+        self.fallbacks = 0
+
+    def register(self, week: int, question: int, *validators: Validator):
+        """Add local validators for a question."""
+        self._validators.setdefault((week, question), []).extend(validators)
+
+    def validate(self, week: int, question: int, user_responses: List[str],
+                 count: bool = True) -> Optional[Verdict]:
+        """
+        Run the question's local validators.
+
+        Args:
+            count: Record the outcome in the decided/fallback counters (False for a
+                dry run, e.g. building the prompt for a fused call)
+
+        Returns:
+            (is_complete, missing_items) from the first confident validator, or
+            None when the LLM validator should decide
+        """
+        validators = self._validators.get((week, question))
+        if not validators:
+            return None
+        for validator in validators:
+            verdict = validator(user_responses)
+            if verdict is not None:
+                if count:
+                    counter = f"week{week}.q{question}.{type(validator).__name__}"
+                    with self._lock:
+                        self.decided[counter] = self.decided.get(counter, 0) + 1
+                    print(f"[Validation] Week {week} Q{question} decided locally by {type(validator).__name__}: {verdict}")
+                return verdict
+        if count:
+            with self._lock:
+                self.fallbacks += 1
+        return None
+
+    def stats(self) -> Dict:
+        """Return how many validations each local validator decided."""
+        with self._lock:
+            return {
+                'questions_with_validators': len(self._validators),
+                'decided_locally': sum(self.decided.values()),
+                'llm_fallbacks': self.fallbacks,
+                'decided_by_validator': dict(sorted(self.decided.items())),
+            }
+
+
+# Global instance shared by every week app in the process
+completeness_validators = ValidatorRegistry()
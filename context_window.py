@@ -0,0 +1,176 @@
+"""
+Windowed Conversation Context for LLM Prompts
+
+Validation (and fused respond-and-validate) prompts list every response the
+learner gave to the current question, so they grow with each iteration. The
+builder here keeps that section within a token budget per call type:
+- the most recent responses are kept verbatim (up to LLM_CONTEXT_RECENT_TURNS,
+  as long as they fit; the latest one is always kept whole)
+- older responses are folded into one rolling summary line - the opening of
+  each response - which is cached, so each new turn only adds its own part
+- tokens before/after windowing are counted per call type, so the savings
+  show up in /health/llm
+
+Budgets: LLM_CONTEXT_BUDGET_VALIDATE and LLM_CONTEXT_BUDGET_RESPOND (tokens,
+estimated at 4 characters per token).
+"""
+
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from rate_limiter import CHARS_PER_TOKEN
+
+# Characters of each older response kept in the rolling summary
+SUMMARY_ITEM_CHARS = 120
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def count_tokens(text: str) -> int:
+    """Rough token count (same estimate as the rate limiter)."""
+    return len(text) // CHARS_PER_TOKEN
+
+
+def summarize_response(response: str) -> str:
+    """The opening sentence of a response, capped at SUMMARY_ITEM_CHARS."""
+    text = _WHITESPACE.sub(" ", response or "").strip()
+    first = _SENTENCE_END.split(text, 1)[0]
+    return first if len(first) <= SUMMARY_ITEM_CHARS else first[:SUMMARY_ITEM_CHARS - 3].rstrip() + "..."
+
+
+class ContextWindow:
+    """Builds the "responses so far" part of a prompt within a per-call-type token budget."""
+
+    def __init__(self, recent_turns: Optional[int] = None, budgets: Optional[Dict[str, int]] = None,
+                 cache_size: int = 2000):
+        self.recent_turns = _env_int('LLM_CONTEXT_RECENT_TURNS', 3) if recent_turns is None else recent_turns
+        self.budgets = budgets if budgets is not None else {
+            "validate": _env_int('LLM_CONTEXT_BUDGET_VALIDATE', 600),
+            "respond": _env_int('LLM_CONTEXT_BUDGET_RESPOND', 800),
+        }
+        self.cache_size = cache_size
+        # hash of responses[:k] -> summary of those k responses
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._totals: Dict[str, Dict[str, int]] = {}
+        self.summary_hits = 0
+        self.summary_misses = 0
+
+    def responses_section(self, user_responses: List[str], call_type: str = "validate",
+                          week: Optional[int] = None, question: Optional[int] = None) -> str:
+        """
+        Format the learner's responses as "  Response i: ..." lines within the call type's budget.
+
+        Args:
+            user_responses: The learner's responses to the current question, oldest first
+            call_type: "validate" or "respond" (selects the budget)
+            week: Week number (for the log line)
+            question: Question number (for the log line)
+
+        Returns:
+            The lines, each ending in a newline ("" when there are no responses)
+        """
+        lines = [f"  Response {i}: {resp}\n" for i, resp in enumerate(user_responses, 1)]
+        full_tokens = count_tokens("".join(lines))
+        budget = self.budgets.get(call_type)
+        if not lines or budget is None or full_tokens <= budget:
+            self._count(call_type, full_tokens, full_tokens)
+            return "".join(lines)
+
+        # Newest first: the latest response is always whole, then as many recent ones as fit
+        kept = [lines[-1]]
+        used = count_tokens(lines[-1])
+        for line in reversed(lines[:-1]):
+            if len(kept) >= self.recent_turns or used + count_tokens(line) > budget:
+                break
+            kept.append(line)
+            used += count_tokens(line)
+        kept.reverse()
+
+        older = len(lines) - len(kept)
+        section = "".join(kept)
+        if older:
+            summary = self._summary(user_responses[:older])
+            allowance = max(0, budget - used) * CHARS_PER_TOKEN
+            if len(summary) > allowance:
+                # The most recent of the older responses matter most; drop from the front
+                summary = "..." + summary[len(summary) - allowance + 3:] if allowance > 3 else ""
+            if summary:
+                label = "Response 1" if older == 1 else f"Responses 1-{older}"
+                section = f"  {label} (summarized): {summary}\n" + section
+            else:
+                section = f"  ({older} earlier response(s) omitted)\n" + section
+
+        windowed_tokens = count_tokens(section)
+        self._count(call_type, full_tokens, windowed_tokens)
+        print(f"[Context] Week {week} Q{question} {call_type}: {len(lines)} responses, "
+              f"{full_tokens} -> {windowed_tokens} tokens (saved {full_tokens - windowed_tokens})")
+        return section
+
+    def _summary(self, responses: List[str]) -> str:
+        """Rolling summary of responses, extended one response at a time from the cached prefix."""
+        digest = hashlib.sha256()
+        keys = []
+        for response in responses:
+            digest.update((response or "").encode("utf-8") + b"\x00")
+            keys.append(digest.hexdigest())
+
+        with self._lock:
+            # Longest cached prefix
+            start, summary = 0, ""
+            for k in range(len(keys), 0, -1):
+                cached = self._summaries.get(keys[k - 1])
+                if cached is not None:
+                    self._summaries.move_to_end(keys[k - 1])
+                    start, summary = k, cached
+                    break
+            if start == len(keys):
+                self.summary_hits += 1
+                return summary
+            self.summary_misses += 1
+
+        for k in range(start, len(keys)):
+            part = summarize_response(responses[k])
+            summary = f"{summary} | {part}" if summary else part
+            with self._lock:
+                self._summaries[keys[k]] = summary
+                while len(self._summaries) > self.cache_size:
+                    self._summaries.popitem(last=False)
+        return summary
+
+    def _count(self, call_type: str, full_tokens: int, windowed_tokens: int):
+        with self._lock:
+            totals = self._totals.setdefault(call_type, {"calls": 0, "windowed": 0, "tokens_before": 0,
+                                                         "tokens_after": 0})
+            totals["calls"] += 1
+            totals["windowed"] += 1 if windowed_tokens < full_tokens else 0
+            totals["tokens_before"] += full_tokens
+            totals["tokens_after"] += windowed_tokens
+
+    def stats(self) -> Dict[str, Any]:
+        """Return token budgets and the tokens saved per call type."""
+        with self._lock:
+            return {
+                'budgets': dict(self.budgets),
+                'recent_turns': self.recent_turns,
+                'by_call_type': {call_type: {**totals, "tokens_saved": totals["tokens_before"] - totals["tokens_after"]}
+                                 for call_type, totals in self._totals.items()},
+                'summary_cache': {'entries': len(self._summaries), 'hits': self.summary_hits,
+                                  'misses': self.summary_misses},
+            }
+
+
+# Global instance shared by every week app in the process
+context_window = ContextWindow()
@@ -0,0 +1,188 @@
+"""
+Shared Conversation State for the Week Apps
+
+Every week module used to define its own ConversationState with parallel dicts
+(answers, nova_responses, iteration_count, question_completed) plus one
+attribute per question for the scenario classification (q1_scenario, ...).
+
+ConversationState keeps all of that in one slotted QuestionRecord per question.
+The old attribute names still work:
+- state.answers / nova_responses / iteration_count / question_completed /
+  scenarios are dict-like views over the records
+- state.q{n}_scenario reads and writes the record's scenario
+
+Week modules subclass ConversationState for their week-specific fields
+(declared in __slots__). to_dict() / from_dict() give a compact JSON form used
+by the conversation store.
+"""
+
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterator, MutableMapping, Optional
+
+from conversation_store import encode_value, decode_value
+
+_SCENARIO_ATTR = re.compile(r"^q(\d+)_scenario$")
+
+
+@lru_cache(maxsize=128)
+def _scenario_question(attr_name: str) -> Optional[int]:
+    """Return N for an attribute named q{N}_scenario, else None."""
+    match = _SCENARIO_ATTR.match(attr_name)
+    return int(match.group(1)) if match else None
+
+
+class QuestionRecord:
+    """Everything the conversation tracks for one question (None = not set yet)."""
+
+    __slots__ = ('answers', 'responses', 'iteration', 'scenario', 'completed')
+
+    def __init__(self):
+        self.answers = None  # List of user responses
+        self.responses = None  # List of NOVA responses
+        self.iteration = None  # Iteration count (for 2-iteration loops)
+        self.scenario = None  # Scenario classification, e.g. "SCENARIO_1"
+        self.completed = None  # Whether the question is fully completed
+
+    def to_list(self) -> list:
+        return [self.answers, self.responses, self.iteration, self.scenario, self.completed]
+
+    @classmethod
+    def from_list(cls, values: list) -> "QuestionRecord":
+        record = cls()
+        record.answers, record.responses, record.iteration, record.scenario, record.completed = values
+        return record
+
+
+class QuestionFieldView(MutableMapping):
+    """Dict-like view of one QuestionRecord field across questions (qnum -> value)."""
+
+    __slots__ = ('_state', '_field')
+
+    def __init__(self, state: "ConversationState", field: str):
+        self._state = state
+        self._field = field
+
+    def __getitem__(self, qnum):
+        record = self._state._questions.get(qnum)
+        value = getattr(record, self._field) if record is not None else None
+        if value is None:
+            raise KeyError(qnum)
+        return value
+
+    def __setitem__(self, qnum, value):
+        setattr(self._state.question(qnum), self._field, value)
+
+    def __delitem__(self, qnum):
+        record = self._state._questions.get(qnum)
+        if record is None or getattr(record, self._field) is None:
+            raise KeyError(qnum)
+        setattr(record, self._field, None)
+
+    def __iter__(self) -> Iterator:
+        field = self._field
+        return iter([qnum for qnum, record in self._state._questions.items()
+                     if getattr(record, field) is not None])
+
+    def __len__(self) -> int:
+        field = self._field
+        return sum(1 for record in self._state._questions.values() if getattr(record, field) is not None)
+
+    def __contains__(self, qnum) -> bool:
+        record = self._state._questions.get(qnum)
+        return record is not None and getattr(record, self._field) is not None
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+def _field_property(field: str, doc: str) -> property:
+    def getter(self):
+        return QuestionFieldView(self, field)
+
+    def setter(self, mapping):
+        # e.g. `state.question_completed = {}` resets that field for every question
+        for record in self._questions.values():
+            setattr(record, field, None)
+        for qnum, value in dict(mapping).items():
+            setattr(self.question(qnum), field, value)
+
+    return property(getter, setter, doc=doc)
+
+
+class ConversationState:
+    """Manages state for a single conversation."""
+
+    __slots__ = ('name', 'current_question', '_questions')
+
+    # Week-specific fields declared in subclasses' __slots__ (serialized by to_dict)
+    _extra_fields = ()
+
+    def __init__(self, name, first_question: int = 1):
+        self.name = name
+        self.current_question = first_question
+        self._questions: Dict[int, QuestionRecord] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._extra_fields = tuple(cls._extra_fields) + tuple(cls.__dict__.get('__slots__', ()))
+
+    answers = _field_property('answers', "qnum -> list of user responses")
+    nova_responses = _field_property('responses', "qnum -> list of NOVA responses")
+    iteration_count = _field_property('iteration', "qnum -> iteration count")
+    question_completed = _field_property('completed', "qnum -> bool (whether question is fully completed)")
+    scenarios = _field_property('scenario', "qnum -> scenario classification")
+
+    def question(self, qnum: int) -> QuestionRecord:
+        """Return the record for a question, creating it if needed."""
+        record = self._questions.get(qnum)
+        if record is None:
+            record = self._questions[qnum] = QuestionRecord()
+        return record
+
+    def __getattr__(self, attr_name: str) -> Any:
+        # Only called when normal lookup fails: map q{N}_scenario onto the question record
+        qnum = _scenario_question(attr_name)
+        if qnum is None:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{attr_name}'")
+        record = self._questions.get(qnum)
+        return record.scenario if record is not None else None
+
+    def __setattr__(self, attr_name: str, value: Any):
+        qnum = _scenario_question(attr_name)
+        if qnum is not None:
+            self.question(qnum).scenario = value
+        else:
+            object.__setattr__(self, attr_name, value)
+
+    def get_iteration(self, qnum):
+        """Get current iteration count for a question."""
+        record = self._questions.get(qnum)
+        return record.iteration if record is not None and record.iteration is not None else 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Compact JSON-serializable form: question records are stored as 5-item lists."""
+        data = {
+            'name': self.name,
+            'current_question': self.current_question,
+            'questions': {str(qnum): record.to_list() for qnum, record in self._questions.items()},
+        }
+        for field in self._extra_fields:
+            if hasattr(self, field):
+                data[field] = encode_value(getattr(self, field))
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ConversationState":
+        """Rebuild a state from to_dict() output without calling __init__."""
+        state = cls.__new__(cls)
+        state.name = data.get('name')
+        state.current_question = data.get('current_question')
+        state._questions = {
+            int(qnum): QuestionRecord.from_list(values)
+            for qnum, values in data.get('questions', {}).items()
+        }
+        for field in cls._extra_fields:
+            if field in data:
+                setattr(state, field, decode_value(data[field]))
+        return state
@@ -0,0 +1,591 @@
+"""
+Shared Conversation State Store for the Week Apps
+
+Each week module keeps one ConversationState per session. Originally these lived
+in a module-level dict, which pinned every learner to a single worker process.
+This module provides storage backends for those states:
+- InMemoryConversationStore: process-local, bounded by idle TTL and LRU eviction (single worker)
+- SQLiteConversationStore: one row per (session, week) in a WAL-mode SQLite database (single node)
+- PostgresConversationStore: the existing `conversation_states` table (multi-node)
+
+ConversationStateMap is a drop-in replacement for the old `conversation_states`
+dict. With init_app(app) a session's state is loaded on first access during a
+request and saved when the request ends. Saves use optimistic versioning: if
+another worker saved the same state in the meantime, the request gets a 409.
+
+Select a backend with CONVERSATION_BACKEND=memory|sqlite|postgres (default: memory).
+"""
+
+import os
+import json
+import sqlite3
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_SQLITE_PATH = "conversation_states.db"
+
+# Every store created by create_conversation_store(), for health reporting
+_stores: List["ConversationStore"] = []
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class StaleStateError(Exception):
+    """Raised when a state was saved by another request since it was loaded."""
+
+
+# ----------------------------------------------------------------------
+# JSON codec for ConversationState objects (sets and int-keyed dicts)
+# ----------------------------------------------------------------------
+
+def encode_value(value: Any) -> Any:
+    """Make a value JSON-serializable, tagging sets and dicts with non-string keys."""
+    if isinstance(value, (set, frozenset)):
+        return {"__set__": [encode_value(v) for v in value]}
+    if isinstance(value, dict):
+        if all(isinstance(k, str) for k in value) and "__set__" not in value and "__items__" not in value:
+            return {k: encode_value(v) for k, v in value.items()}
+        # Non-string keys (e.g. question numbers) are kept as key/value pairs so they round-trip
+        return {"__items__": [[encode_value(k), encode_value(v)] for k, v in value.items()]}
+    if isinstance(value, (list, tuple)):
+        return [encode_value(v) for v in value]
+    return value
+
+
+def decode_value(value: Any) -> Any:
+    """Reverse encode_value()."""
+    if isinstance(value, dict):
+        if "__set__" in value and len(value) == 1:
+            return set(decode_value(v) for v in value["__set__"])
+        if "__items__" in value and len(value) == 1:
+            return {decode_value(k): decode_value(v) for k, v in value["__items__"]}
+        return {k: decode_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [decode_value(v) for v in value]
+    return value
+
+
+def encode_state(state: Any) -> Dict:
+    """Convert a ConversationState into a JSON-serializable dict."""
+    if hasattr(state, 'to_dict'):
+        return state.to_dict()
+    return {key: encode_value(value) for key, value in vars(state).items()}
+
+
+def decode_state(state_class: type, data: Dict) -> Any:
+    """Rebuild a ConversationState from encode_state() output without calling __init__."""
+    if hasattr(state_class, 'from_dict'):
+        return state_class.from_dict(data)
+    state = state_class.__new__(state_class)
+    for key, value in data.items():
+        setattr(state, key, decode_value(value))
+    return state
+
+
+# ----------------------------------------------------------------------
+# Backends
+# ----------------------------------------------------------------------
+
+class ConversationStore:
+    """Base class for conversation state backends (one store per week)."""
+
+    backend_name = "base"
+    # Persistent stores hand out fresh copies, so states must be written back after a request
+    persistent = True
+
+    def __init__(self, week_number: int, state_class: type):
+        self.week_number = week_number
+        self.state_class = state_class
+
+    def load(self, session_id: str) -> Optional[Tuple[Any, int]]:
+        """Return (state, version) for a session, or None if it has no state yet."""
+        raise NotImplementedError
+
+    def save(self, session_id: str, state: Any, expected_version: int) -> int:
+        """
+        Save a state if its stored version still equals expected_version (0 = new).
+
+        Returns:
+            The new version
+
+        Raises:
+            StaleStateError: if another request saved the state first
+        """
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        """Remove a session's state."""
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, Any]:
+        """Return counters for monitoring."""
+        return {'backend': self.backend_name, 'week': self.week_number}
+
+
+class InMemoryConversationStore(ConversationStore):
+    """
+    Process-local store holding live state objects (single worker only).
+
+    The store is bounded: sessions idle for longer than idle_ttl seconds expire,
+    and once max_sessions is reached the least recently used session is evicted.
+    If a spill_store is given, evicted sessions are written to it and transparently
+    restored the next time the learner sends a request.
+    """
+
+    backend_name = "memory"
+    persistent = False
+
+    def __init__(self, week_number: int, state_class: type,
+                 max_sessions: Optional[int] = None, idle_ttl: Optional[float] = None,
+                 spill_store: Optional[ConversationStore] = None):
+        super().__init__(week_number, state_class)
+        self.max_sessions = _env_int('CONVERSATION_MAX_SESSIONS', 5000) if max_sessions is None else max_sessions
+        self.idle_ttl = _env_float('CONVERSATION_IDLE_TTL', 7200) if idle_ttl is None else idle_ttl
+        self.spill_store = spill_store
+        # session_id -> [state, version, last_access]; ordered from least to most recently used
+        self._states: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.spilled = 0
+        self.restored = 0
+
+    def _is_expired(self, entry: list, now: float) -> bool:
+        return self.idle_ttl > 0 and now - entry[2] > self.idle_ttl
+
+    def _collect_evictions(self, now: float) -> List[Tuple[str, Any]]:
+        """Pop expired and over-capacity sessions (caller holds the lock)."""
+        evicted = []
+        # Oldest sessions are at the front, so stop at the first one that is still fresh
+        while self._states:
+            session_id, entry = next(iter(self._states.items()))
+            if not self._is_expired(entry, now):
+                break
+            self._states.popitem(last=False)
+            self.expirations += 1
+            evicted.append((session_id, entry[0]))
+        while self.max_sessions > 0 and len(self._states) > self.max_sessions:
+            session_id, entry = self._states.popitem(last=False)
+            self.evictions += 1
+            evicted.append((session_id, entry[0]))
+        return evicted
+
+    def _spill(self, evicted: List[Tuple[str, Any]]):
+        """Write evicted sessions to the spill store (outside the lock)."""
+        if not self.spill_store:
+            return
+        for session_id, state in evicted:
+            try:
+                existing = self.spill_store.load(session_id)
+                self.spill_store.save(session_id, state, existing[1] if existing else 0)
+                self.spilled += 1
+            except Exception as e:
+                print(f"[State] WARNING: Could not spill session {session_id}: {e}")
+
+    def load(self, session_id: str) -> Optional[Tuple[Any, int]]:
+        now = time.monotonic()
+        with self._lock:
+            evicted = self._collect_evictions(now)
+            entry = self._states.get(session_id)
+            if entry is not None:
+                self.hits += 1
+                entry[2] = now
+                self._states.move_to_end(session_id)
+                result = (entry[0], entry[1])
+            else:
+                self.misses += 1
+                result = None
+        self._spill(evicted)
+
+        if result is None and self.spill_store:
+            restored = self.spill_store.load(session_id)
+            if restored:
+                with self._lock:
+                    entry = self._states.get(session_id)
+                    if entry is None:
+                        entry = [restored[0], restored[1], now]
+                        self._states[session_id] = entry
+                        self.restored += 1
+                    result = (entry[0], entry[1])
+                    evicted = self._collect_evictions(now)
+                self._spill(evicted)
+        return result
+
+    def save(self, session_id: str, state: Any, expected_version: int) -> int:
+        now = time.monotonic()
+        with self._lock:
+            current = self._states.get(session_id)
+            if current is not None and current[1] != expected_version and current[0] is not state:
+                raise StaleStateError(session_id)
+            # A session evicted mid-request is simply re-admitted with the caller's state
+            new_version = (current[1] if current else expected_version) + 1
+            self._states[session_id] = [state, new_version, now]
+            self._states.move_to_end(session_id)
+            evicted = self._collect_evictions(now)
+        self._spill(evicted)
+        return new_version
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._states.pop(session_id, None)
+        if self.spill_store:
+            self.spill_store.delete(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **super().stats(),
+                'size': len(self._states),
+                'max_sessions': self.max_sessions,
+                'idle_ttl': self.idle_ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'spilled': self.spilled,
+                'restored': self.restored,
+                'spill_backend': self.spill_store.backend_name if self.spill_store else None,
+            }
+
+
+class SQLiteConversationStore(ConversationStore):
+    """One row per (session, week) in a WAL-mode SQLite database."""
+
+    backend_name = "sqlite"
+
+    def __init__(self, week_number: int, state_class: type,
+                 db_path: str = DEFAULT_SQLITE_PATH, busy_timeout_ms: int = 5000):
+        super().__init__(week_number, state_class)
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS conversation_states (
+                session_id TEXT NOT NULL,
+                week_number INTEGER NOT NULL,
+                version INTEGER NOT NULL,
+                conversation_data TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (session_id, week_number)
+            )
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection (SQLite connections can't be shared across threads)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=self.busy_timeout_ms / 1000)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            self._local.conn = conn
+        return conn
+
+    def load(self, session_id: str) -> Optional[Tuple[Any, int]]:
+        row = self._connect().execute(
+            "SELECT conversation_data, version FROM conversation_states WHERE session_id = ? AND week_number = ?",
+            (session_id, self.week_number)
+        ).fetchone()
+        if not row:
+            return None
+        return decode_state(self.state_class, json.loads(row[0])), row[1]
+
+    def save(self, session_id: str, state: Any, expected_version: int) -> int:
+        conn = self._connect()
+        data = json.dumps(encode_state(state))
+        now = datetime.now().isoformat()
+        new_version = expected_version + 1
+        if expected_version == 0:
+            cursor = conn.execute(
+                """
+                INSERT OR IGNORE INTO conversation_states
+                    (session_id, week_number, version, conversation_data, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (session_id, self.week_number, new_version, data, now)
+            )
+        else:
+            cursor = conn.execute(
+                """
+                UPDATE conversation_states
+                SET conversation_data = ?, version = ?, updated_at = ?
+                WHERE session_id = ? AND week_number = ? AND version = ?
+                """,
+                (data, new_version, now, session_id, self.week_number, expected_version)
+            )
+        if cursor.rowcount != 1:
+            raise StaleStateError(session_id)
+        return new_version
+
+    def delete(self, session_id: str):
+        self._connect().execute(
+            "DELETE FROM conversation_states WHERE session_id = ? AND week_number = ?",
+            (session_id, self.week_number)
+        )
+
+
+class PostgresConversationStore(ConversationStore):
+    """
+    States in the Postgres `conversation_states` table (shared by all nodes).
+
+    The version counter is kept inside the JSONB conversation_data under '_version',
+    so the existing schema is used as-is.
+    """
+
+    backend_name = "postgres"
+
+    def __init__(self, week_number: int, state_class: type, engine=None):
+        super().__init__(week_number, state_class)
+        if engine is None:
+            from database.db_config import get_shared_engine
+            engine = get_shared_engine()
+        self.engine = engine
+        from sqlalchemy import text
+        self._text = text
+
+    _WEEK_ID = "(SELECT week_id FROM weeks WHERE week_number = :week)"
+
+    def load(self, session_id: str) -> Optional[Tuple[Any, int]]:
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                self._text(f"""
+                    SELECT conversation_data FROM conversation_states
+                    WHERE session_id = :sid AND week_id = {self._WEEK_ID}
+                """),
+                {'sid': session_id, 'week': self.week_number}
+            ).fetchone()
+        if not row or not row[0]:
+            return None
+        data = dict(row[0])
+        version = int(data.pop('_version', 1))
+        return decode_state(self.state_class, data), version
+
+    def save(self, session_id: str, state: Any, expected_version: int) -> int:
+        text = self._text
+        new_version = expected_version + 1
+        data = encode_state(state)
+        data['_version'] = new_version
+        params = {
+            'sid': session_id,
+            'week': self.week_number,
+            'question': getattr(state, 'current_question', None),
+            'data': json.dumps(data),
+            'expected': expected_version,
+        }
+        with self.engine.begin() as conn:
+            if expected_version == 0:
+                result = conn.execute(text(f"""
+                    INSERT INTO conversation_states (session_id, week_id, current_question_number, conversation_data)
+                    VALUES (:sid, {self._WEEK_ID}, :question, CAST(:data AS JSONB))
+                    ON CONFLICT (session_id, week_id) DO NOTHING
+                """), params)
+            else:
+                result = conn.execute(text(f"""
+                    UPDATE conversation_states
+                    SET conversation_data = CAST(:data AS JSONB), current_question_number = :question
+                    WHERE session_id = :sid AND week_id = {self._WEEK_ID}
+                      AND COALESCE((conversation_data->>'_version')::INTEGER, 1) = :expected
+                """), params)
+        if result.rowcount != 1:
+            raise StaleStateError(session_id)
+        return new_version
+
+    def delete(self, session_id: str):
+        with self.engine.begin() as conn:
+            conn.execute(
+                self._text(f"DELETE FROM conversation_states WHERE session_id = :sid AND week_id = {self._WEEK_ID}"),
+                {'sid': session_id, 'week': self.week_number}
+            )
+
+
+def _create_backend(backend: str, week_number: int, state_class: type) -> ConversationStore:
+    if backend == 'memory':
+        spill_backend = os.getenv('CONVERSATION_SPILL_BACKEND', '').lower()
+        spill_store = None
+        if spill_backend and spill_backend != 'memory':
+            spill_store = _create_backend(spill_backend, week_number, state_class)
+        return InMemoryConversationStore(week_number, state_class, spill_store=spill_store)
+    if backend == 'sqlite':
+        return SQLiteConversationStore(
+            week_number, state_class, os.getenv('CONVERSATION_DB_PATH', DEFAULT_SQLITE_PATH)
+        )
+    if backend in ('postgres', 'postgresql'):
+        return PostgresConversationStore(week_number, state_class)
+    raise ValueError(f"Unknown conversation backend '{backend}' (expected memory, sqlite or postgres)")
+
+
+def create_conversation_store(week_number: int, state_class: type,
+                              backend: Optional[str] = None) -> ConversationStore:
+    """
+    Create the conversation store selected by CONVERSATION_BACKEND (memory, sqlite or postgres).
+
+    The memory backend is bounded by CONVERSATION_MAX_SESSIONS and CONVERSATION_IDLE_TTL;
+    set CONVERSATION_SPILL_BACKEND=sqlite|postgres to keep evicted sessions.
+
+    Args:
+        week_number: Week the states belong to
+        state_class: The week module's ConversationState class (used to rebuild states)
+        backend: Override for CONVERSATION_BACKEND
+    """
+    backend = (backend or os.getenv('CONVERSATION_BACKEND', 'memory')).lower()
+    store = _create_backend(backend, week_number, state_class)
+    _stores.append(store)
+    return store
+
+
+def get_conversation_store_stats() -> List[Dict[str, Any]]:
+    """Return stats for every conversation store in this process."""
+    return [store.stats() for store in _stores]
+
+
+# ----------------------------------------------------------------------
+# Dict-like view used by the week modules
+# ----------------------------------------------------------------------
+
+class ConversationStateMap:
+    """
+    Replacement for the module-level `conversation_states` dict.
+
+    Inside a request (after init_app) states are loaded once, cached for the
+    rest of the request and saved back when it ends. Outside a request every
+    access goes straight to the store.
+    """
+
+    def __init__(self, store: ConversationStore):
+        self.store = store
+        self._local = threading.local()
+
+    # -- request lifecycle ------------------------------------------------
+
+    def _request_cache(self) -> Optional[Dict[str, Dict]]:
+        return getattr(self._local, 'entries', None)
+
+    def begin_request(self):
+        self._local.entries = {}
+
+    def end_request(self):
+        """Save every state loaded or created during the request. Raises StaleStateError on conflict."""
+        entries = self._request_cache()
+        self._local.entries = None
+        self._save_entries(entries)
+
+    def flush(self):
+        """Save pending states now and keep serving the rest of the request from fresh loads."""
+        entries = self._request_cache()
+        if entries is None:
+            return
+        self._local.entries = {}
+        self._save_entries(entries)
+
+    def _save_entries(self, entries: Optional[Dict[str, Dict]]):
+        if not entries:
+            return
+        for session_id, entry in entries.items():
+            state = entry['state']
+            if state is None:
+                continue
+            unchanged = not entry.get('replaced') and entry['snapshot'] == self._snapshot(state)
+            if entry['version'] and unchanged:
+                continue  # Unchanged - skip the write
+            self.store.save(session_id, state, entry['version'])
+
+    def discard_request(self):
+        self._local.entries = None
+
+    def init_app(self, app):
+        """Load states lazily during each request of a Flask app and save them when it ends."""
+        from flask import jsonify
+
+        @app.before_request
+        def _begin_conversation_states():
+            self.begin_request()
+
+        @app.after_request
+        def _save_conversation_states(response):
+            try:
+                self.end_request()
+            except StaleStateError:
+                print("[State] Conflict: conversation was updated by another request")
+                response = jsonify({
+                    "success": False,
+                    "error": "Your conversation was updated by another request. Please try again.",
+                    "conflict": True
+                })
+                response.status_code = 409
+            return response
+
+        @app.teardown_request
+        def _discard_conversation_states(exc=None):
+            # after_request doesn't run for unhandled errors - never save half-applied state
+            self.discard_request()
+
+    # -- helpers ----------------------------------------------------------
+
+    def _snapshot(self, state: Any) -> Optional[str]:
+        if not self.store.persistent:
+            return None
+        return json.dumps(encode_state(state), sort_keys=True)
+
+    def _entry(self, session_id: str) -> Dict:
+        entries = self._request_cache()
+        if entries is not None and session_id in entries:
+            return entries[session_id]
+
+        loaded = self.store.load(session_id)
+        state, version = loaded if loaded else (None, 0)
+        entry = {
+            'state': state,
+            'version': version,
+            'snapshot': self._snapshot(state) if state is not None else None,
+        }
+        if entries is not None:
+            entries[session_id] = entry
+        return entry
+
+    # -- mapping interface ------------------------------------------------
+
+    def __contains__(self, session_id: str) -> bool:
+        return self._entry(session_id)['state'] is not None
+
+    def __getitem__(self, session_id: str):
+        state = self._entry(session_id)['state']
+        if state is None:
+            raise KeyError(session_id)
+        return state
+
+    def get(self, session_id: str, default=None):
+        state = self._entry(session_id)['state']
+        return default if state is None else state
+
+    def __setitem__(self, session_id: str, state: Any):
+        entries = self._request_cache()
+        if entries is None:
+            loaded = self.store.load(session_id)
+            self.store.save(session_id, state, loaded[1] if loaded else 0)
+            return
+        entry = self._entry(session_id)
+        entry['state'] = state
+        entry['replaced'] = True  # Always write a replaced state
+
+    def __delitem__(self, session_id: str):
+        entries = self._request_cache()
+        if entries is not None:
+            entries.pop(session_id, None)
+        self.store.delete(session_id)
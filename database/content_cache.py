@@ -0,0 +1,175 @@
+"""
+Week Content Cache
+
+This module provides a shared in-process cache for week content (questions, prompts,
+welcome messages, content blocks) so lookups don't hit the database on every call.
+
+Entries are keyed by (week_number, content_version) and expire after a TTL.
+Content can also be invalidated explicitly, either for one week or for all weeks.
+
+The week modules copy QUESTIONS, SYSTEM_PROMPTS etc. into module globals. They
+remember the revision() they loaded and re-run their _init_weekN_data() loader
+when is_current() says the week's content changed (stored anew, invalidated,
+new content version) or expired, so refreshed prompts reach live requests.
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+def _env_ttl() -> float:
+    """Read the cache TTL (seconds) from the environment. 0 disables caching."""
+    try:
+        return float(os.getenv('WEEK_CONTENT_CACHE_TTL', '300'))
+    except ValueError:
+        return 300.0
+
+
+class WeekContentCache:
+    """Thread-safe TTL cache for week content, keyed by week number and content version."""
+
+    def __init__(self, ttl_seconds: Optional[float] = None, version: Optional[str] = None):
+        self.ttl_seconds = _env_ttl() if ttl_seconds is None else ttl_seconds
+        # Content version can be pinned by deployment (e.g. after running a populate script)
+        self._base_version = version or os.getenv('WEEK_CONTENT_VERSION', '1')
+        self._generation = 0  # Bumped by invalidate_all() so old entries become unreachable
+        self._entries: Dict[Tuple[int, str], Tuple[float, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._load_locks: Dict[int, threading.Lock] = {}
+        # Bumped whenever cached content changes: per week, and for every week at once
+        self._revisions: Dict[int, int] = {}
+        self._epoch = 0
+        # Sequence number of the latest invalidate(week) call, and when each week was last invalidated
+        self._invalidations = 0
+        self._invalidated_at: Dict[int, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+
+    @property
+    def version(self) -> str:
+        """Current content version used as part of the cache key."""
+        return f"{self._base_version}.{self._generation}"
+
+    def load_token(self) -> Tuple[str, int]:
+        """Marker to take before loading content and pass to put(), so loads that raced an invalidation are dropped."""
+        with self._lock:
+            return self.version, self._invalidations
+
+    def _is_fresh(self, loaded_at: float) -> bool:
+        return (time.monotonic() - loaded_at) < self.ttl_seconds
+
+    def _lookup(self, week_number: int) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get((week_number, self.version))
+        if entry and self._is_fresh(entry[0]):
+            return entry[1]
+        return None
+
+    def get(self, week_number: int, loader: Callable[[int], Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Return cached content for a week, loading it with `loader` on a miss.
+
+        Concurrent misses for the same week share a single load.
+        The returned dict is shared between callers and must be treated as read-only.
+        """
+        if self.ttl_seconds <= 0:
+            with self._lock:
+                self.misses += 1
+                self.loads += 1
+            return loader(week_number)
+
+        with self._lock:
+            content = self._lookup(week_number)
+            if content is not None:
+                self.hits += 1
+                return content
+            self.misses += 1
+            load_lock = self._load_locks.setdefault(week_number, threading.Lock())
+
+        with load_lock:
+            # Another thread may have loaded it while we were waiting
+            with self._lock:
+                content = self._lookup(week_number)
+                if content is not None:
+                    return content
+                self.loads += 1
+                token = (self.version, self._invalidations)
+
+            content = loader(week_number)
+            self.put(week_number, content, token=token)
+            return content
+
+    def put(self, week_number: int, content: Dict[str, Any], token: Optional[Tuple[str, int]] = None):
+        """Store content for a week, unless it was invalidated after `token` (from load_token()) was taken."""
+        with self._lock:
+            if token is not None:
+                version, invalidations = token
+                if version != self.version or self._invalidated_at.get(week_number, -1) > invalidations:
+                    # Content was invalidated while this load was in flight - don't cache stale data
+                    return
+            self._entries[(week_number, self.version)] = (time.monotonic(), content)
+            self._revisions[week_number] = self._revisions.get(week_number, 0) + 1
+
+    def invalidate(self, week_number: Optional[int] = None):
+        """Drop cached content for one week, or for every week if week_number is None."""
+        with self._lock:
+            if week_number is None:
+                # New generation, so loads already in flight are dropped by put()
+                self._generation += 1
+                self._entries.clear()
+                self._epoch += 1
+            else:
+                for key in [k for k in self._entries if k[0] == week_number]:
+                    del self._entries[key]
+                self._invalidations += 1
+                self._invalidated_at[week_number] = self._invalidations
+                self._revisions[week_number] = self._revisions.get(week_number, 0) + 1
+
+    def invalidate_all(self):
+        """Bump the content version so every cached entry (and in-flight load) is discarded."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._epoch += 1
+
+    def set_version(self, version: str):
+        """Switch to a new content version (e.g. after content was republished)."""
+        with self._lock:
+            if version != self._base_version:
+                self._base_version = version
+                self._entries.clear()
+                self._epoch += 1
+
+    def revision(self, week_number: int) -> Tuple[int, int]:
+        """Opaque marker of a week's cached content; read it before loading the content it describes."""
+        with self._lock:
+            return self._epoch, self._revisions.get(week_number, 0)
+
+    def is_current(self, week_number: int, revision: Optional[Tuple[int, int]]) -> bool:
+        """
+        Whether content loaded at `revision` is still what the cache would serve.
+
+        False once the week was stored anew, invalidated or switched to a new content
+        version, or (with caching enabled) once its entry expired.
+        """
+        with self._lock:
+            if revision != (self._epoch, self._revisions.get(week_number, 0)):
+                return False
+            return self.ttl_seconds <= 0 or self._lookup(week_number) is not None
+
+    def stats(self) -> Dict[str, Any]:
+        """Return hit/miss counters and cached weeks for monitoring."""
+        with self._lock:
+            return {
+                'version': self.version,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'loads': self.loads,
+                'cached_weeks': sorted(week for week, version in self._entries if version == self.version),
+            }
+
+
+# Global instance shared by every week app in the process
+week_content_cache = WeekContentCache()
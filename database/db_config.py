@@ -4,15 +4,152 @@ Database Configuration for Supabase/PostgreSQL
 This module handles database connection setup using Supabase credentials.
 """
 import os
+import threading
+import time
+from typing import Any, Dict, Optional
 from flask_sqlalchemy import SQLAlchemy
 from flask import Flask
 from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool
 
 # Load environment variables
 load_dotenv()
 
+
+class SharedEngineSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension whose default bind is the process-wide engine from get_shared_engine()."""
+    
+    def _make_engine(self, bind_key, options, app):
+        # Every app gets the same Engine (not just the same Pool), so dialect setup on
+        # first connect and pool settings apply once to the connections they all share
+        if bind_key is None:
+            return get_shared_engine()
+        return super()._make_engine(bind_key, options, app)
+
+
 # Initialize SQLAlchemy
-db = SQLAlchemy()
+db = SharedEngineSQLAlchemy()
+
+# Process-wide engine shared by every week app (see get_shared_engine)
+_shared_engine: Optional[Engine] = None
+_shared_engine_lock = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_pool_settings() -> Dict[str, Any]:
+    """
+    Get connection pool settings from environment variables.
+    
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING
+    """
+    return {
+        'pool_size': _env_int('DB_POOL_SIZE', 5),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 5),
+        'pool_timeout': _env_float('DB_POOL_TIMEOUT', 10.0),
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 300),  # Recycle connections after 5 minutes
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', '1').lower() not in ('0', 'false', 'no'),
+    }
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long callers wait to check out a connection."""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkout_count = 0
+        self.checkout_timeouts = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.peak_checked_out = 0
+    
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            with self._stats_lock:
+                self.checkout_timeouts += 1
+            raise
+        waited = time.perf_counter() - start
+        with self._stats_lock:
+            self.checkout_count += 1
+            self.total_wait_seconds += waited
+            self.max_wait_seconds = max(self.max_wait_seconds, waited)
+            self.peak_checked_out = max(self.peak_checked_out, self.checkedout())
+        return conn
+
+
+def get_shared_engine() -> Engine:
+    """
+    Get the process-wide SQLAlchemy engine.
+    
+    All week apps mounted in one process share this engine's connection pool,
+    so the total number of connections against the Supabase pooler is bounded
+    by DB_POOL_SIZE + DB_MAX_OVERFLOW no matter how many apps call init_db().
+    """
+    global _shared_engine
+    if _shared_engine is None:
+        with _shared_engine_lock:
+            if _shared_engine is None:
+                settings = get_pool_settings()
+                url = make_url(get_database_url())
+                if url.drivername == 'postgresql':
+                    # Use the driver in requirements.txt (SQLAlchemy 2.1 defaults to psycopg 3)
+                    url = url.set(drivername='postgresql+psycopg2')
+                _shared_engine = create_engine(
+                    url,
+                    poolclass=InstrumentedQueuePool,
+                    **settings
+                )
+    return _shared_engine
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """
+    Get occupancy and checkout wait-time statistics for the shared pool.
+    
+    Returns:
+        dict with configured limits, current occupancy and wait-time counters
+    """
+    if _shared_engine is None:
+        return {'initialized': False, **get_pool_settings()}
+    
+    pool = _shared_engine.pool
+    stats = {
+        'initialized': True,
+        **get_pool_settings(),
+        'checked_out': pool.checkedout(),
+        'checked_in': pool.checkedin(),
+        'overflow': pool.overflow(),
+        'status': pool.status(),
+    }
+    if isinstance(pool, InstrumentedQueuePool):
+        with pool._stats_lock:
+            count = pool.checkout_count
+            stats.update({
+                'checkouts': count,
+                'checkout_timeouts': pool.checkout_timeouts,
+                'peak_checked_out': pool.peak_checked_out,
+                'avg_wait_ms': round((pool.total_wait_seconds / count) * 1000, 3) if count else 0.0,
+                'max_wait_ms': round(pool.max_wait_seconds * 1000, 3),
+            })
+    return stats
 
 def get_database_url():
     """
@@ -96,10 +233,8 @@ def init_db(app: Flask):
     
     app.config['SQLALCHEMY_DATABASE_URI'] = database_url
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-        'pool_pre_ping': True,  # Verify connections before using
-        'pool_recycle': 300,     # Recycle connections after 5 minutes
-    }
+    # Every app is bound to the process-wide engine (pool size, overflow, timeout,
+    # recycle and pre-ping are configured once in get_shared_engine)
     
     db.init_app(app)
     
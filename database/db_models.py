@@ -8,17 +8,23 @@ while maintaining the exact same interface as the hardcoded dicts.
 from flask import Flask, current_app, has_app_context
 from sqlalchemy import text
 from database.db_config import db, init_db
+from database.content_cache import week_content_cache
 from typing import Dict, List, Optional, Any
 
 
-def get_week_content(week_number: int, app: Flask = None) -> Dict[str, Any]:
+def get_week_content(week_number: int, app: Flask = None, use_cache: bool = True) -> Dict[str, Any]:
     """
     Get all content for a week (questions, prompts, welcome message, etc.)
     Returns a dict that matches the structure of hardcoded QUESTIONS and SYSTEM_PROMPTS.
     
+    Content is served from the shared week content cache and only loaded from the
+    database on a miss (or after the TTL expires / content is invalidated).
+    The returned dict is shared between callers - treat it as read-only.
+    
     Args:
         week_number: Week number (1-6)
         app: Flask app instance (required for database connection)
+        use_cache: Set to False to bypass the cache and read straight from the database
     
     Returns:
         {
@@ -27,6 +33,7 @@ def get_week_content(week_number: int, app: Flask = None) -> Dict[str, Any]:
             'final_response': str,
             'questions': {question_number: question_text, ...},
             'system_prompts': {question_number: {prompt_type: prompt_text, ...}, ...},
+            'validation_policies': {question_number: {'validation_type': str, 'prompt_text': str}, ...},
             'content_blocks': {block_name: content_text, ...}
         }
     """
@@ -37,80 +44,129 @@ def get_week_content(week_number: int, app: Flask = None) -> Dict[str, Any]:
         else:
             raise ValueError("Flask app instance required or must be in application context")
     
+    if not use_cache:
+        return _load_week_content(week_number, app)
+    
+    return week_content_cache.get(week_number, lambda week_num: _load_week_content(week_num, app))
+
+
+# Single round trip: questions, per-question prompts, validation policies and content blocks are
+# aggregated server-side. json_agg keeps prompt/question order (sort_order,
+# question_number) so the Python dicts match the old sequential loader.
+_WEEK_CONTENT_SQL = """
+    SELECT
+        w.week_number,
+        w.week_id,
+        w.welcome_message,
+        COALESCE((
+            SELECT json_agg(json_build_array(q.question_number, q.question_text) ORDER BY q.question_number)
+            FROM questions q
+            WHERE q.week_id = w.week_id
+        ), '[]'::json) AS questions,
+        COALESCE((
+            SELECT json_agg(json_build_array(qp.question_number, qp.prompts) ORDER BY qp.question_number)
+            FROM (
+                SELECT q.question_number,
+                       json_agg(json_build_array(sp.prompt_type, sp.prompt_text) ORDER BY sp.sort_order, sp.prompt_id) AS prompts
+                FROM system_prompts sp
+                JOIN questions q ON sp.question_id = q.question_id
+                WHERE q.week_id = w.week_id
+                GROUP BY q.question_number
+            ) qp
+        ), '[]'::json) AS system_prompts,
+        COALESCE((
+            SELECT json_agg(json_build_array(q.question_number, vp.validation_type, vp.prompt_text)
+                            ORDER BY q.question_number, vp.validation_id)
+            FROM validation_prompts vp
+            JOIN questions q ON vp.question_id = q.question_id
+            WHERE q.week_id = w.week_id
+        ), '[]'::json) AS validation_policies,
+        COALESCE((
+            SELECT jsonb_object_agg(b.block_name, b.content_text)
+            FROM week_content_blocks b
+            WHERE b.week_id = w.week_id
+        ), '{}'::jsonb) AS content_blocks
+    FROM weeks w
+"""
+
+
+def _row_to_week_content(row) -> Dict[str, Any]:
+    """Convert one aggregated week row into the get_week_content() dict structure."""
+    _, week_id, welcome_message, questions_json, prompts_json, policies_json, blocks_json = row
+    
+    questions = {qnum: qtext for qnum, qtext in questions_json}
+    
+    system_prompts = {}
+    for qnum, prompt_pairs in prompts_json:
+        # Later sort_order wins for duplicate prompt types (same as the old loader)
+        system_prompts[qnum] = {prompt_type: prompt_text for prompt_type, prompt_text in prompt_pairs}
+    
+    # Later rows win for a question with several validation_prompts rows
+    validation_policies = {}
+    for qnum, validation_type, prompt_text in policies_json:
+        validation_policies[qnum] = {'validation_type': validation_type, 'prompt_text': prompt_text}
+    
+    content_blocks = dict(blocks_json)
+    
+    return {
+        'week_id': week_id,
+        'welcome_message': welcome_message,
+        'final_response': content_blocks.get('FINAL_RESPONSE'),
+        'questions': questions,
+        'system_prompts': system_prompts,
+        'validation_policies': validation_policies,
+        'content_blocks': content_blocks
+    }
+
+
+def _load_week_content(week_number: int, app: Flask) -> Dict[str, Any]:
+    """Load all content for a week from the database in a single query (uncached)."""
     with app.app_context():
         with db.engine.connect() as conn:
-            # Get week - using week_number (not week_id) to ensure correct week
-            week_result = conn.execute(
-                text("SELECT week_id, welcome_message FROM weeks WHERE week_number = :week_num"),
+            # Filter on week_number (not week_id) to ensure correct week
+            row = conn.execute(
+                text(_WEEK_CONTENT_SQL + " WHERE w.week_number = :week_num"),
                 {'week_num': week_number}
-            )
-            week_row = week_result.fetchone()
-            if not week_row:
+            ).fetchone()
+            if not row:
                 raise ValueError(f"Week {week_number} not found in database")
-            
-            week_id = week_row[0]
-            welcome_message = week_row[1]
-            
-            # Get questions - linked via week_id (which corresponds to week_number=4)
-            questions_result = conn.execute(
-                text("""
-                    SELECT question_number, question_text 
-                    FROM questions 
-                    WHERE week_id = :week_id 
-                    ORDER BY question_number
-                """),
-                {'week_id': week_id}
-            )
-            questions = {row[0]: row[1] for row in questions_result}
-            
-            # Get system prompts organized by question
-            prompts_result = conn.execute(
-                text("""
-                    SELECT q.question_number, sp.prompt_type, sp.prompt_text, sp.scenario_name
-                    FROM system_prompts sp
-                    JOIN questions q ON sp.question_id = q.question_id
-                    WHERE q.week_id = :week_id
-                    ORDER BY q.question_number, sp.sort_order
-                """),
-                {'week_id': week_id}
-            )
-            
-            system_prompts = {}
-            for row in prompts_result:
-                qnum, prompt_type, prompt_text, scenario_name = row
-                if qnum not in system_prompts:
-                    system_prompts[qnum] = {}
-                system_prompts[qnum][prompt_type] = prompt_text
-            
-            # Get content blocks
-            blocks_result = conn.execute(
-                text("""
-                    SELECT block_name, content_text 
-                    FROM week_content_blocks 
-                    WHERE week_id = :week_id
-                """),
-                {'week_id': week_id}
-            )
-            content_blocks = {row[0]: row[1] for row in blocks_result}
-            
-            # Get final response (stored as a content block or in week metadata)
-            final_response = None
-            final_result = conn.execute(
-                text("SELECT content_text FROM week_content_blocks WHERE week_id = :week_id AND block_name = 'FINAL_RESPONSE'"),
-                {'week_id': week_id}
-            )
-            final_row = final_result.fetchone()
-            if final_row:
-                final_response = final_row[0]
-            
-            return {
-                'week_id': week_id,
-                'welcome_message': welcome_message,
-                'final_response': final_response,
-                'questions': questions,
-                'system_prompts': system_prompts,
-                'content_blocks': content_blocks
-            }
+            return _row_to_week_content(row)
+
+
+def load_all_weeks_content(app: Flask = None) -> Dict[int, Dict[str, Any]]:
+    """
+    Load content for every week in a single query (uncached).
+    
+    Args:
+        app: Flask app instance (required for database connection)
+    
+    Returns:
+        {week_number: week_content_dict, ...} - same structure as get_week_content()
+    """
+    if app is None:
+        if has_app_context():
+            app = current_app
+        else:
+            raise ValueError("Flask app instance required or must be in application context")
+    
+    with app.app_context():
+        with db.engine.connect() as conn:
+            rows = conn.execute(text(_WEEK_CONTENT_SQL + " ORDER BY w.week_number")).fetchall()
+    return {row[0]: _row_to_week_content(row) for row in rows}
+
+
+def preload_week_content(app: Flask = None) -> List[int]:
+    """
+    Warm the week content cache for all weeks with one database round trip.
+    
+    Returns:
+        List of week numbers that were loaded into the cache
+    """
+    token = week_content_cache.load_token()
+    all_content = load_all_weeks_content(app)
+    for week_number, content in all_content.items():
+        week_content_cache.put(week_number, content, token=token)
+    return sorted(all_content.keys())
 
 
 def get_question_prompts(week_number: int, question_number: int, app: Flask = None) -> Dict[str, str]:
@@ -149,6 +205,20 @@ def get_final_response(week_number: int, app: Flask = None) -> Optional[str]:
     return week_content.get('final_response')
 
 
+def invalidate_week_content(week_number: Optional[int] = None):
+    """
+    Drop cached week content so the next lookup reloads it from the database.
+    The week apps notice the change and reload their prompts on their next request.
+    
+    Args:
+        week_number: Week to invalidate, or None to invalidate every week
+    """
+    if week_number is None:
+        week_content_cache.invalidate_all()
+    else:
+        week_content_cache.invalidate(week_number)
+
+
 def format_prompt_with_variables(prompt_text: str, variables: Dict[str, str]) -> str:
     """
     Format a prompt string with variable substitutions.
@@ -202,7 +202,25 @@ CREATE INDEX idx_messages_session_week ON conversation_messages(session_id, week
 CREATE INDEX idx_messages_sender ON conversation_messages(sender);
 
 -- =====================================================
--- 9. VALIDATION PROMPTS (Optional - Can be in questions table)
+-- 9. USER PROGRESS (Progress Tracking)
+-- =====================================================
+-- One row per session, used by progress_tracker.py when PROGRESS_BACKEND=postgres
+-- progress_data JSONB structure matches ProgressTracker records:
+-- {
+--   "name": "User Name",
+--   "current_week": 2,
+--   "weeks": {"1": {"completed": true, "questions_completed": {"1": true}, ...}},
+--   "created_at": "...", "last_updated": "..."
+-- }
+
+CREATE TABLE IF NOT EXISTS user_progress (
+    session_id VARCHAR(255) PRIMARY KEY, -- Flask session ID
+    progress_data JSONB NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- =====================================================
+-- 10. VALIDATION PROMPTS (Optional - Can be in questions table)
 -- =====================================================
 -- Some weeks use separate validation prompts
 -- Can store here or in questions.validation_prompt field
@@ -292,5 +310,6 @@ COMMENT ON TABLE conversation_states IS 'Current conversation state per session/
 COMMENT ON TABLE user_answers IS 'User answers to questions (referenced in prompts via {Answer to question X})';
 COMMENT ON TABLE question_completions IS 'Question completion tracking (iterations, scenarios, completion status) - CRITICAL for flow control';
 COMMENT ON TABLE conversation_messages IS 'Full conversation history (user and NOVA messages)';
+COMMENT ON TABLE user_progress IS 'Per-session progress across weeks (PROGRESS_BACKEND=postgres)';
 
 
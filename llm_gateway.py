@@ -0,0 +1,1028 @@
+"""
+Shared LLM Gateway for the Week Apps
+
+Every LLM round trip (scenario classifiers, completeness validation and NOVA's
+responses) goes through this module so that connection reuse, timeouts, retries
+and accounting are handled in one place:
+- one OpenAI client per process on a keep-alive httpx connection pool
+- per-call-type timeouts and retry counts (classify / validate / respond)
+- retries with exponential backoff and full jitter on timeouts, connection
+  errors, rate limits and 5xx responses
+- a latency and token-usage record for every call, aggregated per call type
+- declarative per-question rules (classifier_rules) and a cache of classifier
+  results for repeated answers (classifier_cache) in front of the classifier
+- single-flight coalescing: identical requests already in flight share one
+  upstream call and its result
+- a per-turn deadline: each call's timeout is capped by the turn's remaining
+  budget, and a turn that runs out skips validation and answers with a canned
+  reply instead of stalling the learner
+- optional hedging: a duplicate request is sent when a call runs past the
+  call type's p95 latency, and whichever answers first wins
+- a circuit breaker per call type and model (circuit_breaker): while the
+  primary model is failing or slow, calls go to LLM_FALLBACK_MODEL or are
+  answered with canned replies and fallback scenarios (canned_replies)
+- typed judgements: classifiers return one of the question's known scenario
+  identifiers and validators a (complete, missing items) verdict, with short
+  output caps and a cheap re-ask when the output is malformed
+- a token-bucket limiter matching the org's request/token limits
+  (rate_limiter), queueing NOVA's replies ahead of classifiers and validation
+- a routing table of models per call type, week and question (model_router),
+  switching a call type to a faster tier while it is overloaded
+- optional token streaming of NOVA's responses to a per-thread sink (used by
+  the Server-Sent Events endpoint)
+
+Tuning is done with environment variables, e.g. LLM_TIMEOUT_RESPOND=30,
+LLM_RETRIES_CLASSIFY=2, LLM_MAX_CONNECTIONS=50.
+"""
+
+import os
+import re
+import json
+import hashlib
+import time
+import queue
+import random
+import threading
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+import openai
+from openai import OpenAI
+
+from canned_replies import canned_replies
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from classifier_cache import classifier_cache
+from classifier_rules import classifier_rules
+from context_window import context_window
+from model_router import ModelRouter
+from rate_limiter import estimate_tokens, rate_limiter
+
+DEFAULT_MODEL = "gpt-4o-mini"
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+# Per-call-type policy: read timeout (seconds), retries, default temperature and output limits.
+# Classifiers and validators return a few tokens, so they fail fast and are capped; responses are longer.
+CALL_POLICIES = {
+    "classify": {
+        "timeout": _env_float('LLM_TIMEOUT_CLASSIFY', 10),
+        "retries": _env_int('LLM_RETRIES_CLASSIFY', 2),
+        "temperature": 0.1,
+        "max_tokens": _env_int('LLM_MAX_TOKENS_CLASSIFY', 10),
+        "stop": ["\n"],
+    },
+    "validate": {
+        "timeout": _env_float('LLM_TIMEOUT_VALIDATE', 15),
+        "retries": _env_int('LLM_RETRIES_VALIDATE', 2),
+        "temperature": 0.3,
+        # No stop sequence: models often leave a blank line between COMPLETE: and MISSING:
+        "max_tokens": _env_int('LLM_MAX_TOKENS_VALIDATE', 150),
+    },
+    "respond": {
+        "timeout": _env_float('LLM_TIMEOUT_RESPOND', 30),
+        "retries": _env_int('LLM_RETRIES_RESPOND', 1),
+        "temperature": 0.7,
+    },
+}
+
+# Errors worth retrying: the request may succeed on a second attempt
+RETRYABLE_ERRORS = (
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+# Shown instead of NOVA's reply when the turn's time budget runs out
+DEADLINE_REPLY = (
+    "I'm sorry, that took me longer than it should have. "
+    "Could you send your answer again so I can respond properly?"
+)
+
+# Verdict used in place of an LLM validation the turn has no time left for (skip validation)
+SKIPPED_VALIDATION = "COMPLETE: Yes\nMISSING: None"
+
+# Scenario assumed when the classifier is unavailable and the question has no
+# classifier_fallback row (unless its prompt offers others, the first one it lists)
+DEFAULT_SCENARIO = "SCENARIO_1"
+
+# Don't start a call with less than this many seconds of the turn's budget left
+MIN_CALL_BUDGET = 0.5
+
+# A call taking more than this fraction of its call type's timeout counts as slow for the circuit breaker
+SLOW_CALL_FRACTION = 0.5
+
+
+class DeadlineExceeded(Exception):
+    """The turn's time budget ran out before (or while) making an LLM call."""
+
+
+CLASSIFIER_SYSTEM_PROMPT = "You are a scenario classifier. Respond with only the scenario identifier."
+
+# Re-asks after a malformed classifier or validator answer (each is a capped, few-token call)
+JUDGEMENT_RETRIES = _env_int('LLM_JUDGEMENT_RETRIES', 1)
+
+_SCENARIO_ID = re.compile(r"SCENARIO_[A-Z0-9]+")
+# Also accepts near misses like "Scenario 2" or "SCENARIO-2"
+_SCENARIO_ANSWER = re.compile(r"SCENARIO[\s_\-]*([A-Z0-9]+)\b")
+_COMPLETE_LINE = re.compile(r"COMPLETE\s*:\s*\**\s*(YES|NO)\b", re.IGNORECASE)
+_MISSING_LINE = re.compile(r"MISSING\s*:\s*(.*)", re.IGNORECASE | re.DOTALL)
+_LIST_MARKER = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s*")
+_FUSED_REPLY = re.compile(r'"reply"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_NOTHING_MISSING = {"", "none", "n/a", "na", "nothing", "-"}
+
+VALIDATION_FORMAT_REMINDER = "Answer again using exactly this format:\nCOMPLETE: Yes or No\nMISSING: the missing items, or None"
+
+# Structured output for fused respond-and-validate calls
+FUSED_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "nova_turn",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "reply": {"type": "string"},
+                "complete": {"type": "boolean"},
+                "missing": {"type": "string"},
+            },
+            "required": ["reply", "complete", "missing"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+FUSED_INSTRUCTIONS = """
+
+---
+In the same answer, also judge whether the learner has now answered the current question completely,
+using the validation instructions below. Ignore any output format they describe and return JSON instead:
+- "reply": your message to the learner, exactly as you would otherwise write it
+- "complete": true or false
+- "missing": the specific items still missing, or "None"
+
+{question}
+Learner's responses so far:
+{responses}
+
+Validation instructions:
+{validation_prompt}"""
+
+
+class LLMResult:
+    """Text returned by a call plus its latency/usage record."""
+
+    __slots__ = ('text', 'record')
+
+    def __init__(self, text: str, record: Dict[str, Any]):
+        self.text = text
+        self.record = record
+
+
+class Judgement:
+    """A parsed completeness verdict: complete or not, plus the items still missing."""
+
+    __slots__ = ('complete', 'missing')
+
+    def __init__(self, complete: bool, missing: List[str]):
+        self.complete = complete
+        self.missing = missing
+
+    @property
+    def missing_text(self) -> str:
+        """The missing items as the week modules report them ("None" when nothing is missing)."""
+        return "; ".join(self.missing) if self.missing else "None"
+
+    def __repr__(self) -> str:
+        return f"Judgement(complete={self.complete}, missing={self.missing})"
+
+
+class MalformedJudgement(ValueError):
+    """A classifier or validator answer that doesn't fit the expected format."""
+
+
+def extract_fused_reply(text: str) -> Optional[str]:
+    """The "reply" string of a fused response whose JSON is otherwise unusable (None if it is cut off)."""
+    try:
+        result = json.loads(text)
+        if isinstance(result, dict) and isinstance(result.get("reply"), str):
+            return result["reply"].strip() or None
+    except ValueError:
+        pass
+    match = _FUSED_REPLY.search(text or "")
+    if not match:
+        return None
+    try:
+        return json.loads(f'"{match.group(1)}"').strip() or None
+    except ValueError:
+        return None
+
+
+def known_scenarios(classifier_prompt: str) -> List[str]:
+    """The scenario identifiers a classifier prompt offers (e.g. SCENARIO_1..SCENARIO_3), in order."""
+    return list(dict.fromkeys(_SCENARIO_ID.findall(classifier_prompt or "")))
+
+
+def parse_scenario(text: str, scenarios: Optional[List[str]] = None) -> str:
+    """
+    Extract the scenario identifier from a classifier answer.
+
+    Raises:
+        MalformedJudgement: No identifier, or one outside `scenarios`
+    """
+    for suffix in _SCENARIO_ANSWER.findall((text or "").upper()):
+        scenario = f"SCENARIO_{suffix}"
+        if not scenarios or scenario in scenarios:
+            return scenario
+    raise MalformedJudgement(f"expected one of {scenarios or 'SCENARIO_<n>'}, got {text!r}")
+
+
+def parse_judgement(text: str) -> Judgement:
+    """
+    Parse a "COMPLETE: Yes/No / MISSING: ..." validator answer.
+
+    Raises:
+        MalformedJudgement: No COMPLETE line
+    """
+    complete = _COMPLETE_LINE.search(text or "")
+    if complete is None:
+        raise MalformedJudgement(f"no COMPLETE line in {text!r}")
+    missing_match = _MISSING_LINE.search(text)
+    missing = []
+    if missing_match:
+        for line in re.split(r"[\n;]", missing_match.group(1)):
+            item = _LIST_MARKER.sub("", line).strip()
+            if item.lower().rstrip(".") not in _NOTHING_MISSING:
+                missing.append(item)
+    return Judgement(complete.group(1).upper() == "YES", missing)
+
+
+class SingleFlight:
+    """Lets concurrent callers with the same key share one execution of a function."""
+
+    class _Call:
+        __slots__ = ('done', 'result', 'error', 'waiters')
+
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error: Optional[BaseException] = None
+            self.waiters = 0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, "SingleFlight._Call"] = {}
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable[[], Any], wait_timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        Run fn() unless an identical call is already running, in which case wait for its result.
+
+        Returns:
+            (result, shared) - shared is True when the result came from another caller's call
+
+        Raises:
+            Whatever fn() raised (for the leader and every waiter), or TimeoutError
+            if a waiter gave up before the leader finished
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = SingleFlight._Call()
+            else:
+                call.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            if not call.done.wait(wait_timeout):
+                raise TimeoutError("timed out waiting for an identical in-flight LLM call")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+class LLMGateway:
+    """Process-wide OpenAI client with pooled connections, timeouts, retries and usage records."""
+
+    def __init__(self, model: Optional[str] = None, history_size: int = 200):
+        self._model = model
+        self._client: Optional[OpenAI] = None
+        self._client_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.backoff_base = _env_float('LLM_BACKOFF_BASE', 0.5)
+        self.backoff_max = _env_float('LLM_BACKOFF_MAX', 4.0)
+        self.recent_calls = deque(maxlen=history_size)
+        self._totals: Dict[str, Dict[str, Any]] = {}
+        # Return the reply and the completeness verdict from one structured call
+        self.fused_validation = os.getenv('LLM_FUSED_VALIDATION', '0') == '1'
+        self._local = threading.local()
+        # Share one upstream call between identical concurrent requests
+        self.single_flight = os.getenv('LLM_SINGLE_FLIGHT', '1') == '1'
+        self._flights = SingleFlight()
+        # End-to-end budget for one process_response turn (seconds)
+        self.turn_budget = _env_float('LLM_TURN_BUDGET', 45)
+        # Hedged duplicate requests once a call passes the call type's p-th percentile latency
+        self.hedging = os.getenv('LLM_HEDGE', '0') == '1'
+        self.hedge_percentile = _env_float('LLM_HEDGE_PERCENTILE', 95)
+        self.hedge_min_samples = _env_int('LLM_HEDGE_MIN_SAMPLES', 20)
+        self._latencies: Dict[str, deque] = {}
+        # Cheaper/faster model used while the primary model's breaker is open
+        self.fallback_model = os.getenv('LLM_FALLBACK_MODEL') or None
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self.router = ModelRouter(lambda: self.model)
+
+    @property
+    def model(self) -> str:
+        return self._model or os.getenv("OPENAI_MODEL", DEFAULT_MODEL)
+
+    @property
+    def client(self) -> OpenAI:
+        """The shared OpenAI client (created on first use, after .env has been loaded)."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._create_client()
+        return self._client
+
+    def _create_client(self) -> OpenAI:
+        limits = httpx.Limits(
+            max_connections=_env_int('LLM_MAX_CONNECTIONS', 50),
+            max_keepalive_connections=_env_int('LLM_MAX_KEEPALIVE', 20),
+            keepalive_expiry=_env_float('LLM_KEEPALIVE_EXPIRY', 30),
+        )
+        timeout = httpx.Timeout(
+            CALL_POLICIES["respond"]["timeout"],
+            connect=_env_float('LLM_CONNECT_TIMEOUT', 5),
+        )
+        http_client = openai.DefaultHttpxClient(limits=limits, timeout=timeout)
+        # Retries are handled here (with jitter and per-call-type limits), not by the SDK
+        return OpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client, max_retries=0)
+
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    # -- turn deadline ------------------------------------------------------
+
+    @contextmanager
+    def deadline(self, seconds: Optional[float] = None):
+        """Give every LLM call made by this thread inside the block a shared time budget."""
+        previous = getattr(self._local, 'deadline', None)
+        budget = self.turn_budget if seconds is None else seconds
+        self._local.deadline = time.monotonic() + budget if budget > 0 else None
+        try:
+            yield
+        finally:
+            self._local.deadline = previous
+
+    def turn_deadline(self, seconds: Optional[float] = None) -> Callable:
+        """Decorate a view so its LLM calls share one deadline (LLM_TURN_BUDGET seconds by default)."""
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                with self.deadline(seconds):
+                    return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def remaining_budget(self) -> Optional[float]:
+        """Seconds left in the current turn's budget, or None when no deadline is set."""
+        deadline = getattr(self._local, 'deadline', None)
+        return None if deadline is None else deadline - time.monotonic()
+
+    def _call_timeout(self, call_type: str, policy: Dict[str, Any]) -> float:
+        """The call type's timeout capped by the turn's remaining budget."""
+        remaining = self.remaining_budget()
+        if remaining is None:
+            return policy["timeout"]
+        if remaining < MIN_CALL_BUDGET:
+            raise DeadlineExceeded(f"no time left in this turn for a {call_type} call")
+        return min(policy["timeout"], remaining)
+
+    def _out_of_budget(self, delay: float) -> bool:
+        """Whether waiting `delay` seconds would leave too little of the turn's budget for another attempt."""
+        remaining = self.remaining_budget()
+        return remaining is not None and remaining - delay < MIN_CALL_BUDGET
+
+    # -- circuit breakers ---------------------------------------------------
+
+    def _breaker(self, call_type: str, model: str) -> CircuitBreaker:
+        with self._stats_lock:
+            breaker = self._breakers.get((call_type, model))
+            if breaker is None:
+                policy = CALL_POLICIES.get(call_type, CALL_POLICIES["respond"])
+                breaker = self._breakers[(call_type, model)] = CircuitBreaker(
+                    f"{call_type}/{model}", slow_seconds=policy["timeout"] * SLOW_CALL_FRACTION
+                )
+            return breaker
+
+    def _route(self, call_type: str, model: str) -> str:
+        """
+        Pick the model for a call: the requested one, or the fallback model while its breaker is open.
+
+        Raises:
+            CircuitOpenError: Both breakers are open (or there is no fallback model)
+        """
+        if self._breaker(call_type, model).allow():
+            return model
+        fallback = self.fallback_model
+        if fallback and fallback != model and self._breaker(call_type, fallback).allow():
+            print(f"[LLM] Circuit {call_type}/{model} open, using fallback model {fallback}")
+            return fallback
+        raise CircuitOpenError(f"circuit open for {call_type} calls to {model}")
+
+    def complete(self, messages: List[Dict[str, str]], call_type: str = "respond",
+                 temperature: Optional[float] = None, model: Optional[str] = None,
+                 week: Optional[int] = None, question: Optional[int] = None,
+                 **kwargs) -> LLMResult:
+        """
+        Run one chat completion under the policy for `call_type`.
+
+        Identical requests (model, messages, temperature and options) made while
+        one is in flight wait for it and share its result (LLM_SINGLE_FLIGHT=1).
+
+        Args:
+            messages: Chat messages
+            call_type: "classify", "validate" or "respond"
+            temperature: Override for the call type's default temperature
+            model: Override for the routed model (see model_router)
+            week: Week number, for per-week routes
+            question: Question number, for per-question routes
+            **kwargs: Passed through to chat.completions.create
+
+        Returns:
+            LLMResult with the stripped response text and its usage record
+
+        Raises:
+            The last OpenAI error once retries are exhausted, DeadlineExceeded
+            when the turn's budget runs out, or CircuitOpenError when the model
+            (and the fallback model) are unavailable
+        """
+        policy = CALL_POLICIES.get(call_type, CALL_POLICIES["respond"])
+        model = self._route(call_type, model or self.router.select(call_type, policy["timeout"], week, question))
+        temperature = policy["temperature"] if temperature is None else temperature
+        for limit in ("max_tokens", "stop"):
+            if policy.get(limit) and limit not in kwargs:
+                kwargs[limit] = policy[limit]
+
+        if not self.single_flight:
+            return self._complete(messages, call_type, policy, model, temperature, kwargs)
+
+        key = self._flight_key(model, messages, temperature, kwargs)
+        # Waiters give up once the leader has had time for all of its attempts
+        wait_timeout = (policy["timeout"] + self.backoff_max) * (policy["retries"] + 1)
+        remaining = self.remaining_budget()
+        if remaining is not None:
+            wait_timeout = max(0.0, min(wait_timeout, remaining))
+        try:
+            result, shared = self._flights.do(
+                key,
+                lambda: self._complete(messages, call_type, policy, model, temperature, kwargs),
+                wait_timeout=wait_timeout
+            )
+        except TimeoutError as e:
+            if self._out_of_budget(0):
+                raise DeadlineExceeded(f"no time left in this turn to wait for the {call_type} call") from e
+            raise
+        if shared:
+            self._count(call_type, "coalesced")
+            print(f"[LLM] {call_type} call shared with an identical in-flight request")
+        return result
+
+    @staticmethod
+    def _flight_key(model: str, messages: List[Dict[str, str]], temperature: float, kwargs: Dict[str, Any]) -> str:
+        """Hash of everything that determines the upstream request."""
+        payload = json.dumps([model, messages, temperature, kwargs], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _complete(self, messages: List[Dict[str, str]], call_type: str, policy: Dict[str, Any],
+                  model: str, temperature: float, kwargs: Dict[str, Any]) -> LLMResult:
+        """One chat completion with retries (no coalescing), counted as in flight for routing."""
+        with self.router.track(call_type):
+            return self._attempt(messages, call_type, policy, model, temperature, kwargs)
+
+    def _attempt(self, messages: List[Dict[str, str]], call_type: str, policy: Dict[str, Any],
+                 model: str, temperature: float, kwargs: Dict[str, Any]) -> LLMResult:
+        """Send the request, retrying under the call type's policy."""
+        started = time.perf_counter()
+        attempt = 0
+        estimated_tokens = estimate_tokens(messages, kwargs.get('max_tokens'))
+        while True:
+            try:
+                self._throttle(call_type, estimated_tokens)
+                timeout = self._call_timeout(call_type, policy)
+                response = self._create(call_type, timeout, dict(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    timeout=timeout,
+                    **kwargs
+                ), estimated_tokens)
+                break
+            except RETRYABLE_ERRORS as e:
+                delay = self._backoff(attempt)
+                out_of_budget = self._out_of_budget(delay)
+                if attempt >= policy["retries"] or out_of_budget:
+                    self._record(call_type, model, started, attempt + 1, None, error=e)
+                    if out_of_budget:
+                        raise DeadlineExceeded(f"no time left in this turn to retry the {call_type} call") from e
+                    raise
+                print(f"[LLM] {call_type} attempt {attempt + 1} failed ({type(e).__name__}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+            except Exception as e:
+                self._record(call_type, model, started, attempt + 1, None, error=e)
+                raise
+
+        text = (response.choices[0].message.content or "").strip()
+        record = self._record(call_type, model, started, attempt + 1, getattr(response, 'usage', None))
+        rate_limiter.settle(estimated_tokens, record["total_tokens"])
+        return LLMResult(text, record)
+
+    def _throttle(self, call_type: str, estimated_tokens: int):
+        """Wait for rate limit capacity, for no longer than the turn has left."""
+        remaining = self.remaining_budget()
+        max_wait = None if remaining is None else max(0.0, remaining - MIN_CALL_BUDGET)
+        rate_limiter.acquire(call_type, estimated_tokens, max_wait)
+
+    def _create(self, call_type: str, timeout: float, params: Dict[str, Any], estimated_tokens: int = 0):
+        """
+        Send one request, hedged with a duplicate if it runs past the call type's tail latency.
+
+        The duplicate takes its own rate limiter capacity (and is skipped when none is
+        free right away), counts as in flight while it runs, and whichever request
+        loses settles its own token usage when it finishes.
+        """
+        hedge_after = self._hedge_delay(call_type)
+        if hedge_after is None or hedge_after >= timeout:
+            sent = time.perf_counter()
+            response = self.client.chat.completions.create(**params)
+            self._observe_latency(call_type, time.perf_counter() - sent)
+            return response
+
+        results: "queue.Queue" = queue.Queue()
+        finished_lock = threading.Lock()
+        finished = []
+
+        def send(hedge: bool):
+            sent = time.perf_counter()
+            try:
+                if hedge:
+                    with self.router.track(call_type):
+                        response = self.client.chat.completions.create(**params)
+                else:
+                    response = self.client.chat.completions.create(**params)
+            except Exception as e:
+                results.put((hedge, None, e, None))
+                return
+            with finished_lock:
+                # The first successful response is the one _create returns; a later one is the loser
+                lost = bool(finished)
+                finished.append(hedge)
+                results.put((hedge, response, None, time.perf_counter() - sent))
+            if lost:
+                usage = getattr(response, 'usage', None)
+                rate_limiter.settle(estimated_tokens, getattr(usage, 'total_tokens', 0) or 0)
+
+        threading.Thread(target=send, args=(False,), daemon=True).start()
+        outstanding = 1
+        try:
+            outcome = results.get(timeout=hedge_after)
+        except queue.Empty:
+            if rate_limiter.try_acquire(call_type, estimated_tokens):
+                print(f"[LLM] {call_type} call passed {hedge_after:.2f}s (p{self.hedge_percentile:g}), "
+                      f"sending a hedged request")
+                threading.Thread(target=send, args=(True,), daemon=True).start()
+                outstanding = 2
+                self._count(call_type, "hedged")
+            else:
+                # No rate limit capacity to spare - a hedge now would only add to the 429s
+                self._count(call_type, "hedges_skipped")
+            outcome = results.get()
+        outstanding -= 1
+        if outcome[2] is not None and outstanding:
+            # The other request may still succeed
+            outcome = results.get()
+        hedge, response, error, latency = outcome
+        if error is not None:
+            raise error
+        if hedge:
+            self._count(call_type, "hedge_wins")
+        self._observe_latency(call_type, latency)
+        return response
+
+    def _hedge_delay(self, call_type: str) -> Optional[float]:
+        """Latency after which to send a hedged request, or None when hedging is off or has too few samples."""
+        if not self.hedging:
+            return None
+        with self._stats_lock:
+            samples = sorted(self._latencies.get(call_type, ()))
+        if len(samples) < self.hedge_min_samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * self.hedge_percentile / 100))
+        return samples[index]
+
+    def _observe_latency(self, call_type: str, seconds: float):
+        with self._stats_lock:
+            self._latencies.setdefault(call_type, deque(maxlen=200)).append(seconds)
+
+    def _count(self, call_type: str, counter: str):
+        with self._stats_lock:
+            totals = self._totals.get(call_type)
+            if totals is not None:
+                totals[counter] += 1
+
+    def complete_streaming(self, messages: List[Dict[str, str]], on_token: Callable[[str], None],
+                           call_type: str = "respond", temperature: Optional[float] = None,
+                           model: Optional[str] = None, week: Optional[int] = None,
+                           question: Optional[int] = None) -> LLMResult:
+        """
+        Like complete(), but passes each content delta to on_token as it arrives.
+
+        A failed attempt is only retried if no tokens were emitted yet, so the
+        receiver never sees a partial answer repeated.
+
+        Returns:
+            LLMResult with the full stripped text and its usage record
+        """
+        policy = CALL_POLICIES.get(call_type, CALL_POLICIES["respond"])
+        model = self._route(call_type, model or self.router.select(call_type, policy["timeout"], week, question))
+        temperature = policy["temperature"] if temperature is None else temperature
+        with self.router.track(call_type):
+            return self._stream(messages, on_token, call_type, policy, model, temperature)
+
+    def _stream(self, messages: List[Dict[str, str]], on_token: Callable[[str], None], call_type: str,
+                policy: Dict[str, Any], model: str, temperature: float) -> LLMResult:
+        """One streamed chat completion with retries."""
+        started = time.perf_counter()
+        attempt = 0
+        emitted = False
+        estimated_tokens = estimate_tokens(messages)
+        while True:
+            parts: List[str] = []
+            usage = None
+            try:
+                self._throttle(call_type, estimated_tokens)
+                stream = self.client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    timeout=self._call_timeout(call_type, policy),
+                    stream=True,
+                    stream_options={"include_usage": True}
+                )
+                for chunk in stream:
+                    if getattr(chunk, 'usage', None):
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        emitted = True
+                        on_token(delta)
+                break
+            except RETRYABLE_ERRORS as e:
+                delay = self._backoff(attempt)
+                out_of_budget = self._out_of_budget(delay)
+                if emitted or attempt >= policy["retries"] or out_of_budget:
+                    self._record(call_type, model, started, attempt + 1, None, error=e)
+                    if out_of_budget and not emitted:
+                        raise DeadlineExceeded(f"no time left in this turn to retry the {call_type} call") from e
+                    raise
+                print(f"[LLM] {call_type} stream attempt {attempt + 1} failed ({type(e).__name__}), retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+            except Exception as e:
+                self._record(call_type, model, started, attempt + 1, None, error=e)
+                raise
+
+        record = self._record(call_type, model, started, attempt + 1, usage)
+        rate_limiter.settle(estimated_tokens, record["total_tokens"])
+        return LLMResult("".join(parts).strip(), record)
+
+    @contextmanager
+    def stream_to(self, on_token: Callable[[str], None]):
+        """Stream every respond() call made by this thread inside the block to on_token."""
+        previous = getattr(self._local, 'token_sink', None)
+        self._local.token_sink = on_token
+        try:
+            yield
+        finally:
+            self._local.token_sink = previous
+
+    def _record(self, call_type: str, model: str, started: float, attempts: int,
+                usage: Any, error: Optional[Exception] = None) -> Dict[str, Any]:
+        record = {
+            "call_type": call_type,
+            "model": model,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+            "attempts": attempts,
+            "prompt_tokens": getattr(usage, 'prompt_tokens', 0) or 0,
+            "completion_tokens": getattr(usage, 'completion_tokens', 0) or 0,
+            "total_tokens": getattr(usage, 'total_tokens', 0) or 0,
+            "success": error is None,
+            "error": type(error).__name__ if error else None,
+            "at": datetime.now().isoformat(),
+        }
+        with self._stats_lock:
+            self.recent_calls.append(record)
+            totals = self._totals.setdefault(call_type, {
+                "calls": 0, "errors": 0, "retries": 0, "coalesced": 0, "hedged": 0, "hedge_wins": 0,
+                "hedges_skipped": 0,
+                "latency_ms": 0.0, "max_latency_ms": 0.0,
+                "prompt_tokens": 0, "completion_tokens": 0,
+            })
+            totals["calls"] += 1
+            totals["errors"] += 0 if error is None else 1
+            totals["retries"] += attempts - 1
+            totals["latency_ms"] += record["latency_ms"]
+            totals["max_latency_ms"] = max(totals["max_latency_ms"], record["latency_ms"])
+            totals["prompt_tokens"] += record["prompt_tokens"]
+            totals["completion_tokens"] += record["completion_tokens"]
+        # Errors that aren't the provider's fault (bad requests, our own deadline) don't move the breaker
+        failed = False if error is None else (True if isinstance(error, RETRYABLE_ERRORS) else None)
+        self._breaker(call_type, model).record(record["latency_ms"] / 1000, failed)
+        if failed is not None:
+            self.router.observe(call_type, model, record["latency_ms"] / 1000)
+        return record
+
+    # -- helpers used by the week modules ---------------------------------
+
+    def classify(self, classifier_prompt: str, user_message: str, temperature: Optional[float] = None,
+                 week: Optional[int] = None, question: Optional[int] = None) -> str:
+        """
+        Run a scenario classifier and return the identifier in upper case (e.g. "SCENARIO_1").
+
+        Trivial answers are classified by the question's rules when one matches
+        confidently. Otherwise results are cached per (week, question, prompt
+        version, normalized answer), so a repeated short answer doesn't need
+        another round trip.
+
+        The answer must be one of the scenario identifiers the classifier prompt
+        offers; anything else is re-asked (LLM_JUDGEMENT_RETRIES). If it is still
+        malformed, the raw answer is returned for the week module's default branch.
+
+        If the classifier can't be reached (breaker open, turn out of time, retries
+        used up), the question's classifier_fallback scenario is returned, or the
+        first scenario the prompt offers when it has none.
+        """
+        scenario = classifier_rules.classify(week, question, user_message)
+        if scenario is not None:
+            return scenario
+
+        model = self.router.select("classify", CALL_POLICIES["classify"]["timeout"], week, question)
+        effective_temperature = CALL_POLICIES["classify"]["temperature"] if temperature is None else temperature
+        cache_key = classifier_cache.make_key(week, question, classifier_prompt, user_message,
+                                              model, effective_temperature)
+        cached = classifier_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        scenarios = known_scenarios(classifier_prompt)
+        messages = [
+            {"role": "system", "content": CLASSIFIER_SYSTEM_PROMPT},
+            {"role": "user", "content": f"{classifier_prompt}\n\nUser's response: {user_message}"}
+        ]
+        try:
+            for attempt in range(JUDGEMENT_RETRIES + 1):
+                result = self.complete(messages, call_type="classify", temperature=temperature, model=model,
+                                       week=week, question=question)
+                try:
+                    scenario = parse_scenario(result.text, scenarios)
+                    break
+                except MalformedJudgement as e:
+                    print(f"[LLM] Malformed classifier answer for week {week} Q{question}: {e}")
+                    messages = messages + [
+                        {"role": "assistant", "content": result.text},
+                        {"role": "user", "content": f"Respond with only one of: {', '.join(scenarios) or 'SCENARIO_<n>'}"}
+                    ]
+            else:
+                return result.text.upper()
+        except (CircuitOpenError, DeadlineExceeded) + RETRYABLE_ERRORS as e:
+            scenario = canned_replies.scenario(week, question)
+            if scenario is None:
+                # Same as the week modules' missing-scenario branch: the first scenario offered
+                scenario = scenarios[0] if scenarios else DEFAULT_SCENARIO
+            print(f"[LLM] Classifier unavailable ({type(e).__name__}), assuming {scenario} for week {week} Q{question}")
+            canned_replies.count_served("classifier_fallback")
+            return scenario
+        if result.record["model"] == model:
+            # Don't let fallback-model answers outlive the brownout
+            classifier_cache.put(cache_key, scenario)
+        return scenario
+
+    def validate(self, system_prompt: str, user_content: str, temperature: Optional[float] = None,
+                 week: Optional[int] = None, question: Optional[int] = None) -> str:
+        """Run a completeness validation prompt and return the raw verdict text (complete if the turn is out of time)."""
+        return self._validate([
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content}
+        ], temperature, week, question)
+
+    def _validate(self, messages: List[Dict[str, str]], temperature: Optional[float],
+                  week: Optional[int], question: Optional[int]) -> str:
+        try:
+            return self.complete(messages, call_type="validate", temperature=temperature,
+                                 week=week, question=question).text
+        except (DeadlineExceeded, CircuitOpenError) as e:
+            print(f"[LLM] Skipping validation: {e}")
+            return SKIPPED_VALIDATION
+
+    def judge_completeness(self, system_prompt: str, user_content: str, temperature: Optional[float] = None,
+                           week: Optional[int] = None, question: Optional[int] = None) -> Judgement:
+        """
+        Run a completeness validation prompt and return its parsed verdict.
+
+        A malformed answer is re-asked with a reminder of the format
+        (LLM_JUDGEMENT_RETRIES times).
+
+        Raises:
+            MalformedJudgement: The answer was still malformed after the re-asks
+        """
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content}
+        ]
+        for attempt in range(JUDGEMENT_RETRIES + 1):
+            text = self._validate(messages, temperature, week, question)
+            try:
+                return parse_judgement(text)
+            except MalformedJudgement as e:
+                print(f"[LLM] Malformed validation answer for week {week} Q{question}: {e}")
+                if attempt == JUDGEMENT_RETRIES:
+                    raise
+                messages = messages + [
+                    {"role": "assistant", "content": text},
+                    {"role": "user", "content": VALIDATION_FORMAT_REMINDER}
+                ]
+
+    def respond(self, system_prompt: str, user_message: str, temperature: Optional[float] = None,
+                canned: Optional[str] = None, week: Optional[int] = None, question: Optional[int] = None) -> str:
+        """
+        Generate NOVA's response (streamed token by token inside a stream_to() block).
+
+        Args:
+            canned: Reply to use instead when the LLM is unavailable (see canned_replies)
+        """
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message}
+        ]
+        token_sink = getattr(self._local, 'token_sink', None)
+        try:
+            if token_sink is not None:
+                return self.complete_streaming(messages, token_sink, call_type="respond", temperature=temperature,
+                                               week=week, question=question).text
+            return self.complete(messages, call_type="respond", temperature=temperature,
+                                 week=week, question=question).text
+        except DeadlineExceeded as e:
+            print(f"[LLM] Using canned reply: {e}")
+            return canned or DEADLINE_REPLY
+        except (CircuitOpenError,) + RETRYABLE_ERRORS as e:
+            if canned is None:
+                raise
+            print(f"[LLM] Using canned reply: {type(e).__name__}")
+            canned_replies.count_served("reply")
+            return canned
+
+    def respond_and_validate(self, system_prompt: str, user_message: str, validation_prompt: str,
+                             question: str, user_responses: List[str], canned: Optional[str] = None,
+                             week: Optional[int] = None, question_number: Optional[int] = None) -> str:
+        """
+        Generate NOVA's response and judge completeness in one structured-output call.
+
+        The verdict is kept for the current request and picked up by take_verdict()
+        when validate_completeness reaches the same validation prompt.
+
+        Returns:
+            NOVA's reply
+        """
+        responses = (context_window.responses_section(user_responses, "respond", week, question_number).rstrip("\n")
+                     or "  (none)")
+        fused_prompt = system_prompt + FUSED_INSTRUCTIONS.format(
+            question=question, responses=responses, validation_prompt=validation_prompt
+        )
+        try:
+            text = self.complete(
+                [
+                    {"role": "system", "content": fused_prompt},
+                    {"role": "user", "content": user_message}
+                ],
+                call_type="respond",
+                week=week,
+                question=question_number,
+                response_format=FUSED_RESPONSE_FORMAT
+            ).text
+        except DeadlineExceeded as e:
+            print(f"[LLM] Using canned reply: {e}")
+            return canned or DEADLINE_REPLY
+        except (CircuitOpenError,) + RETRYABLE_ERRORS as e:
+            if canned is None:
+                raise
+            print(f"[LLM] Using canned reply: {type(e).__name__}")
+            canned_replies.count_served("reply")
+            return canned
+        try:
+            result = json.loads(text)
+            reply = str(result["reply"]).strip()
+            verdict = (bool(result["complete"]), str(result.get("missing") or "None").strip() or "None")
+        except (ValueError, KeyError, TypeError) as e:
+            # No verdict: validate_completeness falls back to a separate validation call.
+            # Only coaching text goes to the learner - the reply field if it is intact,
+            # otherwise a plain respond() call
+            reply = extract_fused_reply(text)
+            print(f"[LLM] Could not parse fused response ({e}), "
+                  f"{'using its reply' if reply else 'generating the reply separately'} and validating separately")
+            if reply:
+                return reply
+            return self.respond(system_prompt, user_message, canned=canned, week=week, question=question_number)
+        self._verdicts()[validation_prompt] = verdict
+        return reply
+
+    def _verdicts(self) -> Dict[str, Tuple[bool, str]]:
+        """Verdicts from fused calls, scoped to the current request (or thread outside Flask)."""
+        try:
+            from flask import g, has_app_context
+            if has_app_context():
+                if 'fused_verdicts' not in g:
+                    g.fused_verdicts = {}
+                return g.fused_verdicts
+        except ImportError:
+            pass
+        if not hasattr(self._local, 'verdicts'):
+            self._local.verdicts = {}
+        return self._local.verdicts
+
+    def take_verdict(self, validation_prompt: str) -> Optional[Tuple[bool, str]]:
+        """Return (and forget) the fused verdict for this validation prompt, if there is one."""
+        return self._verdicts().pop(validation_prompt, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return per-call-type counters, average/max latency and token usage."""
+        hedge_after = {call_type: self._hedge_delay(call_type) for call_type in list(self._latencies)}
+        breakers = list(self._breakers.values())
+        with self._stats_lock:
+            by_type = {}
+            for call_type, totals in self._totals.items():
+                by_type[call_type] = {
+                    **totals,
+                    "avg_latency_ms": round(totals["latency_ms"] / totals["calls"], 1) if totals["calls"] else 0,
+                }
+            return {
+                "model": self.model,
+                "fused_validation": self.fused_validation,
+                "turn_budget_seconds": self.turn_budget,
+                "hedging": {"enabled": self.hedging, "percentile": self.hedge_percentile,
+                            "after_seconds": hedge_after},
+                "single_flight": {"enabled": self.single_flight, "in_flight": self._flights.in_flight(),
+                                  "coalesced": self._flights.coalesced},
+                "routing": self.router.stats(),
+                "rate_limiter": rate_limiter.stats(),
+                "context_window": context_window.stats(),
+                "fallback_model": self.fallback_model,
+                "circuit_breakers": {breaker.name: breaker.snapshot() for breaker in breakers},
+                "canned_replies": canned_replies.stats(),
+                "classifier_rules": classifier_rules.stats(),
+                "classifier_cache": classifier_cache.stats(),
+                "policies": CALL_POLICIES,
+                "by_call_type": by_type,
+                "recent_calls": list(self.recent_calls)[-20:],
+            }
+
+
+# Global instance shared by every week app in the process
+llm_gateway = LLMGateway()
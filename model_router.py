@@ -0,0 +1,174 @@
+"""
+Load-Aware Model Routing for LLM Calls
+
+Classifier and validator calls return a handful of tokens and make up most of
+the traffic; NOVA's coaching replies are the only calls that benefit from a
+bigger model. ModelRouter picks the model for each call from a routing table:
+
+    LLM_MODEL_CLASSIFY / LLM_MODEL_VALIDATE / LLM_MODEL_RESPOND
+        Model per call type (default: OPENAI_MODEL)
+    LLM_MODEL_ROUTES
+        JSON overrides per week or question, most specific first:
+        {"respond:3": "gpt-4o", "respond:3:17": "gpt-4o-mini", "validate:5": "gpt-4o-mini"}
+
+Under load a call type switches to its fast tier (LLM_FAST_MODEL_<CALL_TYPE>,
+or LLM_FAST_MODEL for all of them) when either
+- LLM_ROUTE_MAX_IN_FLIGHT calls of that type are already waiting upstream, or
+- the routed model's observed p95 latency reaches LLM_ROUTE_P95_FRACTION of the
+  call type's timeout
+and stays there for LLM_ROUTE_HOLD seconds before the routed model is tried
+again. Both thresholds are off (0) by default.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+CALL_TYPES = ("classify", "validate", "respond")
+
+# Latency samples per (call type, model) needed before p95 is trusted
+MIN_LATENCY_SAMPLES = 20
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def parse_routes(routes_json: Optional[str]) -> Dict[Tuple[str, Optional[int], Optional[int]], str]:
+    """
+    Parse LLM_MODEL_ROUTES into {(call_type, week, question): model}.
+
+    Raises:
+        ValueError: Malformed JSON, unknown call type or non-numeric week/question
+    """
+    routes = {}
+    for key, model in json.loads(routes_json or "{}").items():
+        call_type, *scope = key.split(":")
+        if call_type not in CALL_TYPES or len(scope) > 2:
+            raise ValueError(f"invalid route {key!r} (use call_type[:week[:question]])")
+        week = int(scope[0]) if scope else None
+        question = int(scope[1]) if len(scope) > 1 else None
+        routes[(call_type, week, question)] = str(model)
+    return routes
+
+
+class ModelRouter:
+    """Routing table per call type/week/question with a load-triggered fast tier."""
+
+    def __init__(self, default_model: Callable[[], str]):
+        self._default_model = default_model
+        try:
+            self.routes = parse_routes(os.getenv('LLM_MODEL_ROUTES'))
+        except ValueError as e:
+            print(f"[LLM] WARNING: ignoring invalid LLM_MODEL_ROUTES: {e}")
+            self.routes = {}
+        self.max_in_flight = _env_int('LLM_ROUTE_MAX_IN_FLIGHT', 0)
+        self.p95_fraction = _env_float('LLM_ROUTE_P95_FRACTION', 0)
+        self.hold = _env_float('LLM_ROUTE_HOLD', 30)
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, int] = {}
+        self._latencies: Dict[Tuple[str, str], deque] = {}
+        # call type -> (monotonic time the fast tier ends, reason)
+        self._degraded: Dict[str, Tuple[float, str]] = {}
+        self.fast_routed: Dict[str, int] = {}
+
+    def model_for(self, call_type: str, week: Optional[int] = None, question: Optional[int] = None) -> str:
+        """The routing table's model for a call, ignoring load."""
+        for key in ((call_type, week, question), (call_type, week, None)):
+            if key in self.routes:
+                return self.routes[key]
+        return os.getenv(f'LLM_MODEL_{call_type.upper()}') or self._default_model()
+
+    def fast_model_for(self, call_type: str) -> Optional[str]:
+        return os.getenv(f'LLM_FAST_MODEL_{call_type.upper()}') or os.getenv('LLM_FAST_MODEL') or None
+
+    def select(self, call_type: str, timeout: float, week: Optional[int] = None,
+               question: Optional[int] = None) -> str:
+        """
+        Pick the model for a call.
+
+        Args:
+            call_type: "classify", "validate" or "respond"
+            timeout: The call type's timeout (the p95 threshold is a fraction of it)
+            week: Week number, if known
+            question: Question number, if known
+
+        Returns:
+            The routed model, or the call type's fast tier while it is overloaded
+        """
+        model = self.model_for(call_type, week, question)
+        fast = self.fast_model_for(call_type)
+        if not fast or fast == model or not self._overloaded(call_type, model, timeout):
+            return model
+        with self._lock:
+            self.fast_routed[call_type] = self.fast_routed.get(call_type, 0) + 1
+        return fast
+
+    def _overloaded(self, call_type: str, model: str, timeout: float) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            until, _ = self._degraded.get(call_type, (0.0, ""))
+            if now < until:
+                return True
+            reason = None
+            in_flight = self._in_flight.get(call_type, 0)
+            if self.max_in_flight and in_flight >= self.max_in_flight:
+                reason = f"{in_flight} calls in flight"
+            samples = self._latencies.get((call_type, model))
+            if reason is None and self.p95_fraction and samples and len(samples) >= MIN_LATENCY_SAMPLES:
+                ordered = sorted(samples)
+                p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+                if p95 >= timeout * self.p95_fraction:
+                    reason = f"p95 {p95:.2f}s"
+            if reason is None:
+                return False
+            self._degraded[call_type] = (now + self.hold, reason)
+            # Measure the routed model afresh once the hold is over
+            self._latencies.pop((call_type, model), None)
+        print(f"[LLM] {call_type} calls switched to the fast tier for {self.hold:g}s ({reason})")
+        return True
+
+    @contextmanager
+    def track(self, call_type: str):
+        """Count a call as in flight for the duration of the block."""
+        with self._lock:
+            self._in_flight[call_type] = self._in_flight.get(call_type, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight[call_type] -= 1
+
+    def observe(self, call_type: str, model: str, seconds: float):
+        """Record how long a call to a model took."""
+        with self._lock:
+            self._latencies.setdefault((call_type, model), deque(maxlen=200)).append(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return the routing table and current load state for monitoring."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'models': {call_type: self.model_for(call_type) for call_type in CALL_TYPES},
+                'fast_models': {call_type: self.fast_model_for(call_type) for call_type in CALL_TYPES},
+                'routes': {":".join(str(part) for part in key if part is not None): model
+                           for key, model in self.routes.items()},
+                'in_flight': dict(self._in_flight),
+                'fast_tier': {call_type: {'seconds_left': round(until - now, 1), 'reason': reason}
+                              for call_type, (until, reason) in self._degraded.items() if until > now},
+                'fast_routed': dict(self.fast_routed),
+            }
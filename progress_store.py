@@ -0,0 +1,317 @@
+"""
+Progress Storage Backends for the Shared Progress Tracker
+
+ProgressTracker keeps one progress record per user session. This module provides
+the storage backends behind it:
+- JSONFileProgressStore: the original single JSON file (whole file read/written per call)
+- SQLiteProgressStore: one row per session in a WAL-mode SQLite database (single node)
+- PostgresProgressStore: one row per session in the `user_progress` table (multi-node)
+
+Row-based stores update a single session inside one transaction, so each update
+is O(1) in the number of users and concurrent week apps can't lose each other's writes.
+
+Select a backend with PROGRESS_BACKEND=json|sqlite|postgres (default: sqlite).
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+# Mutators receive the current record (or None if the session is new) and return the new record
+ProgressMutator = Callable[[Optional[Dict]], Dict]
+
+DEFAULT_SQLITE_PATH = "user_progress.db"
+
+
+class ProgressStore:
+    """Base class for progress storage backends."""
+
+    backend_name = "base"
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        """Return the stored progress record for a session, or None."""
+        raise NotImplementedError
+
+    def update(self, session_id: str, mutator: ProgressMutator) -> Dict:
+        """Atomically read, mutate and write one session's record. Returns the new record."""
+        raise NotImplementedError
+
+    def import_records(self, records: Dict[str, Dict]) -> int:
+        """Bulk-insert records that don't exist yet (used by the JSON migration)."""
+        raise NotImplementedError
+
+    def count(self) -> int:
+        """Return the number of stored sessions."""
+        raise NotImplementedError
+
+
+class JSONFileProgressStore(ProgressStore):
+    """Original storage: every session in one JSON file."""
+
+    backend_name = "json"
+
+    def __init__(self, progress_file: str):
+        self.progress_file = progress_file
+        self._lock = threading.Lock()
+        if not os.path.exists(self.progress_file):
+            with open(self.progress_file, 'w') as f:
+                json.dump({}, f)
+
+    def _load_all(self) -> Dict:
+        try:
+            with open(self.progress_file, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_all(self, progress: Dict):
+        # Write to a temp file and swap it in so readers never see a half-written file
+        tmp_path = f"{self.progress_file}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(progress, f, indent=2)
+        os.replace(tmp_path, self.progress_file)
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        return self._load_all().get(session_id)
+
+    def update(self, session_id: str, mutator: ProgressMutator) -> Dict:
+        with self._lock:
+            progress = self._load_all()
+            record = mutator(progress.get(session_id))
+            progress[session_id] = record
+            self._save_all(progress)
+            return record
+
+    def import_records(self, records: Dict[str, Dict]) -> int:
+        with self._lock:
+            progress = self._load_all()
+            new_records = {sid: rec for sid, rec in records.items() if sid not in progress}
+            progress.update(new_records)
+            self._save_all(progress)
+            return len(new_records)
+
+    def count(self) -> int:
+        return len(self._load_all())
+
+
+class SQLiteProgressStore(ProgressStore):
+    """One row per session in a WAL-mode SQLite database."""
+
+    backend_name = "sqlite"
+
+    def __init__(self, db_path: str = DEFAULT_SQLITE_PATH, busy_timeout_ms: int = 5000):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_progress (
+                session_id TEXT PRIMARY KEY,
+                progress_data TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection (SQLite connections can't be shared across threads)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # isolation_level=None: we manage transactions explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=self.busy_timeout_ms / 1000)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        row = self._connect().execute(
+            "SELECT progress_data FROM user_progress WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, session_id: str, mutator: ProgressMutator) -> Dict:
+        conn = self._connect()
+        # BEGIN IMMEDIATE takes the write lock up front so read-modify-write can't interleave
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT progress_data FROM user_progress WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            record = mutator(json.loads(row[0]) if row else None)
+            conn.execute(
+                """
+                INSERT INTO user_progress (session_id, progress_data, updated_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT(session_id) DO UPDATE SET
+                    progress_data = excluded.progress_data,
+                    updated_at = excluded.updated_at
+                """,
+                (session_id, json.dumps(record), datetime.now().isoformat())
+            )
+            conn.execute("COMMIT")
+            return record
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def import_records(self, records: Dict[str, Dict]) -> int:
+        conn = self._connect()
+        now = datetime.now().isoformat()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO user_progress (session_id, progress_data, updated_at) VALUES (?, ?, ?)",
+                [(sid, json.dumps(rec), now) for sid, rec in records.items()]
+            )
+            imported = conn.total_changes - before
+            conn.execute("COMMIT")
+            return imported
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM user_progress").fetchone()[0]
+
+
+class PostgresProgressStore(ProgressStore):
+    """One row per session in the Postgres `user_progress` table (shared by all nodes)."""
+
+    backend_name = "postgres"
+
+    def __init__(self, engine=None):
+        if engine is None:
+            from database.db_config import get_shared_engine
+            engine = get_shared_engine()
+        self.engine = engine
+        from sqlalchemy import text
+        self._text = text
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS user_progress (
+                    session_id VARCHAR(255) PRIMARY KEY,
+                    progress_data JSONB NOT NULL DEFAULT '{}',
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """))
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                self._text("SELECT progress_data FROM user_progress WHERE session_id = :sid"),
+                {'sid': session_id}
+            ).fetchone()
+        return row[0] if row else None
+
+    def update(self, session_id: str, mutator: ProgressMutator) -> Dict:
+        text = self._text
+        with self.engine.begin() as conn:
+            # Make sure the row exists so FOR UPDATE can lock it, even for brand-new sessions
+            conn.execute(
+                text("INSERT INTO user_progress (session_id) VALUES (:sid) ON CONFLICT (session_id) DO NOTHING"),
+                {'sid': session_id}
+            )
+            row = conn.execute(
+                text("SELECT progress_data FROM user_progress WHERE session_id = :sid FOR UPDATE"),
+                {'sid': session_id}
+            ).fetchone()
+            current = row[0] if row and row[0] else None
+            record = mutator(current)
+            conn.execute(
+                text("""
+                    UPDATE user_progress
+                    SET progress_data = CAST(:data AS JSONB), updated_at = CURRENT_TIMESTAMP
+                    WHERE session_id = :sid
+                """),
+                {'sid': session_id, 'data': json.dumps(record)}
+            )
+            return record
+
+    def import_records(self, records: Dict[str, Dict]) -> int:
+        if not records:
+            return 0
+        text = self._text
+        with self.engine.begin() as conn:
+            before = conn.execute(text("SELECT COUNT(*) FROM user_progress")).scalar()
+            conn.execute(
+                text("""
+                    INSERT INTO user_progress (session_id, progress_data)
+                    VALUES (:sid, CAST(:data AS JSONB))
+                    ON CONFLICT (session_id) DO NOTHING
+                """),
+                [{'sid': sid, 'data': json.dumps(rec)} for sid, rec in records.items()]
+            )
+            return conn.execute(text("SELECT COUNT(*) FROM user_progress")).scalar() - before
+
+    def count(self) -> int:
+        with self.engine.connect() as conn:
+            return conn.execute(self._text("SELECT COUNT(*) FROM user_progress")).scalar()
+
+
+def migrate_json_progress(json_path: str, store: ProgressStore, archive: bool = True) -> int:
+    """
+    One-shot migration of an existing user_progress.json file into a row-based store.
+
+    Existing rows in the store are left untouched. When archive is True the JSON
+    file is renamed to `<json_path>.migrated` so the migration doesn't run twice.
+    Every worker runs this at startup; the file is claimed with an atomic rename
+    first, so only one of them imports it and the others return 0.
+
+    Returns:
+        Number of sessions imported
+    """
+    if isinstance(store, JSONFileProgressStore) or not os.path.exists(json_path):
+        return 0
+
+    source = json_path
+    if archive:
+        source = f"{json_path}.migrating.{os.getpid()}"
+        try:
+            os.replace(json_path, source)
+        except FileNotFoundError:
+            # Another worker claimed it
+            return 0
+
+    try:
+        with open(source, 'r') as f:
+            records = json.load(f)
+        imported = store.import_records(records) if records else 0
+    except FileNotFoundError:
+        return 0
+    except json.JSONDecodeError as e:
+        print(f"[Progress] WARNING: Could not parse {json_path} for migration: {e}")
+        if archive:
+            os.replace(source, json_path)
+        return 0
+    except Exception:
+        if archive:
+            os.replace(source, json_path)
+        raise
+
+    if archive:
+        os.replace(source, f"{json_path}.migrated")
+    print(f"[Progress] Migrated {imported} session(s) from {json_path} to {store.backend_name} store")
+    return imported
+
+
+def create_progress_store(backend: Optional[str] = None, progress_file: Optional[str] = None) -> ProgressStore:
+    """
+    Create the progress store selected by PROGRESS_BACKEND (json, sqlite or postgres).
+
+    Args:
+        backend: Override for PROGRESS_BACKEND
+        progress_file: JSON file used by the json backend (and migrated by the others)
+    """
+    backend = (backend or os.getenv('PROGRESS_BACKEND', 'sqlite')).lower()
+    if backend == 'json':
+        return JSONFileProgressStore(progress_file)
+    if backend == 'sqlite':
+        return SQLiteProgressStore(os.getenv('PROGRESS_DB_PATH', DEFAULT_SQLITE_PATH))
+    if backend in ('postgres', 'postgresql'):
+        return PostgresProgressStore()
+    raise ValueError(f"Unknown PROGRESS_BACKEND '{backend}' (expected json, sqlite or postgres)")
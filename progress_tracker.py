@@ -2,14 +2,26 @@
 Shared Progress Tracker for Multi-Week DRIVEN Program
 
 This module provides a centralized way to track progress across all weeks.
-Progress is stored in a JSON file that can be shared across different week servers.
+Progress is stored per session in a pluggable backend (see progress_store.py):
+SQLite in WAL mode for a single node, Postgres for multiple nodes, or the legacy
+JSON file. An existing user_progress.json is migrated on first start.
+
+Mutations made while handling one request are collected in a unit of work and
+committed together (one store transaction per session) when the request ends.
+Set PROGRESS_FLUSH_DELAY_MS to additionally debounce commits in a background thread.
 """
 
 import os
+import copy
 import json
-import uuid
-from typing import Dict, Optional, List
+import hashlib
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, List, Tuple
 from datetime import datetime
+from progress_store import ProgressStore, create_progress_store, migrate_json_progress
 
 PROGRESS_FILE = "user_progress.json"
 
@@ -54,107 +66,274 @@ WEEK_CONFIG = {
 }
 
 
+def _new_user_record(name: Optional[str] = None, current_week: int = 1) -> Dict:
+    """Create an empty progress record for a new session."""
+    return {
+        "name": name,
+        "weeks": {},
+        "current_week": current_week,
+        "created_at": datetime.now().isoformat(),
+        "last_updated": datetime.now().isoformat()
+    }
+
+
+def _ensure_week(user_progress: Dict, week_number: int) -> Dict:
+    """Return the week entry in a user record, creating it if needed."""
+    if str(week_number) not in user_progress["weeks"]:
+        user_progress["weeks"][str(week_number)] = {
+            "completed": False,
+            "questions_completed": {},
+            "started_at": datetime.now().isoformat(),
+            "completed_at": None,
+            "selected_problem": None,
+            "selected_corner_piece": None
+        }
+    return user_progress["weeks"][str(week_number)]
+
+
+# A pending mutation: (mutate function, current_week to use if the record is new)
+PendingMutation = Tuple[Callable[[Dict], None], int]
+
+
+def _apply_mutations(record: Optional[Dict], mutations: List[PendingMutation]) -> Dict:
+    """Apply queued mutations in order, creating the record if needed."""
+    for mutate, new_week in mutations:
+        if record is None:
+            record = _new_user_record(current_week=new_week)
+        mutate(record)
+    return record
+
+
+class DebouncedProgressFlusher:
+    """
+    Background writer that coalesces progress mutations per session.
+    
+    Commits are held for `delay` seconds after the last mutation for a session
+    (but never longer than `max_delay`), then written in one store transaction.
+    """
+    
+    def __init__(self, store: ProgressStore, delay: float, max_delay: Optional[float] = None):
+        self.store = store
+        self.delay = delay
+        self.max_delay = max_delay if max_delay is not None else delay * 10
+        self._pending: Dict[str, List[PendingMutation]] = {}
+        self._first_queued: Dict[str, float] = {}
+        self._last_queued: Dict[str, float] = {}
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="progress-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+    
+    def enqueue(self, session_id: str, mutations: List[PendingMutation]):
+        now = time.monotonic()
+        with self._cond:
+            self._pending.setdefault(session_id, []).extend(mutations)
+            self._first_queued.setdefault(session_id, now)
+            self._last_queued[session_id] = now
+            self._cond.notify()
+    
+    def pending_for(self, session_id: str) -> List[PendingMutation]:
+        """Mutations queued but not yet written for a session (for read-your-writes)."""
+        with self._cond:
+            return list(self._pending.get(session_id, []))
+    
+    def _due_sessions(self, now: float) -> List[str]:
+        return [
+            sid for sid in self._pending
+            if now - self._last_queued[sid] >= self.delay or now - self._first_queued[sid] >= self.max_delay
+        ]
+    
+    def _take(self, session_ids: List[str]) -> Dict[str, List[PendingMutation]]:
+        batch = {}
+        for sid in session_ids:
+            batch[sid] = self._pending.pop(sid)
+            self._first_queued.pop(sid, None)
+            self._last_queued.pop(sid, None)
+        return batch
+    
+    def _write(self, batch: Dict[str, List[PendingMutation]]):
+        for sid, mutations in batch.items():
+            try:
+                self.store.update(sid, lambda record, m=mutations: _apply_mutations(record, m))
+            except Exception as e:
+                print(f"[Progress] ERROR: Failed to flush progress for session {sid}: {e}")
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return
+                now = time.monotonic()
+                due = self._due_sessions(now)
+                if not due:
+                    self._cond.wait(timeout=self.delay if self._pending else None)
+                    continue
+                batch = self._take(due)
+            self._write(batch)
+    
+    def flush(self):
+        """Write every pending mutation immediately."""
+        with self._cond:
+            batch = self._take(list(self._pending))
+        self._write(batch)
+    
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self.flush()
+
+
 class ProgressTracker:
     """Manages user progress across all weeks."""
     
-    def __init__(self, progress_file: str = PROGRESS_FILE):
+    def __init__(self, progress_file: str = PROGRESS_FILE, store: Optional[ProgressStore] = None,
+                 flush_delay_ms: Optional[int] = None):
         self.progress_file = progress_file
-        self._ensure_file_exists()
+        self.store = store or create_progress_store(progress_file=progress_file)
+        # One-shot import of the legacy JSON file into row-based stores
+        migrate_json_progress(self.progress_file, self.store)
+        
+        # Per-thread unit of work (one per request when init_app() is used)
+        self._local = threading.local()
+        
+        if flush_delay_ms is None:
+            flush_delay_ms = int(os.getenv('PROGRESS_FLUSH_DELAY_MS', '0'))
+        self.flusher = DebouncedProgressFlusher(self.store, flush_delay_ms / 1000) if flush_delay_ms > 0 else None
+    
+    # ------------------------------------------------------------------
+    # Unit of work
+    # ------------------------------------------------------------------
+    
+    def _pending_batch(self) -> Optional[Dict[str, List[PendingMutation]]]:
+        if getattr(self._local, 'depth', 0) > 0:
+            return self._local.pending
+        return None
+    
+    def begin_batch(self):
+        """Start collecting mutations for the current thread instead of writing them immediately."""
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            self._local.pending = {}
+        self._local.depth = depth + 1
+    
+    def commit_batch(self):
+        """Commit collected mutations: one store transaction per session touched."""
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            return
+        self._local.depth = depth - 1
+        if self._local.depth > 0:
+            return  # Nested batch - the outermost commit writes
+        
+        pending, self._local.pending = self._local.pending, {}
+        for session_id, mutations in pending.items():
+            self._write(session_id, mutations)
     
-    def _ensure_file_exists(self):
-        """Create progress file if it doesn't exist."""
-        if not os.path.exists(self.progress_file):
-            with open(self.progress_file, 'w') as f:
-                json.dump({}, f)
+    def discard_batch(self):
+        """Drop any collected mutations without writing them."""
+        self._local.depth = 0
+        self._local.pending = {}
     
-    def _load_progress(self) -> Dict:
-        """Load progress from JSON file."""
+    @contextmanager
+    def batch(self):
+        """Context manager that commits every progress mutation made inside it at once."""
+        self.begin_batch()
         try:
-            with open(self.progress_file, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {}
+            yield self
+        finally:
+            self.commit_batch()
     
-    def _save_progress(self, progress: Dict):
-        """Save progress to JSON file."""
-        with open(self.progress_file, 'w') as f:
-            json.dump(progress, f, indent=2)
+    def flush(self):
+        """Write any mutations held by the debounced background flusher."""
+        if self.flusher:
+            self.flusher.flush()
+    
+    def init_app(self, app):
+        """Wrap every request of a Flask app in a progress unit of work."""
+        @app.before_request
+        def _begin_progress_batch():
+            self.begin_batch()
+        
+        @app.teardown_request
+        def _commit_progress_batch(exc=None):
+            try:
+                self.commit_batch()
+            except Exception as e:
+                # Don't turn a finished response into an error because of progress storage
+                print(f"[Progress] ERROR: Failed to commit progress batch: {e}")
+                self.discard_batch()
+    
+    def _write(self, session_id: str, mutations: List[PendingMutation]):
+        if self.flusher:
+            self.flusher.enqueue(session_id, mutations)
+        else:
+            self.store.update(session_id, lambda record: _apply_mutations(record, mutations))
+    
+    def _pending_mutations(self, session_id: str) -> List[PendingMutation]:
+        """Mutations for a session that were made but not yet written to the store."""
+        mutations = self.flusher.pending_for(session_id) if self.flusher else []
+        batch = self._pending_batch()
+        if batch:
+            mutations.extend(batch.get(session_id, []))
+        return mutations
+    
+    def _read(self, session_id: str) -> Optional[Dict]:
+        """Read a session's record, including mutations that haven't been written yet."""
+        record = self.store.get(session_id)
+        mutations = self._pending_mutations(session_id)
+        if mutations:
+            record = _apply_mutations(copy.deepcopy(record), mutations)
+        return record
+    
+    def _get_record(self, session_id: str) -> Dict:
+        """Load one session's record (empty dict if none)."""
+        return self._read(session_id) or {}
+    
+    def _update_record(self, session_id: str, mutate: Callable[[Dict], None], new_week: int = 1):
+        """Apply `mutate` to one session's record (deferred to commit inside a batch)."""
+        batch = self._pending_batch()
+        if batch is not None:
+            batch.setdefault(session_id, []).append((mutate, new_week))
+        else:
+            self._write(session_id, [(mutate, new_week)])
     
     def get_user_progress(self, session_id: str) -> Dict:
         """Get progress for a specific user session."""
-        progress = self._load_progress()
-        return progress.get(session_id, {
-            "name": None,
-            "weeks": {},
-            "current_week": 1,
-            "created_at": datetime.now().isoformat(),
-            "last_updated": datetime.now().isoformat()
-        })
+        return self._read(session_id) or _new_user_record()
     
     def update_user_progress(self, session_id: str, week_number: int, 
                            question_number: int, completed: bool = False,
                            week_completed: bool = False):
         """Update progress for a specific user and week."""
-        progress = self._load_progress()
-        
-        if session_id not in progress:
-            progress[session_id] = {
-                "name": None,
-                "weeks": {},
-                "current_week": week_number,
-                "created_at": datetime.now().isoformat(),
-                "last_updated": datetime.now().isoformat()
-            }
-        
-        user_progress = progress[session_id]
-        
-        # Initialize week if not exists
-        if str(week_number) not in user_progress["weeks"]:
-            user_progress["weeks"][str(week_number)] = {
-                "completed": False,
-                "questions_completed": {},
-                "started_at": datetime.now().isoformat(),
-                "completed_at": None,
-                "selected_problem": None,
-                "selected_corner_piece": None
-            }
-        
-        week_progress = user_progress["weeks"][str(week_number)]
-        
-        # Update question completion
-        if completed:
-            week_progress["questions_completed"][str(question_number)] = True
+        def mutate(user_progress: Dict):
+            week_progress = _ensure_week(user_progress, week_number)
+            
+            # Update question completion
+            if completed:
+                week_progress["questions_completed"][str(question_number)] = True
+            
+            # Update week completion
+            if week_completed:
+                week_progress["completed"] = True
+                week_progress["completed_at"] = datetime.now().isoformat()
+                # Update current week to next available week
+                user_progress["current_week"] = week_number + 1
+            
+            # Update last updated timestamp
+            user_progress["last_updated"] = datetime.now().isoformat()
+            user_progress["current_week"] = max(user_progress["current_week"], week_number)
         
-        # Update week completion
-        if week_completed:
-            week_progress["completed"] = True
-            week_progress["completed_at"] = datetime.now().isoformat()
-            # Update current week to next available week
-            user_progress["current_week"] = week_number + 1
-        
-        # Update last updated timestamp
-        user_progress["last_updated"] = datetime.now().isoformat()
-        user_progress["current_week"] = max(user_progress["current_week"], week_number)
-        
-        self._save_progress(progress)
+        self._update_record(session_id, mutate, new_week=week_number)
     
     def set_user_name(self, session_id: str, name: str):
         """Set the user's name in their progress."""
-        progress = self._load_progress()
-        
-        if session_id not in progress:
-            progress[session_id] = {
-                "name": name,
-                "weeks": {},
-                "current_week": 1,
-                "created_at": datetime.now().isoformat(),
-                "last_updated": datetime.now().isoformat()
-            }
-        else:
-            progress[session_id]["name"] = name
-            progress[session_id]["last_updated"] = datetime.now().isoformat()
+        def mutate(user_progress: Dict):
+            user_progress["name"] = name
+            user_progress["last_updated"] = datetime.now().isoformat()
         
-        self._save_progress(progress)
+        self._update_record(session_id, mutate)
     
     def is_week_unlocked(self, session_id: str, week_number: int) -> bool:
         """Check if a week is unlocked (previous week completed)."""
@@ -166,8 +345,7 @@ class ProgressTracker:
         # if week_number == 1:
         #     return True  # Week 1 is always unlocked
         # 
-        # progress = self._load_progress()
-        # user_progress = progress.get(session_id, {})
+        # user_progress = self._get_record(session_id)
         # 
         # # Check if previous week is completed
         # prev_week = week_number - 1
@@ -184,10 +362,8 @@ class ProgressTracker:
         # # If no previous week data, only allow week 1
         # return week_number == 1
     
-    def get_week_status(self, session_id: str, week_number: int) -> Dict:
-        """Get detailed status for a specific week."""
-        progress = self._load_progress()
-        user_progress = progress.get(session_id, {})
+    def _week_status_from_record(self, session_id: str, user_progress: Dict, week_number: int) -> Dict:
+        """Derive one week's status from an already-loaded user record."""
         week_data = user_progress.get("weeks", {}).get(str(week_number), {})
         
         return {
@@ -200,22 +376,47 @@ class ProgressTracker:
             "selected_corner_piece": week_data.get("selected_corner_piece")
         }
     
+    def get_week_status(self, session_id: str, week_number: int) -> Dict:
+        """Get detailed status for a specific week."""
+        user_progress = self._get_record(session_id)
+        return self._week_status_from_record(session_id, user_progress, week_number)
+    
     def get_all_weeks_status(self, session_id: str) -> Dict:
         """Get status for all weeks."""
-        result = {}
-        for week_num in WEEK_CONFIG.keys():
-            result[week_num] = {
-                **self.get_week_status(session_id, week_num),
-                "config": WEEK_CONFIG[week_num]
-            }
-        return result
+        return self.get_status_snapshot(session_id)["weeks"]
     
     def get_current_week(self, session_id: str) -> int:
         """Get the current week for a user."""
-        progress = self._load_progress()
-        user_progress = progress.get(session_id, {})
+        user_progress = self._get_record(session_id)
         return user_progress.get("current_week", 1)
     
+    def get_status_snapshot(self, session_id: str) -> Dict:
+        """
+        Get every week's status and the current week from a single read of the user's record.
+        
+        Returns:
+            Dict with 'weeks', 'current_week' and 'etag' (changes whenever the
+            user's progress or the week configuration changes)
+        """
+        user_progress = self._get_record(session_id)
+        
+        weeks = {}
+        for week_num in WEEK_CONFIG.keys():
+            weeks[week_num] = {
+                **self._week_status_from_record(session_id, user_progress, week_num),
+                "config": WEEK_CONFIG[week_num]
+            }
+        current_week = user_progress.get("current_week", 1)
+        
+        payload = json.dumps({"weeks": weeks, "current_week": current_week}, sort_keys=True, default=str)
+        etag = hashlib.sha1(payload.encode("utf-8")).hexdigest()
+        
+        return {
+            "weeks": weeks,
+            "current_week": current_week,
+            "etag": etag
+        }
+    
     def get_week_port(self, week_number: int) -> Optional[int]:
         """Get the port number for a specific week's server."""
         return WEEK_CONFIG.get(week_number, {}).get("port")
@@ -233,34 +434,12 @@ class ProgressTracker:
         if not cleaned_problem:
             return
         
-        progress = self._load_progress()
-        
-        if session_id not in progress:
-            progress[session_id] = {
-                "name": None,
-                "weeks": {},
-                "current_week": week_number,
-                "created_at": datetime.now().isoformat(),
-                "last_updated": datetime.now().isoformat()
-            }
-        
-        user_progress = progress[session_id]
-        
-        if str(week_number) not in user_progress["weeks"]:
-            user_progress["weeks"][str(week_number)] = {
-                "completed": False,
-                "questions_completed": {},
-                "started_at": datetime.now().isoformat(),
-                "completed_at": None,
-                "selected_problem": None,
-                "selected_corner_piece": None
-            }
+        def mutate(user_progress: Dict):
+            week_progress = _ensure_week(user_progress, week_number)
+            week_progress["selected_problem"] = cleaned_problem
+            user_progress["last_updated"] = datetime.now().isoformat()
         
-        week_progress = user_progress["weeks"][str(week_number)]
-        week_progress["selected_problem"] = cleaned_problem
-        user_progress["last_updated"] = datetime.now().isoformat()
-        
-        self._save_progress(progress)
+        self._update_record(session_id, mutate, new_week=week_number)
 
     def save_selected_corner_piece(self, session_id: str, week_number: int, corner_piece_text: Optional[str]):
         """Persist the user's selected corner piece for a given week."""
@@ -271,34 +450,12 @@ class ProgressTracker:
         if not cleaned_text:
             return
         
-        progress = self._load_progress()
-        
-        if session_id not in progress:
-            progress[session_id] = {
-                "name": None,
-                "weeks": {},
-                "current_week": week_number,
-                "created_at": datetime.now().isoformat(),
-                "last_updated": datetime.now().isoformat()
-            }
-        
-        user_progress = progress[session_id]
-        
-        if str(week_number) not in user_progress["weeks"]:
-            user_progress["weeks"][str(week_number)] = {
-                "completed": False,
-                "questions_completed": {},
-                "started_at": datetime.now().isoformat(),
-                "completed_at": None,
-                "selected_problem": None,
-                "selected_corner_piece": None
-            }
-        
-        week_progress = user_progress["weeks"][str(week_number)]
-        week_progress["selected_corner_piece"] = cleaned_text
-        user_progress["last_updated"] = datetime.now().isoformat()
+        def mutate(user_progress: Dict):
+            week_progress = _ensure_week(user_progress, week_number)
+            week_progress["selected_corner_piece"] = cleaned_text
+            user_progress["last_updated"] = datetime.now().isoformat()
         
-        self._save_progress(progress)
+        self._update_record(session_id, mutate, new_week=week_number)
 
 
 # Global instance
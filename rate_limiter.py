@@ -0,0 +1,370 @@
+"""
+Token-Bucket Rate Limiting for OpenAI Calls
+
+When a cohort logs in at once, every week app sends requests together and the
+organisation's OpenAI limits answer with 429s. RateLimiter keeps two token
+buckets that mirror those limits - requests per minute (LLM_RATE_RPM) and
+tokens per minute (LLM_RATE_TPM) - and makes each call wait for capacity
+before it is sent:
+- waiting calls queue by priority: NOVA's reply first, then classifiers, then
+  validation, first come first served within a priority
+- the wait is bounded (LLM_RATE_MAX_WAIT seconds, and never past the turn's
+  deadline); a call that waited that long is sent anyway and left to the
+  gateway's 429 retries
+- a call's token cost is estimated up front (prompt length + output cap) and
+  corrected with the actual usage once the call returns
+
+The buckets live in memory by default (one process). LLM_RATE_BACKEND=sqlite
+shares them between workers on one host and LLM_RATE_BACKEND=postgres between
+all nodes. The priority queue is per process; across processes the shared
+buckets are first come, first served.
+
+Both limits are off (0) by default.
+"""
+
+import os
+import time
+import heapq
+import sqlite3
+import itertools
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+DEFAULT_SQLITE_PATH = "llm_rate_limits.db"
+
+# Lower runs first: the learner is waiting on the reply, validation is the most deferrable
+PRIORITIES = {"respond": 0, "classify": 1, "validate": 2}
+
+# Output tokens assumed for calls without a max_tokens cap
+RESPONSE_TOKEN_ESTIMATE = 500
+
+# Rough prompt-size estimate (characters per token for English text)
+CHARS_PER_TOKEN = 4
+
+# bucket name -> (level, updated_at)
+BucketRows = Dict[str, Tuple[float, float]]
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def estimate_tokens(messages, max_output_tokens: Optional[int] = None) -> int:
+    """Upper-ish estimate of a call's total tokens: prompt characters / 4 plus the output cap."""
+    prompt_chars = sum(len(message.get('content') or "") for message in messages)
+    return prompt_chars // CHARS_PER_TOKEN + (max_output_tokens or RESPONSE_TOKEN_ESTIMATE)
+
+
+def take_from_buckets(rows: BucketRows, limits: Dict[str, int], amounts: Dict[str, float],
+                      now: float) -> Tuple[BucketRows, float]:
+    """
+    Refill buckets (per-minute limits) and take `amounts` from all of them, or from none.
+
+    Returns:
+        (new rows, 0.0) when taken, or (refilled rows, seconds until there is enough)
+    """
+    refilled = {}
+    wait = 0.0
+    for name, per_minute in limits.items():
+        level, updated_at = rows.get(name, (float(per_minute), now))
+        level = min(float(per_minute), level + max(0.0, now - updated_at) * per_minute / 60)
+        refilled[name] = (level, now)
+        # A single call bigger than the bucket can still go once the bucket is full
+        needed = min(amounts.get(name, 0), per_minute)
+        if level < needed:
+            wait = max(wait, (needed - level) * 60 / per_minute)
+    if wait:
+        return refilled, wait
+    return {name: (level - min(amounts.get(name, 0), limits[name]), at)
+            for name, (level, at) in refilled.items()}, 0.0
+
+
+class MemoryBucketStore:
+    """Buckets shared by the threads of one process."""
+
+    backend_name = "memory"
+
+    def __init__(self):
+        self._rows: BucketRows = {}
+        self._lock = threading.Lock()
+
+    def take(self, limits: Dict[str, int], amounts: Dict[str, float]) -> float:
+        with self._lock:
+            self._rows, wait = take_from_buckets(self._rows, limits, amounts, time.time())
+            return wait
+
+    def adjust(self, name: str, delta: float, floor: float):
+        with self._lock:
+            if name in self._rows:
+                level, updated_at = self._rows[name]
+                self._rows[name] = (max(floor, level - delta), updated_at)
+
+
+class SQLiteBucketStore:
+    """Buckets in a WAL-mode SQLite table shared by every worker on the host."""
+
+    backend_name = "sqlite"
+
+    def __init__(self, db_path: str = DEFAULT_SQLITE_PATH, busy_timeout_ms: int = 5000):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS llm_rate_buckets (
+                name TEXT PRIMARY KEY,
+                level REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Return this thread's connection (SQLite connections can't be shared across threads)."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=self.busy_timeout_ms / 1000)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, conn: sqlite3.Connection, rows: BucketRows):
+        conn.executemany(
+            "INSERT OR REPLACE INTO llm_rate_buckets (name, level, updated_at) VALUES (?, ?, ?)",
+            [(name, level, updated_at) for name, (level, updated_at) in rows.items()]
+        )
+
+    def take(self, limits: Dict[str, int], amounts: Dict[str, float]) -> float:
+        conn = self._connect()
+        # BEGIN IMMEDIATE takes the write lock up front so workers can't both take the same capacity
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = {name: (level, updated_at) for name, level, updated_at
+                    in conn.execute("SELECT name, level, updated_at FROM llm_rate_buckets")}
+            rows, wait = take_from_buckets(rows, limits, amounts, time.time())
+            self._write(conn, rows)
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def adjust(self, name: str, delta: float, floor: float):
+        self._connect().execute(
+            "UPDATE llm_rate_buckets SET level = MAX(?, level - ?) WHERE name = ?", (floor, delta, name)
+        )
+
+
+class PostgresBucketStore:
+    """Buckets in the Postgres `llm_rate_buckets` table (shared by all nodes)."""
+
+    backend_name = "postgres"
+
+    def __init__(self, engine=None):
+        if engine is None:
+            from database.db_config import get_shared_engine
+            engine = get_shared_engine()
+        self.engine = engine
+        from sqlalchemy import text
+        self._text = text
+        with self.engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS llm_rate_buckets (
+                    name VARCHAR(64) PRIMARY KEY,
+                    level DOUBLE PRECISION NOT NULL,
+                    updated_at DOUBLE PRECISION NOT NULL
+                )
+            """))
+
+    def take(self, limits: Dict[str, int], amounts: Dict[str, float]) -> float:
+        text = self._text
+        now = time.time()
+        with self.engine.begin() as conn:
+            # Make sure the rows exist so FOR UPDATE can lock them
+            conn.execute(
+                text("""
+                    INSERT INTO llm_rate_buckets (name, level, updated_at) VALUES (:name, :level, :now)
+                    ON CONFLICT (name) DO NOTHING
+                """),
+                [{'name': name, 'level': float(per_minute), 'now': now} for name, per_minute in limits.items()]
+            )
+            rows = {row[0]: (row[1], row[2]) for row in conn.execute(
+                text("SELECT name, level, updated_at FROM llm_rate_buckets WHERE name = ANY(:names) FOR UPDATE"),
+                {'names': list(limits)}
+            )}
+            rows, wait = take_from_buckets(rows, limits, amounts, now)
+            conn.execute(
+                text("UPDATE llm_rate_buckets SET level = :level, updated_at = :updated_at WHERE name = :name"),
+                [{'name': name, 'level': level, 'updated_at': updated_at} for name, (level, updated_at) in rows.items()]
+            )
+            return wait
+
+    def adjust(self, name: str, delta: float, floor: float):
+        with self.engine.begin() as conn:
+            conn.execute(
+                self._text("UPDATE llm_rate_buckets SET level = GREATEST(:floor, level - :delta) WHERE name = :name"),
+                {'floor': floor, 'delta': delta, 'name': name}
+            )
+
+
+def create_bucket_store(backend: Optional[str] = None):
+    """Create the bucket store selected by LLM_RATE_BACKEND (memory, sqlite or postgres)."""
+    backend = (backend or os.getenv('LLM_RATE_BACKEND', 'memory')).lower()
+    if backend == 'memory':
+        return MemoryBucketStore()
+    if backend == 'sqlite':
+        return SQLiteBucketStore(os.getenv('LLM_RATE_DB_PATH', DEFAULT_SQLITE_PATH))
+    if backend in ('postgres', 'postgresql'):
+        return PostgresBucketStore()
+    raise ValueError(f"Unknown LLM_RATE_BACKEND '{backend}' (expected memory, sqlite or postgres)")
+
+
+class RateLimiter:
+    """Request and token buckets with a per-process priority queue and bounded waits."""
+
+    def __init__(self, rpm: Optional[int] = None, tpm: Optional[int] = None,
+                 max_wait: Optional[float] = None, backend: Optional[str] = None):
+        self.limits = {}
+        rpm = _env_int('LLM_RATE_RPM', 0) if rpm is None else rpm
+        tpm = _env_int('LLM_RATE_TPM', 0) if tpm is None else tpm
+        if rpm > 0:
+            self.limits['requests'] = rpm
+        if tpm > 0:
+            self.limits['tokens'] = tpm
+        self.max_wait = _env_float('LLM_RATE_MAX_WAIT', 20) if max_wait is None else max_wait
+        self._backend = backend
+        self._store = None
+        self._store_lock = threading.Lock()
+        self._cond = threading.Condition()
+        # (priority, sequence) of waiting calls in this process
+        self._queue: list = []
+        self._sequence = itertools.count()
+        self.acquired = 0
+        self.waited = 0
+        self.overflow = 0
+        self.wait_seconds = 0.0
+        # Optional requests (hedges) refused per call type by try_acquire
+        self.denied: Dict[str, int] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.limits)
+
+    @property
+    def store(self):
+        # Created on first use so importing the gateway doesn't need a database
+        if self._store is None:
+            with self._store_lock:
+                if self._store is None:
+                    self._store = create_bucket_store(self._backend)
+                    print(f"[LLM] Rate limiter using {self._store.backend_name} buckets: {self.limits}")
+        return self._store
+
+    def acquire(self, call_type: str, tokens: int, max_wait: Optional[float] = None) -> float:
+        """
+        Wait until the buckets have room for one request of about `tokens` tokens.
+
+        Args:
+            call_type: "respond", "classify" or "validate" (sets the priority)
+            tokens: Estimated total tokens of the call
+            max_wait: Cap on the wait (defaults to LLM_RATE_MAX_WAIT)
+
+        Returns:
+            Seconds waited. A call still without room after max_wait is let
+            through anyway and counted as overflow.
+        """
+        if not self.enabled:
+            return 0.0
+        max_wait = self.max_wait if max_wait is None else min(max_wait, self.max_wait)
+        amounts = {'requests': 1, 'tokens': tokens}
+        started = time.monotonic()
+        ticket = (PRIORITIES.get(call_type, len(PRIORITIES)), next(self._sequence))
+        with self._cond:
+            heapq.heappush(self._queue, ticket)
+            self._cond.notify_all()
+            try:
+                while True:
+                    remaining = max_wait - (time.monotonic() - started)
+                    if self._queue[0] == ticket:
+                        wait = self.store.take(self.limits, amounts)
+                        if not wait:
+                            break
+                    else:
+                        wait = remaining
+                    if remaining <= 0:
+                        self.overflow += 1
+                        print(f"[LLM] {call_type} call sent after waiting {max_wait:g}s for rate limit capacity")
+                        break
+                    # Wakes early when a higher-priority call joins or the head of the queue leaves
+                    self._cond.wait(min(wait, remaining))
+            finally:
+                self._queue.remove(ticket)
+                heapq.heapify(self._queue)
+                self._cond.notify_all()
+            waited = time.monotonic() - started
+            self.acquired += 1
+            if waited >= 0.01:
+                self.waited += 1
+                self.wait_seconds += waited
+        return waited
+
+    def try_acquire(self, call_type: str, tokens: int) -> bool:
+        """
+        Take capacity for one request only if it is available right now (no queueing).
+
+        Used for optional extra requests such as hedges: they never wait, overflow
+        or jump ahead of calls already queued.
+
+        Returns:
+            True if the request may be sent
+        """
+        if not self.enabled:
+            return True
+        with self._cond:
+            try:
+                available = not self._queue and not self.store.take(self.limits, {'requests': 1, 'tokens': tokens})
+            except Exception as e:
+                print(f"[LLM] WARNING: rate limit store unavailable: {e}")
+                available = False
+            if not available:
+                self.denied[call_type] = self.denied.get(call_type, 0) + 1
+                return False
+            self.acquired += 1
+        return True
+
+    def settle(self, estimated_tokens: int, used_tokens: int):
+        """Correct the token bucket once a call's actual usage is known."""
+        if 'tokens' not in self.limits or not used_tokens:
+            return
+        try:
+            self.store.adjust('tokens', used_tokens - estimated_tokens, floor=-float(self.limits['tokens']))
+        except Exception as e:
+            print(f"[LLM] WARNING: could not settle rate limit tokens: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Return limits and wait counters for monitoring."""
+        with self._cond:
+            return {
+                'enabled': self.enabled,
+                'backend': self._store.backend_name if self._store is not None else None,
+                'limits_per_minute': dict(self.limits),
+                'queued': len(self._queue),
+                'acquired': self.acquired,
+                'waited': self.waited,
+                'avg_wait_seconds': round(self.wait_seconds / self.waited, 2) if self.waited else 0.0,
+                'overflow': self.overflow,
+                'denied': dict(self.denied),
+            }
+
+
+# Global instance shared by every week app in the process
+rate_limiter = RateLimiter()
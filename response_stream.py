@@ -0,0 +1,107 @@
+"""
+Server-Sent Events Streaming for process_response
+
+process_response only returns once the classifier, NOVA's response and the
+completeness validation have all finished, so the learner stares at the loading
+indicator for the whole turn. stream_response() runs the same view in a worker
+thread while NOVA's reply is generated with streaming enabled, and sends:
+
+    event: token   data: {"text": "..."}        one per content delta
+    event: done    data: {...}                   the view's normal JSON body
+
+The done payload is authoritative (it includes anything appended to the reply
+after generation, e.g. "[Note: I still need: ...]") together with
+move_to_next, needs_followup and iteration.
+
+The worker runs inside a copy of the request context, so the session lock,
+idempotency replay, conversation state saving and progress batching behave
+exactly as they do for the plain JSON endpoint.
+"""
+
+import json
+import queue
+import threading
+import uuid
+
+from conversation_store import StaleStateError
+from llm_gateway import llm_gateway
+from progress_tracker import progress_tracker
+
+# Seconds between keep-alive comments while no tokens are flowing (classifier, validation)
+HEARTBEAT_INTERVAL = 15
+
+_DONE = object()
+
+
+def _sse(event: str, payload) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def stream_response(view, state_map=None):
+    """
+    Run a process_response-style view and stream NOVA's reply as Server-Sent Events.
+
+    Args:
+        view: The view function (already wrapped by session_guard.serialized)
+        state_map: The week's ConversationStateMap; saved in the worker thread
+
+    Returns:
+        A text/event-stream Response
+    """
+    from flask import Response, copy_current_request_context, current_app, request, session
+
+    # Anything that sets cookies or reads the body has to happen before streaming starts
+    if not session.get('session_id'):
+        session['session_id'] = str(uuid.uuid4())
+    request.get_json(silent=True)
+
+    events: "queue.Queue" = queue.Queue()
+
+    @copy_current_request_context
+    def run():
+        # before_request hooks don't run for a copied context - open the same units of work
+        if state_map is not None:
+            state_map.begin_request()
+        progress_tracker.begin_batch()
+        try:
+            with llm_gateway.stream_to(lambda text: events.put(('token', {"text": text}))):
+                response = current_app.make_response(view())
+            if state_map is not None:
+                state_map.end_request()
+            payload = response.get_json(silent=True)
+            if payload is None:
+                payload = {"success": False, "error": response.get_data(as_text=True)}
+            payload.setdefault("status", response.status_code)
+            events.put(('done', payload))
+        except StaleStateError:
+            print("[Stream] Conflict: conversation was updated by another request")
+            events.put(('done', {
+                "success": False,
+                "error": "Your conversation was updated by another request. Please try again.",
+                "conflict": True,
+                "status": 409
+            }))
+        except Exception as e:
+            print(f"[Stream] ERROR: process_response failed: {e}")
+            events.put(('done', {"success": False, "error": "Internal server error", "status": 500}))
+        finally:
+            events.put((_DONE, None))
+        # Leaving the copied context runs the teardown hooks (progress commit, state discard)
+
+    threading.Thread(target=run, name="process-response-stream", daemon=True).start()
+
+    def generate():
+        while True:
+            try:
+                event, payload = events.get(timeout=HEARTBEAT_INTERVAL)
+            except queue.Empty:
+                yield ": keep-alive\n\n"
+                continue
+            if event is _DONE:
+                return
+            yield _sse(event, payload)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # Don't let a reverse proxy buffer the stream
+    })
@@ -0,0 +1,116 @@
+"""
+Script to store canned replies and fallback scenarios in system_prompts.
+
+Canned replies are served while the LLM is unavailable (see canned_replies.py).
+They are read from a JSON file shaped as
+
+    {week_number: {question_number: {
+        "scenario_1": "Reply while the question is in SCENARIO_1",
+        "default": "Reply for any other scenario",
+        "classifier_fallback": "SCENARIO_2"
+    }}}
+
+and written as canned_scenario_<n>, canned_reply and classifier_fallback
+prompts, replacing the question's existing ones. Running week apps pick them up
+the next time week content is loaded.
+
+Usage:
+    python scripts/load_canned_replies.py --file canned_replies.json
+    python scripts/load_canned_replies.py --file canned_replies.json --dry-run
+"""
+
+import sys
+import json
+import argparse
+from pathlib import Path
+
+# Add parent directory to path to import database and canned reply modules
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from dotenv import load_dotenv
+from flask import Flask
+from sqlalchemy import text
+
+from canned_replies import CLASSIFIER_FALLBACK_TYPE, DEFAULT_REPLY_TYPE, canned_prompt_type
+from database.db_config import init_db
+
+# Load environment variables
+load_dotenv()
+
+
+def prompt_type_for(key: str) -> str:
+    """Map a JSON key ("default", "classifier_fallback", "scenario_1") to its prompt_type."""
+    if key == "default":
+        return DEFAULT_REPLY_TYPE
+    if key == CLASSIFIER_FALLBACK_TYPE:
+        return CLASSIFIER_FALLBACK_TYPE
+    prompt_type = canned_prompt_type(key)
+    if prompt_type == DEFAULT_REPLY_TYPE:
+        raise ValueError(f"unknown key {key!r} (use default, classifier_fallback or scenario_<n>)")
+    return prompt_type
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Store canned replies and fallback scenarios in system_prompts')
+    parser.add_argument('--file', required=True, help='JSON file: {week: {question: {key: text}}}')
+    parser.add_argument('--dry-run', action='store_true', help='Validate the replies without writing them')
+    args = parser.parse_args()
+
+    with open(args.file, 'r') as f:
+        replies_by_week = json.load(f)
+
+    # Validate everything before touching the database
+    rows = []
+    for week, questions in replies_by_week.items():
+        for qnum, replies in questions.items():
+            try:
+                prompts = {prompt_type_for(key): str(value).strip() for key, value in replies.items()}
+            except (ValueError, AttributeError) as e:
+                print(f"❌ Week {week} Q{qnum}: invalid canned replies ({e})")
+                return
+            rows.append((int(week), int(qnum), prompts))
+
+    if args.dry_run:
+        for week, qnum, prompts in rows:
+            print(f"  ✓ Week {week} Q{qnum}: {', '.join(sorted(prompts))}")
+        print(f"✅ {len(rows)} question(s) validated (dry run, nothing written)")
+        return
+
+    app = Flask(__name__)
+    db = init_db(app)
+
+    with app.app_context():
+        with db.engine.connect() as conn:
+            for week, qnum, prompts in rows:
+                q_row = conn.execute(
+                    text("""
+                        SELECT q.question_id FROM questions q
+                        JOIN weeks w ON q.week_id = w.week_id
+                        WHERE w.week_number = :week AND q.question_number = :qnum
+                    """),
+                    {'week': week, 'qnum': qnum}
+                ).fetchone()
+                if not q_row:
+                    print(f"  ⚠️  Week {week} Q{qnum} not found, skipping")
+                    continue
+
+                for prompt_type, prompt_text in prompts.items():
+                    conn.execute(
+                        text("DELETE FROM system_prompts WHERE question_id = :qid AND prompt_type = :ptype"),
+                        {'qid': q_row[0], 'ptype': prompt_type}
+                    )
+                    conn.execute(
+                        text("""
+                            INSERT INTO system_prompts (question_id, prompt_type, prompt_text)
+                            VALUES (:qid, :ptype, :ptext)
+                        """),
+                        {'qid': q_row[0], 'ptype': prompt_type, 'ptext': prompt_text}
+                    )
+                print(f"  ✓ Week {week} Q{qnum}: {', '.join(sorted(prompts))}")
+            conn.commit()
+
+    print("✅ Canned replies stored")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Script to store classifier fast-path rules in system_prompts.
+
+Rules are read from a JSON file shaped as {week_number: {question_number: [rule, ...]}}
+(see classifier_rules.py for the rule format), validated, and written as the
+question's 'classifier_rules' prompt, replacing any existing rules. Running
+week apps pick them up the next time week content is loaded.
+
+Usage:
+    python scripts/load_classifier_rules.py --file classifier_rules.json
+    python scripts/load_classifier_rules.py --file classifier_rules.json --dry-run
+"""
+
+import sys
+import json
+import argparse
+from pathlib import Path
+
+# Add parent directory to path to import database and classifier modules
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from dotenv import load_dotenv
+from flask import Flask
+from sqlalchemy import text
+
+from classifier_rules import parse_rules
+from database.db_config import init_db
+
+# Load environment variables
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Store classifier fast-path rules in system_prompts')
+    parser.add_argument('--file', required=True, help='JSON file: {week: {question: [rules]}}')
+    parser.add_argument('--dry-run', action='store_true', help='Validate the rules without writing them')
+    args = parser.parse_args()
+
+    with open(args.file, 'r') as f:
+        rules_by_week = json.load(f)
+
+    # Validate everything before touching the database
+    rows = []
+    for week, questions in rules_by_week.items():
+        for qnum, rules in questions.items():
+            rules_text = json.dumps(rules, indent=2)
+            try:
+                parse_rules(rules_text)
+            except Exception as e:
+                print(f"❌ Week {week} Q{qnum}: invalid rules ({e})")
+                return
+            rows.append((int(week), int(qnum), rules_text, len(rules)))
+
+    if args.dry_run:
+        for week, qnum, _, count in rows:
+            print(f"  ✓ Week {week} Q{qnum}: {count} rule(s)")
+        print(f"✅ {len(rows)} question(s) validated (dry run, nothing written)")
+        return
+
+    app = Flask(__name__)
+    db = init_db(app)
+
+    with app.app_context():
+        with db.engine.connect() as conn:
+            for week, qnum, rules_text, count in rows:
+                q_row = conn.execute(
+                    text("""
+                        SELECT q.question_id FROM questions q
+                        JOIN weeks w ON q.week_id = w.week_id
+                        WHERE w.week_number = :week AND q.question_number = :qnum
+                    """),
+                    {'week': week, 'qnum': qnum}
+                ).fetchone()
+                if not q_row:
+                    print(f"  ⚠️  Week {week} Q{qnum} not found, skipping")
+                    continue
+
+                conn.execute(
+                    text("DELETE FROM system_prompts WHERE question_id = :qid AND prompt_type = 'classifier_rules'"),
+                    {'qid': q_row[0]}
+                )
+                conn.execute(
+                    text("""
+                        INSERT INTO system_prompts (question_id, prompt_type, prompt_text)
+                        VALUES (:qid, 'classifier_rules', :ptext)
+                    """),
+                    {'qid': q_row[0], 'ptext': rules_text}
+                )
+                print(f"  ✓ Week {week} Q{qnum}: {count} rule(s)")
+            conn.commit()
+
+    print("✅ Classifier rules stored")
+
+
+if __name__ == '__main__':
+    main()
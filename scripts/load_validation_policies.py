@@ -0,0 +1,109 @@
+"""
+Script to store per-question validation policies in validation_prompts.
+
+Policies are read from a JSON file shaped as
+{week_number: {question_number: {"validation_type": ..., "prompt_text": ...}}}
+(see validation_policies.py for the policy types), compiled to check them, and
+written as the question's only validation_prompts row. Use "validation_type":
+"default" to delete a question's row and go back to the built-in validation.
+To validate a question the built-in checks skip, give llm/llm_after a prompt_text.
+Running week apps pick the change up when the week content cache refreshes.
+
+Example:
+    {"1": {"9": {"validation_type": "skip"},
+           "5": {"validation_type": "local", "prompt_text": {"validator": "yes_no"}},
+           "6": {"validation_type": "llm_after:2"}}}
+
+Usage:
+    python scripts/load_validation_policies.py --file validation_policies.json
+    python scripts/load_validation_policies.py --file validation_policies.json --dry-run
+"""
+
+import sys
+import json
+import argparse
+from pathlib import Path
+
+# Add parent directory to path to import database and validation modules
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from dotenv import load_dotenv
+from flask import Flask
+from sqlalchemy import text
+
+from validation_policies import compile_policy
+from database.db_config import init_db
+
+# Load environment variables
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Store per-question validation policies in validation_prompts')
+    parser.add_argument('--file', required=True, help='JSON file: {week: {question: {validation_type, prompt_text}}}')
+    parser.add_argument('--dry-run', action='store_true', help='Validate the policies without writing them')
+    args = parser.parse_args()
+
+    with open(args.file, 'r') as f:
+        policies_by_week = json.load(f)
+
+    # Compile everything before touching the database
+    rows = []
+    for week, questions in policies_by_week.items():
+        for qnum, policy in questions.items():
+            validation_type = policy.get('validation_type', 'llm')
+            prompt_text = policy.get('prompt_text', '')
+            if not isinstance(prompt_text, str):
+                prompt_text = json.dumps(prompt_text)
+            if validation_type != 'default':
+                try:
+                    compile_policy(validation_type, prompt_text)
+                except Exception as e:
+                    print(f"❌ Week {week} Q{qnum}: invalid policy ({e})")
+                    return
+            rows.append((int(week), int(qnum), validation_type, prompt_text))
+
+    if args.dry_run:
+        for week, qnum, validation_type, _ in rows:
+            print(f"  ✓ Week {week} Q{qnum}: {validation_type}")
+        print(f"✅ {len(rows)} policy(ies) validated (dry run, nothing written)")
+        return
+
+    app = Flask(__name__)
+    db = init_db(app)
+
+    with app.app_context():
+        with db.engine.connect() as conn:
+            for week, qnum, validation_type, prompt_text in rows:
+                q_row = conn.execute(
+                    text("""
+                        SELECT q.question_id FROM questions q
+                        JOIN weeks w ON q.week_id = w.week_id
+                        WHERE w.week_number = :week AND q.question_number = :qnum
+                    """),
+                    {'week': week, 'qnum': qnum}
+                ).fetchone()
+                if not q_row:
+                    print(f"  ⚠️  Week {week} Q{qnum} not found, skipping")
+                    continue
+
+                conn.execute(
+                    text("DELETE FROM validation_prompts WHERE question_id = :qid"),
+                    {'qid': q_row[0]}
+                )
+                if validation_type != 'default':
+                    conn.execute(
+                        text("""
+                            INSERT INTO validation_prompts (question_id, prompt_text, validation_type)
+                            VALUES (:qid, :ptext, :vtype)
+                        """),
+                        {'qid': q_row[0], 'ptext': prompt_text, 'vtype': validation_type}
+                    )
+                print(f"  ✓ Week {week} Q{qnum}: {validation_type}")
+            conn.commit()
+
+    print("✅ Validation policies stored")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Script to migrate user_progress.json into the configured progress backend.
+
+The JSON file is imported into the store selected by PROGRESS_BACKEND
+(sqlite or postgres) and renamed to user_progress.json.migrated.
+Sessions that already exist in the store are left untouched.
+
+Usage:
+    python scripts/migrate_progress_json.py
+    python scripts/migrate_progress_json.py --backend postgres
+    python scripts/migrate_progress_json.py --file path/to/user_progress.json --keep-file
+"""
+
+import os
+import sys
+import argparse
+from pathlib import Path
+
+# Add parent directory to path to import progress modules
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from dotenv import load_dotenv
+from progress_store import create_progress_store, migrate_json_progress
+
+# Load environment variables
+load_dotenv()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate user_progress.json into the progress store')
+    parser.add_argument(
+        '--file',
+        default='user_progress.json',
+        help='Path to the legacy progress JSON file (default: user_progress.json)'
+    )
+    parser.add_argument(
+        '--backend',
+        choices=['sqlite', 'postgres'],
+        default=None,
+        help='Target backend (default: PROGRESS_BACKEND or sqlite)'
+    )
+    parser.add_argument(
+        '--keep-file',
+        action='store_true',
+        help='Do not rename the JSON file after migrating'
+    )
+    args = parser.parse_args()
+    
+    if not Path(args.file).exists():
+        print(f"❌ {args.file} not found - nothing to migrate")
+        return
+    
+    # Check before building the store: the json backend has no target to migrate into
+    backend = (args.backend or os.getenv('PROGRESS_BACKEND', 'sqlite')).lower()
+    if backend == 'json':
+        print("❌ PROGRESS_BACKEND is 'json' - choose --backend sqlite or postgres")
+        return
+    
+    store = create_progress_store(backend, progress_file=args.file)
+    imported = migrate_json_progress(args.file, store, archive=not args.keep_file)
+    print(f"✅ Imported {imported} session(s); store now holds {store.count()} session(s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Cooperative Server Entry Point for the Week Apps
+
+process_response makes two or three blocking OpenAI calls in a row, so under
+the threaded development server each in-flight learner turn pins an OS thread
+for several seconds. This entry point serves the same combined application
+(app.application) on gevent instead: socket I/O from the OpenAI/httpx client,
+the ElevenLabs proxy and the database drivers yields to other requests, so one
+worker process can hold hundreds of learner turns in flight.
+
+Nothing in the week modules changes - threading.local, locks and sleeps are
+patched to their greenlet-aware equivalents before the app is imported.
+
+Usage:
+    python serve_async.py
+    gunicorn -k gevent --worker-connections 500 serve_async:application
+
+Requires the optional packages `gevent` (and `psycogreen` for Postgres).
+"""
+
+import os
+
+try:
+    from gevent import monkey
+except ImportError:
+    raise SystemExit("serve_async.py requires gevent: pip install gevent psycogreen")
+
+# Must run before anything imports socket, ssl or threading
+monkey.patch_all()
+
+try:
+    # Make psycopg2 cooperative so database waits don't block the event loop
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+except ImportError:
+    print("[Server] WARNING: psycogreen not installed - Postgres queries will block other requests")
+
+from dotenv import load_dotenv
+from gevent.pool import Pool
+from gevent.pywsgi import WSGIServer
+
+# Load .env first so its values win over the defaults below (load_dotenv never overrides)
+load_dotenv()
+
+# Many more LLM calls can be in flight at once than under threads; size the pool for it
+os.environ.setdefault('LLM_MAX_CONNECTIONS', '200')
+os.environ.setdefault('LLM_MAX_KEEPALIVE', '100')
+
+from app import application  # noqa: E402
+
+
+def serve(port: int, max_concurrency: int):
+    """Serve the combined application with at most max_concurrency requests in flight."""
+    server = WSGIServer(('0.0.0.0', port), application, spawn=Pool(max_concurrency))
+    print(f"[Server] Serving on http://0.0.0.0:{port} (gevent, up to {max_concurrency} concurrent requests)")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    serve(
+        port=int(os.getenv('PORT', 5007)),
+        max_concurrency=int(os.getenv('SERVER_MAX_CONCURRENCY', 500)),
+    )
@@ -0,0 +1,193 @@
+"""
+Per-Session Request Serialization and Idempotency
+
+A double-click, a voice plus text submit or a client retry can deliver two
+process_response calls for the same session at once. Run concurrently they both
+append answers, both call the LLM and both bump iteration counts.
+
+SessionGuard.serialized() wraps a view so that:
+- requests for one session run one at a time (a per-session lock)
+- a request carrying an Idempotency-Key that was already handled (or is still
+  running) gets the original response instead of running the pipeline again
+- a request with the same message for the same question that arrived within
+  IDEMPOTENCY_DUPLICATE_WINDOW seconds of the one handled before it is treated
+  as a duplicate too, even with a different (or no) Idempotency-Key - a
+  double-click or a voice plus text submit lands within that window, while the
+  learner repeating an answer on purpose has to wait for the reply first
+
+Locks and remembered responses are per process; across workers the conversation
+store's optimistic versioning still rejects conflicting writes.
+"""
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from typing import Callable, Dict, Optional, Tuple
+
+from conversation_store import StaleStateError
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class SessionGuard:
+    """Per-session locks plus a bounded cache of responses keyed by idempotency key."""
+
+    def __init__(self, lock_timeout: Optional[float] = None, idempotency_ttl: Optional[float] = None,
+                 duplicate_window: Optional[float] = None, max_entries: int = 10000):
+        self.lock_timeout = _env_float('SESSION_LOCK_TIMEOUT', 120) if lock_timeout is None else lock_timeout
+        self.idempotency_ttl = _env_float('IDEMPOTENCY_TTL', 600) if idempotency_ttl is None else idempotency_ttl
+        self.duplicate_window = (_env_float('IDEMPOTENCY_DUPLICATE_WINDOW', 5)
+                                 if duplicate_window is None else duplicate_window)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # session_id -> [lock, number of requests using it]; removed when unused
+        self._session_locks: Dict[str, list] = {}
+        # (session_id, key) -> (stored_at, body, status, headers)
+        self._responses: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()
+        self.replayed = 0
+        self.lock_waits = 0
+        self.lock_timeouts = 0
+
+    # -- session locks ----------------------------------------------------
+
+    def _acquire(self, session_id: str) -> Optional[threading.Lock]:
+        with self._lock:
+            entry = self._session_locks.setdefault(session_id, [threading.Lock(), 0])
+            entry[1] += 1
+        lock = entry[0]
+        if not lock.acquire(blocking=False):
+            self.lock_waits += 1
+            if not lock.acquire(timeout=self.lock_timeout):
+                self.lock_timeouts += 1
+                self._release(session_id, lock, held=False)
+                return None
+        return lock
+
+    def _release(self, session_id: str, lock: threading.Lock, held: bool = True):
+        if held:
+            lock.release()
+        with self._lock:
+            entry = self._session_locks.get(session_id)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self._session_locks[session_id]
+
+    # -- idempotency cache ------------------------------------------------
+
+    @staticmethod
+    def body_key(payload) -> Optional[str]:
+        """Key derived from a request's question number and message (None without a message)."""
+        if not isinstance(payload, dict) or not payload.get('message'):
+            return None
+        content = f"{payload.get('question_number')}\x00{str(payload['message']).strip()}"
+        return "body:" + hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
+    def _lookup(self, cache_key: Tuple[str, str], ttl: float, now: Optional[float] = None) -> Optional[tuple]:
+        with self._lock:
+            cached = self._responses.get(cache_key)
+            if cached and (time.monotonic() if now is None else now) - cached[0] <= ttl:
+                return cached
+            if cached:
+                del self._responses[cache_key]
+            return None
+
+    def _remember(self, cache_key: Tuple[str, str], response, stored_at: Optional[float] = None):
+        with self._lock:
+            self._responses[cache_key] = (
+                time.monotonic() if stored_at is None else stored_at,
+                response.get_data(), response.status_code, list(response.headers.items())
+            )
+            self._responses.move_to_end(cache_key)
+            while len(self._responses) > self.max_entries:
+                self._responses.popitem(last=False)
+
+    # -- decorator --------------------------------------------------------
+
+    def serialized(self, state_map=None) -> Callable:
+        """
+        Decorate a view so calls for the same session run one at a time.
+
+        Args:
+            state_map: Optional ConversationStateMap; its pending states are saved
+                before the session lock is released so the next request sees them
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                from flask import current_app, jsonify, request, session, Response
+
+                session_id = session.get('session_id')
+                if not session_id:
+                    return view(*args, **kwargs)
+
+                arrived = time.monotonic()
+                key = request.headers.get(IDEMPOTENCY_HEADER)
+                body_key = self.body_key(request.get_json(silent=True))
+                # (cache key, ttl, timestamp): explicit keys age from when the response
+                # was stored, body keys compare arrival times
+                cache_keys = [entry for entry in (
+                    ((session_id, key), self.idempotency_ttl, None),
+                    ((session_id, body_key), self.duplicate_window, arrived),
+                ) if entry[0][1] and entry[1] > 0]
+
+                lock = self._acquire(session_id)
+                if lock is None:
+                    return jsonify({
+                        "success": False,
+                        "error": "Another request for this conversation is still running. Please try again.",
+                        "conflict": True
+                    }), 409
+                try:
+                    # A duplicate that waited on the lock finds the original's result here
+                    for cache_key, ttl, stamp in cache_keys:
+                        cached = self._lookup(cache_key, ttl, stamp)
+                        if cached:
+                            self.replayed += 1
+                            print(f"[Session] Replaying response for duplicate request {cache_key[1]}")
+                            return Response(cached[1], status=cached[2], headers=cached[3])
+
+                    response = current_app.make_response(view(*args, **kwargs))
+                    if state_map is not None:
+                        try:
+                            state_map.flush()
+                        except StaleStateError:
+                            print("[Session] Conflict: conversation was updated by another worker")
+                            return jsonify({
+                                "success": False,
+                                "error": "Your conversation was updated by another request. Please try again.",
+                                "conflict": True
+                            }), 409
+                    if response.status_code < 500:
+                        for cache_key, _, stamp in cache_keys:
+                            self._remember(cache_key, response, stamp)
+                    return response
+                finally:
+                    self._release(session_id, lock)
+            return wrapper
+        return decorator
+
+    def stats(self) -> Dict:
+        """Return lock and idempotency counters for monitoring."""
+        with self._lock:
+            return {
+                'active_sessions': len(self._session_locks),
+                'remembered_responses': len(self._responses),
+                'replayed': self.replayed,
+                'lock_waits': self.lock_waits,
+                'lock_timeouts': self.lock_timeouts,
+            }
+
+
+# Global instance shared by every week app in the process
+session_guard = SessionGuard()
@@ -2,16 +2,28 @@ import os
 import uuid
 import subprocess
 import sys
-from flask import Flask, request, jsonify, session, Response
+from flask import Flask, request, jsonify, session, Response, g, has_request_context
 from flask_cors import CORS
-from openai import OpenAI
 from dotenv import load_dotenv
+
+# Load environment variables before the modules below read their settings at import
+# (the LLM gateway, rate limiter, router, ...) - this module can run on its own
+load_dotenv()
+
 from progress_tracker import progress_tracker
+from conversation_store import ConversationStateMap, create_conversation_store
+from conversation_state import ConversationState as BaseConversationState
+from session_guard import session_guard
+from response_stream import stream_response
+from llm_gateway import llm_gateway
+from classifier_rules import classifier_rules
+from canned_replies import canned_replies
+from validation_policies import validation_policies
+from context_window import context_window
+from completeness_validators import completeness_validators, NumberedParts, YesNoAnswer
 from database.db_config import init_db
 from database import db_models
-
-# Load environment variables
-load_dotenv()
+from database.content_cache import week_content_cache
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -21,37 +33,27 @@ CORS(app, supports_credentials=True)
 # Initialize database
 db = init_db(app)
 
-# Initialize OpenAI client
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Collect progress writes made during a request and commit them once at the end
+progress_tracker.init_app(app)
+
+# LLM calls go through the shared gateway (pooled connections, timeouts, retries)
 if not os.getenv("OPENAI_API_KEY"):
     raise ValueError("Please set your OPENAI_API_KEY in the .env file.")
 
-# Global state (in production, use a database or session management)
-conversation_states = {}
 
-
-class ConversationState:
-    """Manages state for a single conversation."""
+class ConversationState(BaseConversationState):
+    """Week 1 conversation state (scenarios live in the per-question records, e.g. state.q2_scenario)."""
+    
+    __slots__ = ('skip_q14',)
     
     def __init__(self, name):
-        self.name = name
-        self.current_question = 1  # Start with question 1
-        self.answers = {}  # qnum -> list of user responses
-        self.nova_responses = {}  # qnum -> list of NOVA responses
-        self.iteration_count = {}  # qnum -> iteration count (for 2-iteration loop)
-        self.question_completed = {}  # qnum -> bool (whether question is fully completed)
-        self.q2_scenario = None  # Store Q2 scenario classification: "SCENARIO_1", "SCENARIO_2", or "SCENARIO_3"
-        self.q3_scenario = None  # Store Q3 scenario classification: "SCENARIO_1" or "SCENARIO_2"
-        self.q4_scenario = None  # Store Q4 scenario classification: "SCENARIO_1", "SCENARIO_2", or "SCENARIO_3"
-        self.q5_scenario = None  # Store Q5 scenario classification: "SCENARIO_1" or "SCENARIO_2"
-        self.q6_scenario = None  # Store Q6 scenario classification: "SCENARIO_1" or "SCENARIO_2"
-        self.q7_scenario = None  # Store Q7 scenario classification: "SCENARIO_1" or "SCENARIO_2"
-        self.q8_scenario = None  # Store Q8 scenario classification: "SCENARIO_1" or "SCENARIO_2"
+        super().__init__(name, first_question=1)
         self.skip_q14 = False  # Track if user declined to share next-session topics
-    
-    def get_iteration(self, qnum):
-        """Get current iteration count for a question."""
-        return self.iteration_count.get(qnum, 0)
+
+
+# Conversation states per session, kept in the store selected by CONVERSATION_BACKEND
+conversation_states = ConversationStateMap(create_conversation_store(1, ConversationState))
+conversation_states.init_app(app)
 
 
 def get_or_create_state(name=None):
@@ -76,23 +78,59 @@ def save_question_progress(question_number: int, week_number: int = 1):
         progress_tracker.update_user_progress(session_id, week_number, question_number, completed=True)
 
 
+def _turn_question(state):
+    """The question the current process_response turn is handling (else the state's current question)."""
+    if has_request_context() and 'turn_question' in g:
+        return g.turn_question
+    return state.current_question
+
+
+def _fused_validation_plan(question_number):
+    """
+    With LLM_FUSED_VALIDATION on, return (validation_prompt, question, user_responses)
+    for the current process_response turn so call_llm can get the completeness
+    verdict in the same call. Returns None when validation doesn't need the LLM.
+    """
+    if not llm_gateway.fused_validation or not has_request_context() or request.endpoint != 'process_response':
+        return None
+    
+    state = get_or_create_state()
+    user_responses = state.answers.get(question_number, [])
+    validation_prompt = validate_completeness(
+        question_number,
+        "",
+        user_responses,
+        [],
+        q2_scenario=state.q2_scenario if question_number == 2 else None,
+        q6_scenario=state.q6_scenario if question_number == 6 else None,
+        q6_iteration=state.get_iteration(question_number) + 1 if question_number == 6 else None,
+        q7_scenario=state.q7_scenario if question_number == 7 else None,
+        q8_scenario=state.q8_scenario if question_number == 8 else None,
+        prompt_only=True
+    )
+    if not isinstance(validation_prompt, str):
+        return None
+    return validation_prompt, f"Question {question_number}: {QUESTIONS.get(question_number, '')}", user_responses
+
+
 def call_llm(system_prompt, user_message):
     """Call OpenAI API with system prompt and user message."""
     try:
         # Format system prompt with name if needed
+        state = get_or_create_state()
         if "{name}" in system_prompt:
-            state = get_or_create_state()
             system_prompt = system_prompt.replace("{name}", state.name)
         
-        response = openai_client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
-            temperature=0.7
-        )
-        return response.choices[0].message.content.strip()
+        # Served instead if the LLM is unavailable (see canned_replies)
+        question_number = _turn_question(state)
+        scenario = state.scenarios[question_number] if question_number in state.scenarios else None
+        canned = canned_replies.reply(1, question_number, scenario, state.name)
+        
+        validation_plan = _fused_validation_plan(question_number)
+        if validation_plan:
+            return llm_gateway.respond_and_validate(system_prompt, user_message, *validation_plan, canned=canned,
+                                                    week=1, question_number=question_number)
+        return llm_gateway.respond(system_prompt, user_message, canned=canned, week=1, question=question_number)
     except Exception as e:
         # Log the full error for debugging
         import traceback
@@ -106,26 +144,31 @@ def call_llm(system_prompt, user_message):
         return f"I apologize, but I encountered an error processing your response. Please try again. Error: {str(e)}"
 
 
-def validate_completeness(question_number, nova_response, user_responses, conversation_history, q2_scenario=None, q6_scenario=None, q6_iteration=None, q7_scenario=None, q8_scenario=None):
+def validate_completeness(question_number, nova_response, user_responses, conversation_history, q2_scenario=None, q6_scenario=None, q6_iteration=None, q7_scenario=None, q8_scenario=None, prompt_only=False):
     """
     Use LLM to validate if user has provided all required information.
     Returns (is_complete: bool, missing_items: str)
+    prompt_only: Return the validation prompt instead of calling the LLM (used for fused calls)
     q2_scenario: For Q2, pass the scenario classification to skip validation for Scenario 2
     q6_scenario: For Q6, pass the scenario classification to handle Scenario 1 properly
     q6_iteration: For Q6, pass the iteration count to skip validation on first "I don't know" response
     q7_scenario: For Q7, pass the scenario classification to handle scenarios properly
     q8_scenario: For Q8, pass the scenario classification to handle scenarios properly
     """
+    # A validation_prompts row overrides the built-in checks below (see validation_policies)
+    policy = validation_policies.get(1, question_number, count=not prompt_only)
+    policy_verdict = policy.precheck(user_responses) if policy is not None else None
+    if policy_verdict is not None:
+        return policy_verdict
+    
     # Build context of what was requested
     context = f"Question {question_number}: {QUESTIONS.get(question_number, '')}\n\n"
     context += f"NOVA's latest response: {nova_response}\n\n"
     context += f"User's responses so far: {len(user_responses)} response(s)\n"
-    for i, resp in enumerate(user_responses, 1):
-        # Include full response for Q2 to ensure numbered answers are visible
-        if question_number == 2:
-            context += f"  Response {i}: {resp}\n"
-        else:
-            context += f"  Response {i}: {resp[:200]}...\n"
+
+    # A policy prompt replaces the built-in checks below, including the questions they skip
+    if policy is not None and policy.prompt:
+        return _validate_with_prompt(question_number, policy.prompt, context, user_responses, prompt_only)
 
     if question_number in (9, 10, 11, 12, 13, 14):
         return True, "None"
@@ -349,38 +392,32 @@ Example responses:
         # Generic validation for other questions - only use for Q2-like scenarios
         # For simple questions, rely on iteration limits
         return True, "None"  # Skip validation for other questions
+
+    return _validate_with_prompt(question_number, validation_prompt, context, user_responses, prompt_only)
+
+
+def _validate_with_prompt(question_number, validation_prompt, context, user_responses, prompt_only=False):
+    """Finish validate_completeness for an LLM validation prompt: local validators, a fused verdict, or the LLM."""
+    # Structural checks that don't need the LLM (see completeness_validators)
+    local_verdict = completeness_validators.validate(1, question_number, user_responses, count=not prompt_only)
+    if local_verdict is not None:
+        return local_verdict
+    
+    if prompt_only:
+        return validation_prompt
+    
+    # A fused respond-and-validate call may already have judged this turn
+    fused_verdict = llm_gateway.take_verdict(validation_prompt)
+    if fused_verdict is not None:
+        return fused_verdict
+    
+    # Only now that the LLM is called: recent responses verbatim, older ones summarized,
+    # within the validation token budget
+    context += context_window.responses_section(user_responses, "validate", 1, question_number)
     
     try:
-        validation_response = openai_client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-            messages=[
-                {"role": "system", "content": validation_prompt},
-                {"role": "user", "content": context}
-            ],
-            temperature=0.3  # Lower temperature for more consistent validation
-        )
-        
-        validation_text = validation_response.choices[0].message.content.strip()
-        
-        print(f"[DEBUG] Validation LLM response: {validation_text}")
-        
-        # Parse the response
-        is_complete = False
-        missing_items = "Unknown"
-        
-        if "COMPLETE: Yes" in validation_text or "COMPLETE:YES" in validation_text.upper():
-            is_complete = True
-            print(f"[DEBUG] ✓ Validation result: COMPLETE")
-        elif "COMPLETE: No" in validation_text or "COMPLETE:NO" in validation_text.upper():
-            is_complete = False
-            print(f"[DEBUG] ✗ Validation result: INCOMPLETE")
-        
-        # Extract missing items
-        missing_match = None
-        if "MISSING:" in validation_text:
-            missing_match = validation_text.split("MISSING:")[-1].strip()
-            missing_items = missing_match if missing_match else "Unknown"
-            print(f"[DEBUG] Missing items: {missing_items}")
+        judgement = llm_gateway.judge_completeness(validation_prompt, context, week=1, question=question_number)
+        is_complete, missing_items = judgement.complete, judgement.missing_text
         
         print(f"[DEBUG] Final validation decision: is_complete={is_complete}, missing_items={missing_items}")
         print(f"{'='*80}\n")
@@ -393,6 +430,11 @@ Example responses:
         return False, "Validation error occurred"
 
 
+# Structural checks decided locally before the LLM validator
+completeness_validators.register(1, 2, NumberedParts(4))  # Homework answers numbered 1-4
+completeness_validators.register(1, 5, YesNoAnswer())  # "Please respond Yes or No."
+
+
 # Content blocks are now loaded from database via _init_week1_data()
 # The old hardcoded constants have been removed - all data is stored in the database
 
@@ -402,19 +444,6 @@ NO_FOLLOWUPS_INSTRUCTION = (
 )
 
 
-def normalize_yes_no(message: str):
-    """Return True for yes, False for no, or None if unclear."""
-    if not message:
-        return None
-    cleaned = message.strip().lower()
-    yes_values = {"yes", "y", "yeah", "yep", "sure", "absolutely"}
-    no_values = {"no", "n", "nope", "nah", "not really"}
-    if cleaned in yes_values:
-        return True
-    if cleaned in no_values:
-        return False
-    return None
-
 # QUESTIONS and SYSTEM_PROMPTS are now loaded from database via _init_week1_data()
 # The old hardcoded dicts have been removed - all data is stored in the database
 SYSTEM_PROMPTS = {}
@@ -423,12 +452,14 @@ SYSTEM_PROMPTS = {}
 # Load all data from database to maintain same interface as hardcoded constants
 
 def _init_week1_data():
-    """Initialize Week 1 data from database. Called after app is created."""
-    global QUESTIONS, SYSTEM_PROMPTS, WELCOME_MESSAGE, FINAL_RESPONSE
+    """Initialize Week 1 data from database. Called after app is created (and again when it changes)."""
+    global QUESTIONS, SYSTEM_PROMPTS, WELCOME_MESSAGE, FINAL_RESPONSE, CONTENT_REVISION
     global HOMEWORK_QUESTIONS_Q2, THINKING_FLEXIBLY_NOTES, THINKING_FLEXIBLY_JOB_MARKET
     global GOAL_CATEGORIES, CLARIFYING_QUESTIONS_Q6, CLARIFYING_QUESTIONS_Q7, CLARIFYING_QUESTIONS_Q8
     global NEW_WEEK1_SECTION_INTRO, NEXT_STEPS_TEXT, CLOSING_TEXT
     
+    # Read before loading, so a change that lands mid-load triggers another reload
+    revision = week_content_cache.revision(1)
     with app.app_context():
         week_content = db_models.get_week_content(1, app)
         
@@ -437,6 +468,8 @@ def _init_week1_data():
         
         # Load system prompts dict
         SYSTEM_PROMPTS = week_content['system_prompts']
+        classifier_rules.load_week(1, SYSTEM_PROMPTS)
+        canned_replies.load_week(1, SYSTEM_PROMPTS)
         
         # Load welcome message and final response
         WELCOME_MESSAGE = week_content.get('welcome_message', '')
@@ -454,8 +487,10 @@ def _init_week1_data():
         NEW_WEEK1_SECTION_INTRO = content_blocks.get('NEW_WEEK1_SECTION_INTRO', '')
         NEXT_STEPS_TEXT = content_blocks.get('NEXT_STEPS_TEXT', '')
         CLOSING_TEXT = content_blocks.get('CLOSING_TEXT', '')
+        CONTENT_REVISION = revision
 
 # Initialize data structures (will be populated by _init_week1_data)
+CONTENT_REVISION = None  # week_content_cache revision the globals below were loaded at
 QUESTIONS = {}
 SYSTEM_PROMPTS = {}
 WELCOME_MESSAGE = ""
@@ -473,13 +508,16 @@ CLOSING_TEXT = ""
 
 # Initialize data from database after app is ready
 def _ensure_data_loaded():
-    """Ensure Week 1 data is loaded from database."""
-    if not QUESTIONS:  # Check if data is loaded
+    """Ensure Week 1 data is loaded from database, reloading it when the cached content changed."""
+    if not QUESTIONS or not week_content_cache.is_current(1, CONTENT_REVISION):
         try:
             _init_week1_data()
         except Exception as e:
             print(f"Warning: Could not load Week 1 data from database: {e}")
-            print("Falling back to empty dicts - database may not be populated yet")
+            if QUESTIONS:
+                print("Keeping the previously loaded content")
+            else:
+                print("Falling back to empty dicts - database may not be populated yet")
 
 @app.before_request
 def before_request():
@@ -502,14 +540,18 @@ def get_progress_status():
     if not session_id:
         return jsonify({"success": False, "error": "No session found"}), 400
     
-    weeks_status = progress_tracker.get_all_weeks_status(session_id)
-    current_week = progress_tracker.get_current_week(session_id)
+    # One read of the user's record; clients send the ETag back in If-None-Match
+    snapshot = progress_tracker.get_status_snapshot(session_id)
     
-    return jsonify({
+    response = jsonify({
         "success": True,
-        "current_week": current_week,
-        "weeks": weeks_status
+        "current_week": snapshot["current_week"],
+        "weeks": snapshot["weeks"],
+        "etag": snapshot["etag"]
     })
+    response.set_etag(snapshot["etag"])
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
 
 @app.route('/api/progress/week/<int:week_number>', methods=['GET'])
@@ -638,6 +680,8 @@ def get_next_message():
 
 
 @app.route('/api/process_response', methods=['POST'])
+@llm_gateway.turn_deadline()
+@session_guard.serialized(conversation_states)
 def process_response():
     """Process a user response to a question."""
     data = request.get_json()
@@ -656,6 +700,9 @@ def process_response():
     if question_number is None or question_number not in QUESTIONS:
         return jsonify({"success": False, "error": "No active question"}), 400
     
+    # call_llm's canned reply and fused validation are for this question
+    g.turn_question = question_number
+    
     # Store user response
     if question_number not in state.answers:
         state.answers[question_number] = []
@@ -684,16 +731,7 @@ def process_response():
             classifier_prompt = q2_prompts["classifier"]
             print(f"[DEBUG] Classifying scenario for Q2...")
             
-            classification_response = openai_client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=[
-                    {"role": "system", "content": "You are a scenario classifier. Respond with only the scenario identifier."},
-                    {"role": "user", "content": f"{classifier_prompt}\n\nUser's response: {user_message}"}
-                ],
-                temperature=0.1
-            )
-            
-            state.q2_scenario = classification_response.choices[0].message.content.strip().upper()
+            state.q2_scenario = llm_gateway.classify(classifier_prompt, user_message, week=1, question=2)
             print(f"[DEBUG] Scenario classification result: {state.q2_scenario}")
         
         # Step 2: Use hardcoded logic based on classification
@@ -772,16 +810,7 @@ You asked the user to answer 4 homework questions. The user is providing additio
             classifier_prompt = q3_prompts["classifier"]
             print(f"[DEBUG] Classifying scenario for Q3...")
             
-            classification_response = openai_client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=[
-                    {"role": "system", "content": "You are a scenario classifier. Respond with only the scenario identifier."},
-                    {"role": "user", "content": f"{classifier_prompt}\n\nUser's response: {user_message}"}
-                ],
-                temperature=0.1
-            )
-            
-            state.q3_scenario = classification_response.choices[0].message.content.strip().upper()
+            state.q3_scenario = llm_gateway.classify(classifier_prompt, user_message, week=1, question=3)
             print(f"[DEBUG] Scenario classification result: {state.q3_scenario}")
         
         # Step 2: Use hardcoded logic based on classification
@@ -841,16 +870,7 @@ You asked the user to answer 4 homework questions. The user is providing additio
             classifier_prompt = q4_prompts["classifier"]
             print(f"[DEBUG] Classifying scenario for Q4...")
             
-            classification_response = openai_client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=[
-                    {"role": "system", "content": "You are a scenario classifier. Respond with only the scenario identifier."},
-                    {"role": "user", "content": f"{classifier_prompt}\n\nUser's response: {user_message}"}
-                ],
-                temperature=0.1
-            )
-            
-            state.q4_scenario = classification_response.choices[0].message.content.strip().upper()
+            state.q4_scenario = llm_gateway.classify(classifier_prompt, user_message, week=1, question=4)
             print(f"[DEBUG] Scenario classification result: {state.q4_scenario}")
         
         # Step 2: Use hardcoded logic based on classification
@@ -936,16 +956,7 @@ You asked the user to answer 4 homework questions. The user is providing additio
             classifier_prompt = q5_prompts["classifier"]
             print(f"[DEBUG] Classifying scenario for Q5...")
             
-            classification_response = openai_client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=[
-                    {"role": "system", "content": "You are a scenario classifier. Respond with only the scenario identifier."},
-                    {"role": "user", "content": f"{classifier_prompt}\n\nUser's response: {user_message}"}
-                ],
-                temperature=0.1
-            )
-            
-            state.q5_scenario = classification_response.choices[0].message.content.strip().upper()
+            state.q5_scenario = llm_gateway.classify(classifier_prompt, user_message, week=1, question=5)
             print(f"[DEBUG] Scenario classification result: {state.q5_scenario}")
         
         # Step 2: Use hardcoded logic based on classification
@@ -983,16 +994,7 @@ You asked the user to answer 4 homework questions. The user is providing additio
             classifier_prompt = q6_prompts["classifier"]
             print(f"[DEBUG] Classifying scenario for Q6...")
             
-            classification_response = openai_client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=[
-                    {"role": "system", "content": "You are a scenario classifier. Respond with only the scenario identifier."},
-                    {"role": "user", "content": f"{classifier_prompt}\n\nUser's response: {user_message}"}
-                ],
-                temperature=0.1
-            )
-            
-            state.q6_scenario = classification_response.choices[0].message.content.strip().upper()
+            state.q6_scenario = llm_gateway.classify(classifier_prompt, user_message, week=1, question=6)
             print(f"[DEBUG] Scenario classification result: {state.q6_scenario}")
         
         # Step 2: Use hardcoded logic based on classification
@@ -1063,16 +1065,7 @@ Be warm and supportive."""
             classifier_prompt = q7_prompts["classifier"]
             print(f"[DEBUG] Classifying scenario for Q7...")
             
-            classification_response = openai_client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=[
-                    {"role": "system", "content": "You are a scenario classifier. Respond with only the scenario identifier."},
-                    {"role": "user", "content": f"{classifier_prompt}\n\nUser's response: {user_message}"}
-                ],
-                temperature=0.1
-            )
-            
-            state.q7_scenario = classification_response.choices[0].message.content.strip().upper()
+            state.q7_scenario = llm_gateway.classify(classifier_prompt, user_message, week=1, question=7)
             print(f"[DEBUG] Scenario classification result: {state.q7_scenario}")
         
         # Step 2: Use hardcoded logic based on classification
@@ -1217,16 +1210,7 @@ CRITICAL: Do NOT ask any follow-up questions. Simply provide praise and motivati
             classifier_prompt = q8_prompts["classifier"]
             print(f"[DEBUG] Classifying scenario for Q8...")
             
-            classification_response = openai_client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=[
-                    {"role": "system", "content": "You are a scenario classifier. Respond with only the scenario identifier."},
-                    {"role": "user", "content": f"{classifier_prompt}\n\nUser's response: {user_message}"}
-                ],
-                temperature=0.1
-            )
-            
-            state.q8_scenario = classification_response.choices[0].message.content.strip().upper()
+            state.q8_scenario = llm_gateway.classify(classifier_prompt, user_message, week=1, question=8)
             print(f"[DEBUG] Scenario classification result: {state.q8_scenario}")
         
         # Step 2: Use hardcoded logic based on classification
@@ -1718,6 +1702,12 @@ CRITICAL: Do NOT ask any follow-up questions. Simply provide praise and motivati
     })
 
 
+@app.route('/api/process_response/stream', methods=['POST'])
+def process_response_stream():
+    """Same as process_response, but streams NOVA's reply as Server-Sent Events."""
+    return stream_response(process_response, conversation_states)
+
+
 def kill_process_on_port(port):
     """Kill any process running on the specified port."""
     try:
@@ -3,20 +3,32 @@ import uuid
 import subprocess
 import sys
 from typing import List, Set
-from flask import Flask, request, jsonify, session, Response
+from flask import Flask, request, jsonify, session, Response, g, has_request_context
 from flask_cors import CORS
-from openai import OpenAI
 from dotenv import load_dotenv
+
+# Load environment variables before the modules below read their settings at import
+# (the LLM gateway, rate limiter, router, ...) - this module can run on its own
+load_dotenv()
+
 from progress_tracker import progress_tracker
+from conversation_store import ConversationStateMap, create_conversation_store
+from conversation_state import ConversationState as BaseConversationState
+from session_guard import session_guard
+from response_stream import stream_response
+from llm_gateway import llm_gateway
+from classifier_rules import classifier_rules
+from canned_replies import canned_replies
+from validation_policies import validation_policies
+from context_window import context_window
+from completeness_validators import completeness_validators, CategoryCoverage
 from database.db_config import init_db
 from database import db_models
+from database.content_cache import week_content_cache
 
 # Constants
 WEEK_NUMBER = 3  # Week 3 backend
 
-# Load environment variables
-load_dotenv()
-
 # Initialize Flask app
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev-secret-key-" + uuid.uuid4().hex)
@@ -25,25 +37,25 @@ CORS(app, supports_credentials=True)
 # Initialize database
 db = init_db(app)
 
-# Initialize OpenAI client
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Collect progress writes made during a request and commit them once at the end
+progress_tracker.init_app(app)
+
+# LLM calls go through the shared gateway (pooled connections, timeouts, retries)
 if not os.getenv("OPENAI_API_KEY"):
     raise ValueError("Please set your OPENAI_API_KEY in the .env file.")
 
-# Global state (in production, use a database or session management)
-conversation_states = {}
-
 
-class ConversationState:
-    """Manages state for a single conversation."""
+class ConversationState(BaseConversationState):
+    """Week 3 conversation state (scenarios live in the per-question records, e.g. state.q16_scenario)."""
+    
+    __slots__ = (
+        'pending_print_message', 'show_final_message', 'final_message_index',
+        'print_messages_shown', 'print_message_index',
+        'q17_categories_identified', 'q17_missing_categories', 'data_store',
+    )
     
     def __init__(self, name):
-        self.name = name
-        self.current_question = 16  # Start with question 16
-        self.answers = {}  # qnum -> list of user responses
-        self.nova_responses = {}  # qnum -> list of NOVA responses
-        self.iteration_count = {}  # qnum -> iteration count (for 2-iteration loop)
-        self.question_completed = {}  # qnum -> bool (whether question is fully completed)
+        super().__init__(name, first_question=16)  # Start with question 16
         self.pending_print_message = None  # Track if there's a print message to show before next question
         self.show_final_message = False  # Track if final message should be shown after Q22
         self.final_message_index = 0  # Track which final message index we're on
@@ -51,14 +63,6 @@ class ConversationState:
         self.print_message_index = {}  # Track which print message index we're on for each question
         self.q17_categories_identified = set()  # Track which skill categories user has already covered
         self.q17_missing_categories = set(SKILL_CATEGORIES)  # Track remaining skill categories for Q17
-        # Store scenario classifications for Q16-Q22
-        self.q16_scenario = None
-        self.q17_scenario = None
-        self.q18_scenario = None
-        self.q19_scenario = None
-        self.q20_scenario = None
-        self.q21_scenario = None
-        self.q22_scenario = None
         
         # Data store for required variables
         self.data_store = {
@@ -66,10 +70,6 @@ class ConversationState:
             "skill_list": "hard skills, soft skills, technology skills, growth skills, and experiential skills",
         }
     
-    def get_iteration(self, qnum):
-        """Get current iteration count for a question."""
-        return self.iteration_count.get(qnum, 0)
-    
     def get_answer(self, qnum):
         """Get the last answer for a question number."""
         answers = self.answers.get(qnum, [])
@@ -114,6 +114,11 @@ class ConversationState:
         return text
 
 
+# Conversation states per session, kept in the store selected by CONVERSATION_BACKEND
+conversation_states = ConversationStateMap(create_conversation_store(3, ConversationState))
+conversation_states.init_app(app)
+
+
 def get_or_create_state(name=None):
     """Get or create a conversation state using Flask session."""
     session_id = session.get('session_id')
@@ -128,18 +133,51 @@ def get_or_create_state(name=None):
     return conversation_states[session_id]
 
 
+def _turn_question(state):
+    """The question the current process_response turn is handling (else the state's current question)."""
+    if has_request_context() and 'turn_question' in g:
+        return g.turn_question
+    return state.current_question
+
+
+def _fused_validation_plan(question_number):
+    """
+    With LLM_FUSED_VALIDATION on, return (validation_prompt, question, user_responses)
+    for the current process_response turn so call_llm can get the completeness
+    verdict in the same call. Returns None when validation doesn't need the LLM.
+    """
+    if not llm_gateway.fused_validation or not has_request_context() or request.endpoint != 'process_response':
+        return None
+    
+    state = get_or_create_state()
+    user_responses = state.answers.get(question_number, [])
+    validation_prompt = validate_completeness(
+        question_number,
+        "",
+        user_responses,
+        [],
+        q16_scenario=state.q16_scenario if question_number == 16 else None,
+        prompt_only=True
+    )
+    if not isinstance(validation_prompt, str):
+        return None
+    return validation_prompt, f"Question {question_number}: {QUESTIONS.get(question_number, '')}", user_responses
+
+
 def call_llm(system_prompt, user_message):
     """Call OpenAI API with system prompt and user message."""
     try:
-        response = openai_client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
-            temperature=0.7
-        )
-        return response.choices[0].message.content.strip()
+        # Served instead if the LLM is unavailable (see canned_replies)
+        state = get_or_create_state()
+        question_number = _turn_question(state)
+        scenario = state.scenarios[question_number] if question_number in state.scenarios else None
+        canned = canned_replies.reply(WEEK_NUMBER, question_number, scenario, state.name)
+
+        validation_plan = _fused_validation_plan(question_number)
+        if validation_plan:
+            return llm_gateway.respond_and_validate(system_prompt, user_message, *validation_plan, canned=canned,
+                                                    week=WEEK_NUMBER, question_number=question_number)
+        return llm_gateway.respond(system_prompt, user_message, canned=canned, week=WEEK_NUMBER, question=question_number)
     except Exception as e:
         return f"I apologize, but I encountered an error processing your response. Please try again. Error: {str(e)}"
 
@@ -169,16 +207,25 @@ def mark_week_completion():
         )
 
 
-def validate_completeness(question_number, nova_response, user_responses, conversation_history, q16_scenario=None):
+def validate_completeness(question_number, nova_response, user_responses, conversation_history, q16_scenario=None, prompt_only=False):
     """
     Use LLM to validate if user has provided all required information.
     Returns (is_complete: bool, missing_items: str)
+    prompt_only: Return the validation prompt instead of calling the LLM (used for fused calls)
     """
+    # A validation_prompts row overrides the built-in checks below (see validation_policies)
+    policy = validation_policies.get(3, question_number, count=not prompt_only)
+    policy_verdict = policy.precheck(user_responses) if policy is not None else None
+    if policy_verdict is not None:
+        return policy_verdict
+    
     context = f"Question {question_number}: {QUESTIONS.get(question_number, '')}\n\n"
     context += f"NOVA's latest response: {nova_response}\n\n"
     context += f"User's responses so far: {len(user_responses)} response(s)\n"
-    for i, resp in enumerate(user_responses, 1):
-        context += f"  Response {i}: {resp[:200]}...\n"
+
+    # A policy prompt replaces the built-in checks below, including the questions they skip
+    if policy is not None and policy.prompt:
+        return _validate_with_prompt(question_number, policy.prompt, context, user_responses, prompt_only)
     
     if question_number == 16:
         # For Q16, check if user provided a response about confusion
@@ -322,22 +369,37 @@ Respond in this exact format:
 COMPLETE: Yes or No
 MISSING: [List specific items that are missing, or "None" if all provided]
 """
+
+    return _validate_with_prompt(question_number, validation_prompt, context, user_responses, prompt_only)
+
+
+def _validate_with_prompt(question_number, validation_prompt, context, user_responses, prompt_only=False):
+    """Finish validate_completeness for an LLM validation prompt: local validators, a fused verdict, or the LLM."""
+    # Structural checks that don't need the LLM (see completeness_validators)
+    local_verdict = completeness_validators.validate(3, question_number, user_responses, count=not prompt_only)
+    if local_verdict is not None:
+        return local_verdict
+    
+    if prompt_only:
+        return validation_prompt
+    
+    # A fused respond-and-validate call may already have judged this turn
+    fused_verdict = llm_gateway.take_verdict(validation_prompt)
+    if fused_verdict is not None:
+        return fused_verdict
+    
+    # Only now that the LLM is called: recent responses verbatim, older ones summarized,
+    # within the validation token budget
+    context += context_window.responses_section(user_responses, "validate", WEEK_NUMBER, question_number)
     
     try:
-        validation_response = openai_client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-            messages=[
-                {"role": "system", "content": "You are a validation assistant. Respond only in the specified format."},
-                {"role": "user", "content": f"{context}\n\n{validation_prompt}"}
-            ],
-            temperature=0.3
+        judgement = llm_gateway.judge_completeness(
+            "You are a validation assistant. Respond only in the specified format.",
+            f"{context}\n\n{validation_prompt}",
+            week=WEEK_NUMBER,
+            question=question_number
         )
-        
-        result = validation_response.choices[0].message.content.strip()
-        is_complete = "COMPLETE: Yes" in result
-        missing_items = result.split("MISSING:")[1].strip() if "MISSING:" in result else "Unknown"
-        
-        return is_complete, missing_items
+        return judgement.complete, judgement.missing_text
     except Exception as e:
         print(f"[ERROR] Validation failed: {e}")
         return True, "Validation error"  # Default to complete on error
@@ -373,6 +435,9 @@ def extract_skill_categories_from_text(text: str) -> Set[str]:
             matches.add(category)
     return matches
 
+# Q17 is complete once the learner mentions skills in any of the five areas
+completeness_validators.register(3, 17, CategoryCoverage(SKILL_CATEGORIES, extract_skill_categories_from_text, min_covered=1))
+
 def format_category_list(categories: List[str]) -> str:
     """Return a human-friendly list string from category names."""
     if not categories:
@@ -417,10 +482,12 @@ def build_q17_missing_skills_prompt(
 # Load all data from database to maintain same interface as hardcoded constants
 
 def _init_week3_data():
-    """Initialize Week 3 data from database. Called after app is created."""
-    global QUESTIONS, SYSTEM_PROMPTS, WELCOME_MESSAGE, FINAL_RESPONSE
+    """Initialize Week 3 data from database. Called after app is created (and again when it changes)."""
+    global QUESTIONS, SYSTEM_PROMPTS, WELCOME_MESSAGE, FINAL_RESPONSE, CONTENT_REVISION
     global PRINT_MESSAGES, FINAL_MESSAGES
     
+    # Read before loading, so a change that lands mid-load triggers another reload
+    revision = week_content_cache.revision(3)
     with app.app_context():
         week_content = db_models.get_week_content(3, app)
         
@@ -429,6 +496,8 @@ def _init_week3_data():
         
         # Load system prompts dict
         SYSTEM_PROMPTS = week_content['system_prompts']
+        classifier_rules.load_week(3, SYSTEM_PROMPTS)
+        canned_replies.load_week(3, SYSTEM_PROMPTS)
         
         # Load welcome message and final response
         WELCOME_MESSAGE = week_content.get('welcome_message', '')
@@ -436,8 +505,10 @@ def _init_week3_data():
         
         # Note: PRINT_MESSAGES and FINAL_MESSAGES are handled in the code logic
         # They may be stored as content blocks or handled separately
+        CONTENT_REVISION = revision
 
 # Initialize data structures (will be populated by _init_week3_data)
+CONTENT_REVISION = None  # week_content_cache revision the globals below were loaded at
 QUESTIONS = {}
 SYSTEM_PROMPTS = {}
 WELCOME_MESSAGE = ""
@@ -447,13 +518,16 @@ FINAL_MESSAGES = []
 
 # Initialize data from database after app is ready
 def _ensure_data_loaded():
-    """Ensure Week 3 data is loaded from database."""
-    if not QUESTIONS:  # Check if data is loaded
+    """Ensure Week 3 data is loaded from database, reloading it when the cached content changed."""
+    if not QUESTIONS or not week_content_cache.is_current(3, CONTENT_REVISION):
         try:
             _init_week3_data()
         except Exception as e:
             print(f"Warning: Could not load Week 3 data from database: {e}")
-            print("Falling back to empty dicts - database may not be populated yet")
+            if QUESTIONS:
+                print("Keeping the previously loaded content")
+            else:
+                print("Falling back to empty dicts - database may not be populated yet")
 
 @app.before_request
 def before_request():
@@ -593,6 +667,8 @@ def get_next_message():
 
 
 @app.route('/api/process_response', methods=['POST'])
+@llm_gateway.turn_deadline()
+@session_guard.serialized(conversation_states)
 def process_response():
     """Process a user response to a question."""
     data = request.get_json()
@@ -611,6 +687,9 @@ def process_response():
     if question_number is None or question_number not in QUESTIONS:
         return jsonify({"success": False, "error": "No active question"}), 400
     
+    # call_llm's canned reply and fused validation are for this question
+    g.turn_question = question_number
+    
     # Store user response
     if question_number not in state.answers:
         state.answers[question_number] = []
@@ -633,16 +712,7 @@ def process_response():
             if isinstance(q17_prompts, dict) and "classifier" in q17_prompts:
                 classifier_prompt = q17_prompts["classifier"]
                 
-                classification_response = openai_client.chat.completions.create(
-                    model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-                    messages=[
-                        {"role": "system", "content": "You are a scenario classifier. Respond with only the scenario identifier."},
-                        {"role": "user", "content": f"{classifier_prompt}\n\nUser's response: {user_message}"}
-                    ],
-                    temperature=0.3
-                )
-                
-                state.q17_scenario = classification_response.choices[0].message.content.strip().upper()
+                state.q17_scenario = llm_gateway.classify(classifier_prompt, user_message, temperature=0.3, week=3, question=17)
                 print(f"[DEBUG] Q17 Scenario classification result: {state.q17_scenario}")
         
         # Step 2: Use hardcoded logic based on classification
@@ -830,16 +900,7 @@ def process_response():
             if isinstance(q18_prompts, dict) and "classifier" in q18_prompts:
                 classifier_prompt = q18_prompts["classifier"]
                 
-                classification_response = openai_client.chat.completions.create(
-                    model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-                    messages=[
-                        {"role": "system", "content": "You are a scenario classifier. Respond with only the scenario identifier."},
-                        {"role": "user", "content": f"{classifier_prompt}\n\nUser's response: {user_message}"}
-                    ],
-                    temperature=0.3
-                )
-                
-                state.q18_scenario = classification_response.choices[0].message.content.strip().upper()
+                state.q18_scenario = llm_gateway.classify(classifier_prompt, user_message, temperature=0.3, week=3, question=18)
                 print(f"[DEBUG] Q18 Scenario classification result: {state.q18_scenario}")
         
         # Step 2: Use hardcoded logic based on classification
@@ -946,16 +1007,7 @@ def process_response():
             if isinstance(q19_prompts, dict) and "classifier" in q19_prompts:
                 classifier_prompt = q19_prompts["classifier"]
                 
-                classification_response = openai_client.chat.completions.create(
-                    model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-                    messages=[
-                        {"role": "system", "content": "You are a scenario classifier. Respond with only the scenario identifier."},
-                        {"role": "user", "content": f"{classifier_prompt}\n\nUser's response: {user_message}"}
-                    ],
-                    temperature=0.3
-                )
-                
-                state.q19_scenario = classification_response.choices[0].message.content.strip().upper()
+                state.q19_scenario = llm_gateway.classify(classifier_prompt, user_message, temperature=0.3, week=3, question=19)
                 print(f"[DEBUG] Q19 Scenario classification result: {state.q19_scenario}")
         
         # Step 2: Use hardcoded logic based on classification
@@ -1073,16 +1125,7 @@ def process_response():
             if isinstance(q20_prompts, dict) and "classifier" in q20_prompts:
                 classifier_prompt = q20_prompts["classifier"]
                 
-                classification_response = openai_client.chat.completions.create(
-                    model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-                    messages=[
-                        {"role": "system", "content": "You are a scenario classifier. Respond with only the scenario identifier."},
-                        {"role": "user", "content": f"{classifier_prompt}\n\nUser's response: {user_message}"}
-                    ],
-                    temperature=0.3
-                )
-                
-                state.q20_scenario = classification_response.choices[0].message.content.strip().upper()
+                state.q20_scenario = llm_gateway.classify(classifier_prompt, user_message, temperature=0.3, week=3, question=20)
                 print(f"[DEBUG] Q20 Scenario classification result: {state.q20_scenario}")
         
         # Step 2: Use hardcoded logic based on classification
@@ -1190,16 +1233,7 @@ def process_response():
             if isinstance(q21_prompts, dict) and "classifier" in q21_prompts:
                 classifier_prompt = q21_prompts["classifier"]
                 
-                classification_response = openai_client.chat.completions.create(
-                    model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-                    messages=[
-                        {"role": "system", "content": "You are a scenario classifier. Respond with only the scenario identifier."},
-                        {"role": "user", "content": f"{classifier_prompt}\n\nUser's response: {user_message}"}
-                    ],
-                    temperature=0.3
-                )
-                
-                state.q21_scenario = classification_response.choices[0].message.content.strip().upper()
+                state.q21_scenario = llm_gateway.classify(classifier_prompt, user_message, temperature=0.3, week=3, question=21)
                 print(f"[DEBUG] Q21 Scenario classification result: {state.q21_scenario}")
         
         # Step 2: Use hardcoded logic based on classification
@@ -1314,16 +1348,7 @@ def process_response():
             if isinstance(q22_prompts, dict) and "classifier" in q22_prompts:
                 classifier_prompt = q22_prompts["classifier"]
                 
-                classification_response = openai_client.chat.completions.create(
-                    model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-                    messages=[
-                        {"role": "system", "content": "You are a scenario classifier. Respond with only the scenario identifier."},
-                        {"role": "user", "content": f"{classifier_prompt}\n\nUser's response: {user_message}"}
-                    ],
-                    temperature=0.3
-                )
-                
-                state.q22_scenario = classification_response.choices[0].message.content.strip().upper()
+                state.q22_scenario = llm_gateway.classify(classifier_prompt, user_message, temperature=0.3, week=3, question=22)
                 print(f"[DEBUG] Q22 Scenario classification result: {state.q22_scenario}")
         
         # Step 2: Use hardcoded logic based on classification
@@ -1444,16 +1469,7 @@ def process_response():
             if isinstance(q16_prompts, dict) and "classifier" in q16_prompts:
                 classifier_prompt = q16_prompts["classifier"]
                 
-                classification_response = openai_client.chat.completions.create(
-                    model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-                    messages=[
-                        {"role": "system", "content": "You are a scenario classifier. Respond with only the scenario identifier."},
-                        {"role": "user", "content": f"{classifier_prompt}\n\nUser's response: {user_message}"}
-                    ],
-                    temperature=0.3
-                )
-                
-                state.q16_scenario = classification_response.choices[0].message.content.strip().upper()
+                state.q16_scenario = llm_gateway.classify(classifier_prompt, user_message, temperature=0.3, week=3, question=16)
                 print(f"[DEBUG] Q16 Scenario classification result: {state.q16_scenario}")
         
         # Step 2: Use hardcoded logic based on classification
@@ -1563,6 +1579,12 @@ def process_response():
         })
 
 
+@app.route('/api/process_response/stream', methods=['POST'])
+def process_response_stream():
+    """Same as process_response, but streams NOVA's reply as Server-Sent Events."""
+    return stream_response(process_response, conversation_states)
+
+
 def kill_process_on_port(port):
     """Kill any process running on the specified port."""
     try:
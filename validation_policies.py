@@ -0,0 +1,157 @@
+"""
+Per-Question Validation Policies from the validation_prompts Table
+
+Each week's validate_completeness has its prompts and skip lists in code. A row
+in validation_prompts overrides that for one question, so ops can switch off
+(or re-target) an expensive LLM check without a deploy. validation_type picks
+the policy:
+
+    skip          Always complete - no validation at all
+    local         prompt_text is a validator spec (see completeness_validators):
+                  {"validator": "yes_no"}, {"validator": "numbered_parts", "count": 4}, ...
+                  plus optional "otherwise": "llm" (default), "complete" or "incomplete"
+                  for when the validator isn't confident
+    llm           prompt_text replaces the question's validation prompt
+    llm_after:N   Incomplete without an LLM call until the learner has answered
+                  N times; then the usual LLM validation (prompt_text, if set,
+                  replaces the prompt)
+
+Any other validation_type (e.g. the schema default 'completeness') is treated
+as llm. A policy prompt_text is used even for questions the week's built-in
+checks skip (e.g. week 1 Q9-14); llm/llm_after rows without prompt_text keep
+the built-in prompt, so those questions stay skipped. Policies come from the week content cache, so they are compiled once
+per content load and change when the cache is refreshed or invalidated.
+"""
+
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from completeness_validators import build_validator
+
+Verdict = Tuple[bool, str]
+
+POLICY_MODES = ("skip", "local", "llm", "llm_after")
+
+
+class ValidationPolicy:
+    """A compiled validation_prompts row."""
+
+    __slots__ = ('mode', 'prompt', 'min_responses', 'validator', 'otherwise')
+
+    def __init__(self, mode: str, prompt: Optional[str] = None, min_responses: int = 0,
+                 validator=None, otherwise: str = "llm"):
+        self.mode = mode
+        self.prompt = prompt
+        self.min_responses = min_responses
+        self.validator = validator
+        self.otherwise = otherwise
+
+    def precheck(self, user_responses: List[str]) -> Optional[Verdict]:
+        """Return a verdict that needs no LLM call, or None to continue to LLM validation."""
+        if self.mode == "skip":
+            return True, "None"
+        if self.mode == "llm_after" and len(user_responses) < self.min_responses:
+            return False, "None"  # Keep the conversation going; no "[Note: ...]" for the learner
+        if self.mode == "local":
+            verdict = self.validator(user_responses)
+            if verdict is not None:
+                return verdict
+            if self.otherwise == "complete":
+                return True, "None"
+            if self.otherwise == "incomplete":
+                return False, "None"
+        return None
+
+
+def compile_policy(validation_type: Optional[str], prompt_text: Optional[str]) -> ValidationPolicy:
+    """
+    Compile one validation_prompts row.
+
+    Raises:
+        ValueError: Malformed llm_after count or local validator spec
+    """
+    validation_type = (validation_type or "llm").strip().lower()
+    prompt = (prompt_text or "").strip() or None
+
+    if validation_type == "skip":
+        return ValidationPolicy("skip")
+    if validation_type == "local":
+        spec = json.loads(prompt or "{}")
+        otherwise = spec.get('otherwise', 'llm')
+        if otherwise not in ("llm", "complete", "incomplete"):
+            raise ValueError(f"unknown otherwise {otherwise!r}")
+        return ValidationPolicy("local", validator=build_validator(spec), otherwise=otherwise)
+    if validation_type.startswith("llm_after"):
+        _, _, count = validation_type.partition(":")
+        return ValidationPolicy("llm_after", prompt=prompt, min_responses=int(count))
+    return ValidationPolicy("llm", prompt=prompt)
+
+
+class ValidationPolicySet:
+    """Compiled policies per week, rebuilt whenever the week's cached content changes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # week -> (source dict the policies were compiled from, {question: policy})
+        self._compiled: Dict[int, Tuple[Any, Dict[int, ValidationPolicy]]] = {}
+        self.applied: Dict[str, int] = {}
+
+    def _compile_week(self, week: int, rows: Dict[int, Dict[str, str]]) -> Dict[int, ValidationPolicy]:
+        policies = {}
+        for qnum, row in rows.items():
+            try:
+                policies[int(qnum)] = compile_policy(row.get('validation_type'), row.get('prompt_text'))
+            except (ValueError, TypeError) as e:
+                print(f"[Validation] WARNING: ignoring invalid validation policy for week {week} Q{qnum}: {e}")
+        if policies:
+            print(f"[Validation] Compiled policies for week {week}: "
+                  f"{ {q: p.mode for q, p in sorted(policies.items())} }")
+        return policies
+
+    def _week_rows(self, week: int) -> Optional[Dict[int, Dict[str, str]]]:
+        from flask import has_app_context
+        from database import db_models
+
+        if not has_app_context():
+            return None
+        try:
+            return db_models.get_week_content(week).get('validation_policies')
+        except Exception as e:
+            print(f"[Validation] WARNING: could not load validation policies for week {week}: {e}")
+            return None
+
+    def get(self, week: int, question: int, count: bool = True) -> Optional[ValidationPolicy]:
+        """
+        Return the policy for a question, or None to use the module's built-in validation.
+
+        Args:
+            count: Count the policy as applied (False for lookups that don't decide the turn,
+                e.g. building the prompt for a fused call)
+        """
+        rows = self._week_rows(week)
+        if not rows:
+            return None
+        with self._lock:
+            compiled = self._compiled.get(week)
+            if compiled is None or compiled[0] is not rows:
+                compiled = (rows, self._compile_week(week, rows))
+                self._compiled[week] = compiled
+        policy = compiled[1].get(question)
+        if policy is not None and count:
+            counter = f"week{week}.q{question}.{policy.mode}"
+            with self._lock:
+                self.applied[counter] = self.applied.get(counter, 0) + 1
+        return policy
+
+    def stats(self) -> Dict[str, Any]:
+        """Return how often each policy was applied."""
+        with self._lock:
+            return {
+                'weeks_with_policies': sorted(week for week, (_, policies) in self._compiled.items() if policies),
+                'applied': dict(sorted(self.applied.items())),
+            }
+
+
+# Global instance shared by every week app in the process
+validation_policies = ValidationPolicySet()
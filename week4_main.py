@@ -15,16 +15,28 @@ import os
 import uuid
 import subprocess
 import sys
-from flask import Flask, request, jsonify, session, Response
+from flask import Flask, request, jsonify, session, Response, g, has_request_context
 from flask_cors import CORS
-from openai import OpenAI
 from dotenv import load_dotenv
+
+# Load environment variables before the modules below read their settings at import
+# (the LLM gateway, rate limiter, router, ...) - this module can run on its own
+load_dotenv()
+
 from progress_tracker import progress_tracker
+from conversation_store import ConversationStateMap, create_conversation_store
+from conversation_state import ConversationState as BaseConversationState
+from session_guard import session_guard
+from response_stream import stream_response
+from llm_gateway import llm_gateway
+from classifier_rules import classifier_rules
+from canned_replies import canned_replies
+from validation_policies import validation_policies
+from context_window import context_window
+from completeness_validators import completeness_validators
 from database.db_config import init_db
 from database import db_models
-
-# Load environment variables
-load_dotenv()
+from database.content_cache import week_content_cache
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -34,37 +46,26 @@ CORS(app, supports_credentials=True)
 # Initialize database
 db = init_db(app)
 
-# Initialize OpenAI client
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Collect progress writes made during a request and commit them once at the end
+progress_tracker.init_app(app)
+
+# LLM calls go through the shared gateway (pooled connections, timeouts, retries)
 if not os.getenv("OPENAI_API_KEY"):
     raise ValueError("Please set your OPENAI_API_KEY in the .env file.")
 
-# Global state (in production, use a database or session management)
-conversation_states = {}
 
-
-class ConversationState:
-    """Manages state for a single conversation."""
+class ConversationState(BaseConversationState):
+    """Week 4 conversation state (scenarios live in the per-question records, e.g. state.q1_scenario)."""
+    
+    __slots__ = ()
     
     def __init__(self, name):
-        self.name = name
-        self.current_question = 1  # Start with question 1
-        self.answers = {}  # qnum -> list of user responses
-        self.nova_responses = {}  # qnum -> list of NOVA responses
-        self.iteration_count = {}  # qnum -> iteration count (for 2-iteration loop)
-        self.question_completed = {}  # qnum -> bool (whether question is fully completed)
-        self.q1_scenario = None  # Store Q1 scenario classification
-        self.q2_scenario = None  # Store Q2 scenario classification
-        self.q3_scenario = None  # Store Q3 scenario classification
-        self.q4_scenario = None  # Store Q4 scenario classification
-        self.q5_scenario = None  # Store Q5 scenario classification
-        self.q6_scenario = None  # Store Q6 scenario classification
-        self.q7_scenario = None  # Store Q7 scenario classification
-        self.q7_scenario = None  # Store Q7 scenario classification
-    
-    def get_iteration(self, qnum):
-        """Get current iteration count for a question."""
-        return self.iteration_count.get(qnum, 0)
+        super().__init__(name, first_question=1)
+
+
+# Conversation states per session, kept in the store selected by CONVERSATION_BACKEND
+conversation_states = ConversationStateMap(create_conversation_store(4, ConversationState))
+conversation_states.init_app(app)
 
 
 def get_or_create_state(name=None):
@@ -89,23 +90,54 @@ def save_question_progress(question_number: int, week_number: int = 4):
         progress_tracker.update_user_progress(session_id, week_number, question_number, completed=True)
 
 
+def _turn_question(state):
+    """The question the current process_response turn is handling (else the state's current question)."""
+    if has_request_context() and 'turn_question' in g:
+        return g.turn_question
+    return state.current_question
+
+
+def _fused_validation_plan(question_number):
+    """
+    With LLM_FUSED_VALIDATION on, return (validation_prompt, question, user_responses)
+    for the current process_response turn so call_llm can get the completeness
+    verdict in the same call. Returns None when validation doesn't need the LLM.
+    """
+    if not llm_gateway.fused_validation or not has_request_context() or request.endpoint != 'process_response':
+        return None
+    
+    state = get_or_create_state()
+    user_responses = state.answers.get(question_number, [])
+    validation_prompt = validate_completeness(
+        question_number,
+        "",
+        user_responses,
+        [],
+        prompt_only=True
+    )
+    if not isinstance(validation_prompt, str):
+        return None
+    return validation_prompt, f"Question {question_number}: {QUESTIONS.get(question_number, '')}", user_responses
+
+
 def call_llm(system_prompt, user_message):
     """Call OpenAI API with system prompt and user message."""
     try:
         # Format system prompt with name if needed
+        state = get_or_create_state()
         if "{name}" in system_prompt:
-            state = get_or_create_state()
             system_prompt = system_prompt.replace("{name}", state.name)
         
-        response = openai_client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ],
-            temperature=0.7
-        )
-        return response.choices[0].message.content.strip()
+        # Served instead if the LLM is unavailable (see canned_replies)
+        question_number = _turn_question(state)
+        scenario = state.scenarios[question_number] if question_number in state.scenarios else None
+        canned = canned_replies.reply(4, question_number, scenario, state.name)
+        
+        validation_plan = _fused_validation_plan(question_number)
+        if validation_plan:
+            return llm_gateway.respond_and_validate(system_prompt, user_message, *validation_plan, canned=canned,
+                                                    week=4, question_number=question_number)
+        return llm_gateway.respond(system_prompt, user_message, canned=canned, week=4, question=question_number)
     except Exception as e:
         # Log the full error for debugging
         import traceback
@@ -119,17 +151,26 @@ def call_llm(system_prompt, user_message):
         return f"I apologize, but I encountered an error processing your response. Please try again. Error: {str(e)}"
 
 
-def validate_completeness(question_number, nova_response, user_responses, conversation_history):
+def validate_completeness(question_number, nova_response, user_responses, conversation_history, prompt_only=False):
     """
     Use LLM to validate if user has provided all required information.
     Returns (is_complete: bool, missing_items: str)
+    prompt_only: Return the validation prompt instead of calling the LLM (used for fused calls)
     """
+    # A validation_prompts row overrides the built-in checks below (see validation_policies)
+    policy = validation_policies.get(4, question_number, count=not prompt_only)
+    policy_verdict = policy.precheck(user_responses) if policy is not None else None
+    if policy_verdict is not None:
+        return policy_verdict
+    
     # Build context of what was requested
     context = f"Question {question_number}: {QUESTIONS.get(question_number, '')}\n\n"
     context += f"NOVA's latest response: {nova_response}\n\n"
     context += f"User's responses so far: {len(user_responses)} response(s)\n"
-    for i, resp in enumerate(user_responses, 1):
-        context += f"  Response {i}: {resp[:200]}...\n"
+
+    # A policy prompt replaces the built-in checks below, including the questions they skip
+    if policy is not None and policy.prompt:
+        return _validate_with_prompt(question_number, policy.prompt, context, user_responses, prompt_only)
 
     # Generic validation for Week 4 questions
     validation_prompt = f"""You are validating if a user has provided a meaningful response to the question.
@@ -147,34 +188,32 @@ Example responses:
 - If user provided meaningful response: "COMPLETE: Yes\nMISSING: None"
 - If no meaningful response provided: "COMPLETE: No\nMISSING: A meaningful response to the question"
 """
+
+    return _validate_with_prompt(question_number, validation_prompt, context, user_responses, prompt_only)
+
+
+def _validate_with_prompt(question_number, validation_prompt, context, user_responses, prompt_only=False):
+    """Finish validate_completeness for an LLM validation prompt: local validators, a fused verdict, or the LLM."""
+    # Structural checks that don't need the LLM (see completeness_validators)
+    local_verdict = completeness_validators.validate(4, question_number, user_responses, count=not prompt_only)
+    if local_verdict is not None:
+        return local_verdict
+    
+    if prompt_only:
+        return validation_prompt
+    
+    # A fused respond-and-validate call may already have judged this turn
+    fused_verdict = llm_gateway.take_verdict(validation_prompt)
+    if fused_verdict is not None:
+        return fused_verdict
+    
+    # Only now that the LLM is called: recent responses verbatim, older ones summarized,
+    # within the validation token budget
+    context += context_window.responses_section(user_responses, "validate", 4, question_number)
     
     try:
-        validation_response = openai_client.chat.completions.create(
-            model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-            messages=[
-                {"role": "system", "content": validation_prompt},
-                {"role": "user", "content": context}
-            ],
-            temperature=0.3
-        )
-        
-        validation_text = validation_response.choices[0].message.content.strip()
-        
-        # Parse the response
-        is_complete = False
-        missing_items = "Unknown"
-        
-        if "COMPLETE: Yes" in validation_text or "COMPLETE:YES" in validation_text.upper():
-            is_complete = True
-        elif "COMPLETE: No" in validation_text or "COMPLETE:NO" in validation_text.upper():
-            is_complete = False
-        
-        # Extract missing items
-        if "MISSING:" in validation_text:
-            missing_match = validation_text.split("MISSING:")[-1].strip()
-            missing_items = missing_match if missing_match else "Unknown"
-        
-        return is_complete, missing_items
+        judgement = llm_gateway.judge_completeness(validation_prompt, context, week=4, question=question_number)
+        return judgement.complete, judgement.missing_text
         
     except Exception as e:
         print(f"Validation error: {e}")
@@ -190,10 +229,12 @@ NO_FOLLOWUPS_INSTRUCTION = (
 # Load all data from database to maintain same interface as hardcoded constants
 
 def _init_week4_data():
-    """Initialize Week 4 data from database. Called after app is created."""
-    global QUESTIONS, SYSTEM_PROMPTS, WELCOME_MESSAGE, FINAL_RESPONSE
+    """Initialize Week 4 data from database. Called after app is created (and again when it changes)."""
+    global QUESTIONS, SYSTEM_PROMPTS, WELCOME_MESSAGE, FINAL_RESPONSE, CONTENT_REVISION
     global WEEK4_VIDEOS_EXERCISES, WEEK4_EXERCISE1, WEEK4_EXERCISE2
     
+    # Read before loading, so a change that lands mid-load triggers another reload
+    revision = week_content_cache.revision(4)
     with app.app_context():
         week_content = db_models.get_week_content(4, app)
         
@@ -202,6 +243,8 @@ def _init_week4_data():
         
         # Load system prompts dict
         SYSTEM_PROMPTS = week_content['system_prompts']
+        classifier_rules.load_week(4, SYSTEM_PROMPTS)
+        canned_replies.load_week(4, SYSTEM_PROMPTS)
         
         # Load welcome message and final response
         WELCOME_MESSAGE = week_content.get('welcome_message', '')
@@ -212,8 +255,10 @@ def _init_week4_data():
         WEEK4_VIDEOS_EXERCISES = content_blocks.get('WEEK4_VIDEOS_EXERCISES', '')
         WEEK4_EXERCISE1 = content_blocks.get('WEEK4_EXERCISE1', '')
         WEEK4_EXERCISE2 = content_blocks.get('WEEK4_EXERCISE2', '')
+        CONTENT_REVISION = revision
 
 # Initialize data structures (will be populated by _init_week4_data)
+CONTENT_REVISION = None  # week_content_cache revision the globals below were loaded at
 QUESTIONS = {}
 SYSTEM_PROMPTS = {}
 WELCOME_MESSAGE = ""
@@ -224,13 +269,16 @@ WEEK4_EXERCISE2 = ""
 
 # Initialize data from database after app is ready
 def _ensure_data_loaded():
-    """Ensure Week 4 data is loaded from database."""
-    if not QUESTIONS:  # Check if data is loaded
+    """Ensure Week 4 data is loaded from database, reloading it when the cached content changed."""
+    if not QUESTIONS or not week_content_cache.is_current(4, CONTENT_REVISION):
         try:
             _init_week4_data()
         except Exception as e:
             print(f"Warning: Could not load Week 4 data from database: {e}")
-            print("Falling back to empty dicts - database may not be populated yet")
+            if QUESTIONS:
+                print("Keeping the previously loaded content")
+            else:
+                print("Falling back to empty dicts - database may not be populated yet")
 
 @app.before_request
 def before_request():
@@ -260,14 +308,18 @@ def get_progress_status():
     if not session_id:
         return jsonify({"success": False, "error": "No session found"}), 400
     
-    weeks_status = progress_tracker.get_all_weeks_status(session_id)
-    current_week = progress_tracker.get_current_week(session_id)
+    # One read of the user's record; clients send the ETag back in If-None-Match
+    snapshot = progress_tracker.get_status_snapshot(session_id)
     
-    return jsonify({
+    response = jsonify({
         "success": True,
-        "current_week": current_week,
-        "weeks": weeks_status
+        "current_week": snapshot["current_week"],
+        "weeks": snapshot["weeks"],
+        "etag": snapshot["etag"]
     })
+    response.set_etag(snapshot["etag"])
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
 
 @app.route('/api/progress/week/<int:week_number>', methods=['GET'])
@@ -390,6 +442,8 @@ def get_next_message():
 
 
 @app.route('/api/process_response', methods=['POST'])
+@llm_gateway.turn_deadline()
+@session_guard.serialized(conversation_states)
 def process_response():
     """Process a user response to a question."""
     data = request.get_json()
@@ -408,6 +462,9 @@ def process_response():
     if question_number is None or question_number not in QUESTIONS:
         return jsonify({"success": False, "error": "No active question"}), 400
     
+    # call_llm's canned reply and fused validation are for this question
+    g.turn_question = question_number
+    
     # Store user response
     if question_number not in state.answers:
         state.answers[question_number] = []
@@ -430,48 +487,14 @@ def process_response():
         if not hasattr(state, scenario_attr) or getattr(state, scenario_attr) is None:
             classifier_prompt = q_prompts["classifier"]
             
-            classification_response = openai_client.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
-                messages=[
-                    {"role": "system", "content": "You are a scenario classifier. Respond with only the scenario identifier."},
-                    {"role": "user", "content": f"{classifier_prompt}\n\nUser's response: {user_message}"}
-                ],
-                temperature=0.1
-            )
-            
-            scenario = classification_response.choices[0].message.content.strip().upper()
+            scenario = llm_gateway.classify(classifier_prompt, user_message, week=4, question=question_number)
             setattr(state, scenario_attr, scenario)
             print(f"[DEBUG] Q{question_number} scenario classification: {scenario}")
         
         scenario = getattr(state, scenario_attr)
         
-        # Get the appropriate response prompt based on scenario
-        # Extract scenario number (e.g., "SCENARIO_1" -> "1")
-        scenario_num = scenario.split('_')[1] if '_' in scenario else scenario.replace('SCENARIO', '').strip()
-        scenario_key = f"scenario_{scenario_num.lower()}_respond"
-        
-        # Handle special cases for Q6 and Q7 (which have SCENARIO_4 and SCENARIO_5)
-        if question_number == 6:
-            if "SCENARIO_1" in scenario:
-                scenario_key = "scenario_1_respond"
-            elif "SCENARIO_2" in scenario:
-                scenario_key = "scenario_2_respond"
-            elif "SCENARIO_3" in scenario:
-                scenario_key = "scenario_3_respond"
-            elif "SCENARIO_4" in scenario:
-                scenario_key = "scenario_4_respond"
-        elif question_number == 7:
-            if "SCENARIO_1" in scenario:
-                scenario_key = "scenario_1_respond"
-            elif "SCENARIO_2" in scenario:
-                scenario_key = "scenario_2_respond"
-            elif "SCENARIO_3" in scenario:
-                scenario_key = "scenario_3_respond"
-            elif "SCENARIO_4" in scenario:
-                scenario_key = "scenario_4_respond"
-            elif "SCENARIO_5" in scenario:
-                scenario_key = "scenario_5_respond"
-        
+        # classify() returns one of the classifier prompt's identifiers, e.g. "SCENARIO_1" -> "scenario_1_respond"
+        scenario_key = f"{scenario.lower()}_respond"
         system_prompt = q_prompts.get(scenario_key, "")
         if not system_prompt:
             # Fallback to first available scenario
@@ -638,6 +661,12 @@ def process_response():
     })
 
 
+@app.route('/api/process_response/stream', methods=['POST'])
+def process_response_stream():
+    """Same as process_response, but streams NOVA's reply as Server-Sent Events."""
+    return stream_response(process_response, conversation_states)
+
+
 def kill_process_on_port(port):
     """Kill any process running on the specified port."""
     try: